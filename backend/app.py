@@ -1,12 +1,47 @@
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 from flask_socketio import SocketIO
-import openai
 from openai import RateLimitError
 import os
+import hashlib
 import json
+import queue
+import threading
+import time
 from card_generator import CardGenerator
+from card_schema import (
+    CONCEPT_REQUIRED_FIELDS,
+    CONCEPT_SCHEMA,
+    decode_json_object,
+    response_format_for,
+)
+from async_card_generator import AsyncCardGenerator, SyncCardGenerator
+from batch_sizing import get_batch_size_controller
+from deadline import (
+    CONCEPT_DEADLINE_SECONDS,
+    SET_DEADLINE_SECONDS,
+    Deadline,
+    DeadlineExceeded,
+)
+from generation_job import GenerationJob
+from offline_batch import OFFLINE_DEADLINE_SECONDS, get_offline_job_store
+from governor import (
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_STREAMING,
+    get_concurrency_governor,
+)
+from hedging import get_batch_latency_tracker
+from key_pool import get_api_key_pool
+from model_router import get_model_router
+from model_tiers import get_model_tier_policy
+from openai_clients import fingerprint_api_key, get_client_registry
 from set_skeleton import SetSkeleton
+from micro_batcher import MicroBatcher
+from prompt_templates import check_static_prefixes, get_prompt_cache_stats
+from retry_policy import RetryPolicy
+from singleflight import SingleFlight
+from token_budget import get_token_budget_planner, warm_up_encodings
 from export_utils import SetExporter
 
 app = Flask(__name__)
@@ -28,15 +63,12 @@ print("INFO: Application configured to require user-provided OpenAI API keys")
 # Initialize OpenAI client (will be set per request)
 # openai.api_key will be set dynamically per request
 
-# Define model fallback chain for set concept generation
-MODEL_FALLBACK_CHAIN = [
-    "gpt-4o-mini",  # Cheapest and fastest
-    "gpt-4o",  # More capable
-    "gpt-4-turbo",  # Fallback
-    "gpt-4",  # Last resort
-    "gpt-3.5-turbo",  # Final fallback
-]
-current_model_index = 0
+# Model fallback state for set concept generation is tracked per API key
+model_router = get_model_router()
+# Optional server-side keys used by requests that don't bring their own
+api_key_pool = get_api_key_pool()
+if api_key_pool:
+    print(f"INFO: Requests without an API key use the pool of {len(api_key_pool)} keys")
 
 
 def _is_insufficient_quota_error(error):
@@ -50,16 +82,37 @@ def _is_insufficient_quota_error(error):
     )
 
 
-def _make_api_request_with_fallback(messages, temperature=0.8, api_key=None):
-    """Make an API request with automatic model fallback on quota errors"""
-    global current_model_index
+def _make_api_request_with_fallback(
+    messages, temperature=0.8, api_key=None, response_schema=None, deadline=None
+):
+    """Make an API request with automatic model fallback on quota errors.
 
-    # API key is required - no fallback
-    if not api_key:
+    Each attempt's timeout, retry backoff and governor wait come out of
+    the deadline's remaining budget.
+    """
+    deadline = deadline or Deadline()
+    # Without a key of its own the request draws keys from the server pool
+    pooled = not api_key and bool(api_key_pool)
+    if not api_key and not pooled:
         raise ValueError("OpenAI API key is required")
 
-    while current_model_index < len(MODEL_FALLBACK_CHAIN):
-        current_model = MODEL_FALLBACK_CHAIN[current_model_index]
+    tried_models = set()
+    last_error = None
+    while True:
+        if pooled:
+            api_key = api_key_pool.choose()
+            if api_key is None and last_error is not None:
+                raise last_error
+            if api_key is None:
+                raise Exception("Every key in the API key pool is out of quota")
+        current_model = model_router.select_model(api_key, exclude=tried_models)
+        if current_model is None:
+            # If we get here, all models have been exhausted
+            raise Exception("All models in fallback chain have exceeded quota")
+        if not model_router.begin_call(current_model):
+            # Circuit opened since the model was picked, try the next one
+            tried_models.add(current_model)
+            continue
         try:
             # Log the API key being used (first 10 chars for security)
             print(
@@ -69,52 +122,178 @@ def _make_api_request_with_fallback(messages, temperature=0.8, api_key=None):
             )
             print(f"Making set concept API request with model: {current_model}")
 
-            # Create a new client instance with the provided API key
-            client = openai.OpenAI(api_key=api_key)
-            response = client.chat.completions.create(
-                model=current_model,
-                messages=messages,
-                temperature=temperature,
-            )
-            return response
+            # Reuse the pooled client for the provided API key; transient
+            # failures are retried below within the deadline
+            client = get_client_registry().get_client(api_key)
+            options = {}
+            if response_schema is not None:
+                response_format = response_format_for(current_model, *response_schema)
+                if response_format is not None:
+                    options["response_format"] = response_format
+
+            def attempt():
+                # The user is waiting on the concept before anything else can start
+                with get_concurrency_governor().slot(
+                    api_key, PRIORITY_INTERACTIVE, deadline.remaining()
+                ):
+                    started = time.monotonic()
+                    response = client.chat.completions.create(
+                        model=current_model,
+                        messages=messages,
+                        temperature=temperature,
+                        timeout=deadline.call_timeout(),
+                        **options,
+                    )
+                model_router.record_success(
+                    current_model,
+                    time.monotonic() - started,
+                    completion_tokens=getattr(
+                        getattr(response, "usage", None), "completion_tokens", None
+                    ),
+                )
+                return response
+
+            return RetryPolicy().call(attempt, "set concept", deadline=deadline)
 
         except RateLimitError as e:
-            if _is_insufficient_quota_error(e):
+            if _is_insufficient_quota_error(e) and pooled:
+                # Take the spent key out of rotation and retry on another one
+                api_key_pool.mark_quota_exhausted(api_key)
+                last_error = e
+            elif _is_insufficient_quota_error(e):
                 print(f"Quota exceeded for model {current_model}: {str(e)}")
-                if current_model_index < len(MODEL_FALLBACK_CHAIN) - 1:
-                    current_model_index += 1
-                    print(
-                        f"Switching to fallback model: {MODEL_FALLBACK_CHAIN[current_model_index]}"
-                    )
-                else:
+                model_router.mark_quota_exhausted(api_key, current_model)
+                tried_models.add(current_model)
+                if len(tried_models) >= len(model_router.models):
                     print("All models exhausted for set concept generation")
                     raise e
             else:
                 raise e
+        except DeadlineExceeded:
+            raise
         except Exception as e:
+            if deadline.expired():
+                # Cut off by the request's deadline, not a fault of the model
+                raise DeadlineExceeded(
+                    f"Deadline of {deadline.seconds:.0f}s exceeded during the set concept call"
+                ) from e
             # For non-quota errors, just re-raise immediately
+            model_router.record_failure(current_model, error=e)
             raise e
-
-    # If we get here, all models have been exhausted
-    raise Exception("All models in fallback chain have exceeded quota")
+        finally:
+            model_router.end_call(current_model)
 
 
 # Initialize components
 set_skeleton = SetSkeleton()
 set_exporter = SetExporter()
+# In-flight single-card generations, shared by identical concurrent requests
+card_requests_in_flight = SingleFlight()
+# Single-card requests arriving together are generated in one batch call
+card_micro_batcher = MicroBatcher(lambda: get_card_generator())
 
 # Initialize card generator with socketio after socketio is created
 card_generator = None
 
+# Seconds between SSE keep-alive comments while no card has arrived
+SSE_HEARTBEAT_SECONDS = 15
+
+# Run generation on the asyncio engine instead of one thread per LLM call
+USE_ASYNC_ENGINE = os.getenv("MTG_ASYNC_ENGINE", "").lower() in ("1", "true", "yes")
+
+
+def _create_card_generator():
+    """Create the card generator for the configured engine"""
+    if USE_ASYNC_ENGINE:
+        print("INFO: Using asyncio card generation engine")
+        return SyncCardGenerator(AsyncCardGenerator(socketio))
+    return CardGenerator(socketio)
+
 
 def get_card_generator():
     """Get the card generator, initializing it if needed"""
     global card_generator
     if card_generator is None:
-        card_generator = CardGenerator(socketio)
+        card_generator = _create_card_generator()
     return card_generator
 
 
+def _get_max_concurrency(data):
+    """Read the per-request batch concurrency from the request body"""
+    if data.get("use_parallel") is False:
+        return 1
+    max_concurrency = data.get("max_concurrency")
+    try:
+        return max(1, int(max_concurrency)) if max_concurrency else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _request_deadline(data, default_seconds=SET_DEADLINE_SECONDS):
+    """Deadline for a generation request, from deadline_seconds in the body"""
+    try:
+        seconds = float(data.get("deadline_seconds") or default_seconds)
+    except (TypeError, ValueError):
+        seconds = default_seconds
+    return Deadline(seconds)
+
+
+def _start_offline_set(theme, skeleton, api_key, data):
+    """Generate a set through the Batch API in the background.
+
+    Returns a 202 response with the job id right away; the set is fetched
+    from /api/offline-jobs/<job_id> and its cards are emitted over
+    Socket.IO as each round lands.
+    """
+    job = GenerationJob(
+        priority=PRIORITY_BULK,
+        deadline=_request_deadline(data, OFFLINE_DEADLINE_SECONDS),
+    )
+    store = get_offline_job_store()
+    job_id = store.create(theme, job)
+
+    def run_offline():
+        try:
+            complete_set = get_card_generator().generate_complete_set(
+                theme, skeleton, api_key, job=job, offline=True
+            )
+            store.finish(job_id, complete_set)
+            print(f"Offline set {job_id} for theme '{theme}' completed")
+            socketio.emit(
+                "offline_set_completed",
+                {"job_id": job_id, "theme": theme, "generation": job.to_dict()},
+            )
+        except Exception as e:
+            print(f"Offline set {job_id} failed: {str(e)}")
+            store.finish(job_id, error=e)
+            socketio.emit(
+                "offline_set_failed",
+                {"job_id": job_id, "theme": theme, "error": str(e)},
+            )
+
+    threading.Thread(target=run_offline, name="offline-set", daemon=True).start()
+    return (
+        jsonify(
+            {
+                "success": True,
+                "job_id": job_id,
+                "status": "running",
+                "status_url": f"/api/offline-jobs/{job_id}",
+            }
+        ),
+        202,
+    )
+
+
+@app.route("/api/offline-jobs/<job_id>", methods=["GET"])
+def get_offline_job(job_id):
+    """Status of an offline set, with the set once it has completed"""
+    status = get_offline_job_store().get(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown offline job"}), 404
+    return jsonify(status)
+
+
 @app.route("/api/skeleton", methods=["GET"])
 def get_skeleton():
     """Return the complete set skeleton structure"""
@@ -135,6 +314,14 @@ def get_commons_skeleton():
         return jsonify({"error": str(e)}), 500
 
 
+def _card_request_key(api_key, theme, color, rarity, slot_id, slot_data):
+    """Singleflight key identifying a single-card request"""
+    slot_hash = hashlib.sha256(
+        json.dumps(slot_data, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    return (fingerprint_api_key(api_key), theme, color, rarity, slot_id, slot_hash)
+
+
 @app.route("/api/generate-card", methods=["POST"])
 def generate_card():
     """Generate a single card for a specific slot"""
@@ -153,7 +340,7 @@ def generate_card():
                 400,
             )
 
-        if not api_key:
+        if not api_key and not api_key_pool:
             return (
                 jsonify({"error": "OpenAI API key is required"}),
                 400,
@@ -171,26 +358,53 @@ def generate_card():
             )
             slot_data = {"description": str(slot_data) if slot_data else "Generic slot"}
 
-        # Generate card using the enhanced card generator
-        print("API: Starting card generation process...")
-        card = get_card_generator().generate_skeleton_card(
-            theme, color, rarity, slot_id, slot_data, api_key
-        )
-
-        print(f"API: Successfully generated card: {card.get('name', 'Unknown')}")
-        if card.get("error"):
-            print(f"API: Warning: Card generated with error: {card.get('error')}")
-
-        # Emit card via WebSocket if connected
-        if socketio:
-            socketio.emit(
-                "card_generated",
-                {"color": color, "rarity": rarity, "slot_id": slot_id, "card": card},
+        def generate():
+            # Generate card using the enhanced card generator
+            print("API: Starting card generation process...")
+            card, job, batch_size = card_micro_batcher.generate_card(
+                theme, color, rarity, slot_id, slot_data, api_key
             )
-            print(f"WebSocket: Emitted card {card.get('name', 'Unknown')} to frontend")
+            if batch_size > 1:
+                print(f"API: Card {slot_id} shared a batch of {batch_size} requests")
+
+            print(f"API: Successfully generated card: {card.get('name', 'Unknown')}")
+            if card.get("error"):
+                print(f"API: Warning: Card generated with error: {card.get('error')}")
 
-        return jsonify({"success": True, "card": card})
+            # Emit card via WebSocket if connected
+            if socketio:
+                socketio.emit(
+                    "card_generated",
+                    {
+                        "color": color,
+                        "rarity": rarity,
+                        "slot_id": slot_id,
+                        "card": card,
+                    },
+                )
+                print(
+                    f"WebSocket: Emitted card {card.get('name', 'Unknown')} to frontend"
+                )
+            return card, dict(job.to_dict(), micro_batch_size=batch_size)
+
+        # Duplicate requests for the same slot share one LLM call and one emit
+        key = _card_request_key(api_key, theme, color, rarity, slot_id, slot_data)
+        (card, generation), coalesced = card_requests_in_flight.do(key, generate)
+        if coalesced:
+            print(f"API: Shared in-flight generation for slot {slot_id}")
+
+        return jsonify(
+            {
+                "success": True,
+                "card": card,
+                "generation": generation,
+                "coalesced": coalesced,
+            }
+        )
 
+    except DeadlineExceeded as e:
+        print(f"API: Card generation ran out of time: {str(e)}")
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         print(f"API: Error generating single card: {str(e)}")
         import traceback
@@ -211,20 +425,39 @@ def generate_full_set():
         if not theme:
             return jsonify({"error": "Theme is required"}), 400
 
-        if not api_key:
+        if not api_key and not api_key_pool:
             return jsonify({"error": "OpenAI API key is required"}), 400
 
-        print(f"Generating full set for theme: {theme} (parallel: {use_parallel})")
+        offline = bool(data.get("offline", False))
+        print(
+            f"Generating full set for theme: {theme} (parallel: {use_parallel}, offline: {offline})"
+        )
+
+        if offline:
+            # The Batch API can take hours; answer with a job id instead
+            return _start_offline_set(theme, set_skeleton, api_key, data)
 
         # Generate complete set using batch processing
+        job = GenerationJob(priority=PRIORITY_BULK, deadline=_request_deadline(data))
         complete_set = get_card_generator().generate_complete_set(
-            theme, set_skeleton, api_key
+            theme,
+            set_skeleton,
+            api_key,
+            max_concurrency=_get_max_concurrency(data),
+            job=job,
         )
 
         print(
             f"Successfully generated {len(complete_set)} color sections using batch processing"
         )
-        return jsonify({"success": True, "set": complete_set, "theme": theme})
+        return jsonify(
+            {
+                "success": True,
+                "set": complete_set,
+                "theme": theme,
+                "generation": job.to_dict(),
+            }
+        )
 
     except Exception as e:
         print(f"Error generating full set: {str(e)}")
@@ -246,24 +479,43 @@ def generate_commons_only():
         if not theme:
             return jsonify({"error": "Theme is required"}), 400
 
-        if not api_key:
+        if not api_key and not api_key_pool:
             return jsonify({"error": "OpenAI API key is required"}), 400
 
-        print(f"Generating commons only for theme: {theme} (parallel: {use_parallel})")
+        offline = bool(data.get("offline", False))
+        print(
+            f"Generating commons only for theme: {theme} (parallel: {use_parallel}, offline: {offline})"
+        )
 
         # Get commons skeleton and generate cards
         commons_skeleton_data = set_skeleton.get_commons_only()
         print(f"Commons skeleton has {len(commons_skeleton_data)} colors")
 
+        if offline:
+            # The Batch API can take hours; answer with a job id instead
+            return _start_offline_set(theme, commons_skeleton_data, api_key, data)
+
         # Generate commons using batch processing
+        job = GenerationJob(priority=PRIORITY_BULK, deadline=_request_deadline(data))
         commons_set = get_card_generator().generate_complete_set(
-            theme, commons_skeleton_data, api_key
+            theme,
+            commons_skeleton_data,
+            api_key,
+            max_concurrency=_get_max_concurrency(data),
+            job=job,
         )
 
         print(
             f"Successfully generated commons set with {len(commons_set)} color sections using batch processing"
         )
-        return jsonify({"success": True, "set": commons_set, "theme": theme})
+        return jsonify(
+            {
+                "success": True,
+                "set": commons_set,
+                "theme": theme,
+                "generation": job.to_dict(),
+            }
+        )
 
     except Exception as e:
         print(f"Error generating commons set: {str(e)}")
@@ -322,7 +574,7 @@ def generate_set():
         if not theme:
             return jsonify({"error": "Theme is required"}), 400
 
-        if not api_key:
+        if not api_key and not api_key_pool:
             return jsonify({"error": "OpenAI API key is required"}), 400
 
         # Generate commons based on design skeleton
@@ -345,18 +597,30 @@ def generate_full_set_ultra_fast():
         if not theme:
             return jsonify({"error": "Theme is required"}), 400
 
-        if not api_key:
+        if not api_key and not api_key_pool:
             return jsonify({"error": "OpenAI API key is required"}), 400
 
         print(f"Generating full set ULTRA FAST for theme: {theme}")
 
         # Use the large batch processing for maximum speed
+        job = GenerationJob(priority=PRIORITY_BULK, deadline=_request_deadline(data))
         complete_set = get_card_generator().generate_complete_set_large_batches(
-            theme, set_skeleton, api_key
+            theme,
+            set_skeleton,
+            api_key,
+            max_concurrency=_get_max_concurrency(data),
+            job=job,
         )
 
         print(f"Successfully generated {len(complete_set)} color sections ULTRA FAST")
-        return jsonify({"success": True, "set": complete_set, "theme": theme})
+        return jsonify(
+            {
+                "success": True,
+                "set": complete_set,
+                "theme": theme,
+                "generation": job.to_dict(),
+            }
+        )
 
     except Exception as e:
         print(f"Error generating full set ultra fast: {str(e)}")
@@ -377,7 +641,7 @@ def generate_commons_only_ultra_fast():
         if not theme:
             return jsonify({"error": "Theme is required"}), 400
 
-        if not api_key:
+        if not api_key and not api_key_pool:
             return jsonify({"error": "OpenAI API key is required"}), 400
 
         print(f"Generating commons only ULTRA FAST for theme: {theme}")
@@ -386,14 +650,26 @@ def generate_commons_only_ultra_fast():
         commons_skeleton_data = set_skeleton.get_commons_only()
         print(f"Commons skeleton has {len(commons_skeleton_data)} colors")
 
+        job = GenerationJob(priority=PRIORITY_BULK, deadline=_request_deadline(data))
         commons_set = get_card_generator().generate_complete_set_large_batches(
-            theme, commons_skeleton_data, api_key
+            theme,
+            commons_skeleton_data,
+            api_key,
+            max_concurrency=_get_max_concurrency(data),
+            job=job,
         )
 
         print(
             f"Successfully generated commons set ULTRA FAST with {len(commons_set)} color sections"
         )
-        return jsonify({"success": True, "set": commons_set, "theme": theme})
+        return jsonify(
+            {
+                "success": True,
+                "set": commons_set,
+                "theme": theme,
+                "generation": job.to_dict(),
+            }
+        )
 
     except Exception as e:
         print(f"Error generating commons set ultra fast: {str(e)}")
@@ -414,20 +690,32 @@ def generate_full_set_large_batches():
         if not theme:
             return jsonify({"error": "Theme is required"}), 400
 
-        if not api_key:
+        if not api_key and not api_key_pool:
             return jsonify({"error": "OpenAI API key is required"}), 400
 
         print(f"Generating full set with LARGE BATCHES for theme: {theme}")
 
         # Generate complete set using large batch processing
+        job = GenerationJob(priority=PRIORITY_BULK, deadline=_request_deadline(data))
         complete_set = get_card_generator().generate_complete_set_large_batches(
-            theme, set_skeleton, api_key
+            theme,
+            set_skeleton,
+            api_key,
+            max_concurrency=_get_max_concurrency(data),
+            job=job,
         )
 
         print(
             f"Successfully generated {len(complete_set)} color sections with LARGE BATCHES"
         )
-        return jsonify({"success": True, "set": complete_set, "theme": theme})
+        return jsonify(
+            {
+                "success": True,
+                "set": complete_set,
+                "theme": theme,
+                "generation": job.to_dict(),
+            }
+        )
 
     except Exception as e:
         print(f"Error generating full set with large batches: {str(e)}")
@@ -448,7 +736,7 @@ def generate_commons_only_large_batches():
         if not theme:
             return jsonify({"error": "Theme is required"}), 400
 
-        if not api_key:
+        if not api_key and not api_key_pool:
             return jsonify({"error": "OpenAI API key is required"}), 400
 
         print(f"Generating commons only with LARGE BATCHES for theme: {theme}")
@@ -457,14 +745,26 @@ def generate_commons_only_large_batches():
         commons_skeleton_data = set_skeleton.get_commons_only()
         print(f"Commons skeleton has {len(commons_skeleton_data)} colors")
 
+        job = GenerationJob(priority=PRIORITY_BULK, deadline=_request_deadline(data))
         commons_set = get_card_generator().generate_complete_set_large_batches(
-            theme, commons_skeleton_data, api_key
+            theme,
+            commons_skeleton_data,
+            api_key,
+            max_concurrency=_get_max_concurrency(data),
+            job=job,
         )
 
         print(
             f"Successfully generated commons set with LARGE BATCHES with {len(commons_set)} color sections"
         )
-        return jsonify({"success": True, "set": commons_set, "theme": theme})
+        return jsonify(
+            {
+                "success": True,
+                "set": commons_set,
+                "theme": theme,
+                "generation": job.to_dict(),
+            }
+        )
 
     except Exception as e:
         print(f"Error generating commons set with large batches: {str(e)}")
@@ -485,20 +785,32 @@ def generate_full_set_batched_50():
         if not theme:
             return jsonify({"error": "Theme is required"}), 400
 
-        if not api_key:
+        if not api_key and not api_key_pool:
             return jsonify({"error": "OpenAI API key is required"}), 400
 
         print(f"Generating full set in large batches for theme: {theme}")
 
         # Generate complete set using large batch processing
+        job = GenerationJob(priority=PRIORITY_BULK, deadline=_request_deadline(data))
         complete_set = get_card_generator().generate_complete_set_large_batches(
-            theme, set_skeleton, api_key
+            theme,
+            set_skeleton,
+            api_key,
+            max_concurrency=_get_max_concurrency(data),
+            job=job,
         )
 
         print(
             f"Successfully generated {len(complete_set)} color sections in large batches"
         )
-        return jsonify({"success": True, "set": complete_set, "theme": theme})
+        return jsonify(
+            {
+                "success": True,
+                "set": complete_set,
+                "theme": theme,
+                "generation": job.to_dict(),
+            }
+        )
 
     except Exception as e:
         print(f"Error generating full set in large batches: {str(e)}")
@@ -519,7 +831,7 @@ def generate_commons_only_batched_50():
         if not theme:
             return jsonify({"error": "Theme is required"}), 400
 
-        if not api_key:
+        if not api_key and not api_key_pool:
             return jsonify({"error": "OpenAI API key is required"}), 400
 
         print(f"Generating commons only in large batches for theme: {theme}")
@@ -528,14 +840,26 @@ def generate_commons_only_batched_50():
         commons_skeleton_data = set_skeleton.get_commons_only()
         print(f"Commons skeleton has {len(commons_skeleton_data)} colors")
 
+        job = GenerationJob(priority=PRIORITY_BULK, deadline=_request_deadline(data))
         commons_set = get_card_generator().generate_complete_set_large_batches(
-            theme, commons_skeleton_data, api_key
+            theme,
+            commons_skeleton_data,
+            api_key,
+            max_concurrency=_get_max_concurrency(data),
+            job=job,
         )
 
         print(
             f"Successfully generated commons set with {len(commons_set)} color sections in large batches"
         )
-        return jsonify({"success": True, "set": commons_set, "theme": theme})
+        return jsonify(
+            {
+                "success": True,
+                "set": commons_set,
+                "theme": theme,
+                "generation": job.to_dict(),
+            }
+        )
 
     except Exception as e:
         print(f"Error generating commons set in large batches: {str(e)}")
@@ -553,16 +877,17 @@ def generate_set_stream():
         theme = data.get("theme", "")
         set_type = data.get("set_type", "full")  # 'full' or 'commons'
         api_key = data.get("apiKey", "")
-        # Note: parallel processing not yet implemented for streaming
-        # use_parallel = data.get("use_parallel", True)
 
         if not theme:
             return jsonify({"error": "Theme is required"}), 400
 
-        if not api_key:
+        if not api_key and not api_key_pool:
             return jsonify({"error": "OpenAI API key is required"}), 400
 
+        max_concurrency = _get_max_concurrency(data)
+
         def generate():
+            job = None
             try:
                 # Send initial status
                 yield f"data: {json.dumps({'type': 'status', 'message': 'Starting generation...', 'theme': theme})}\n\n"
@@ -576,50 +901,82 @@ def generate_set_stream():
                 # Send skeleton structure
                 yield f"data: {json.dumps({'type': 'skeleton', 'skeleton': skeleton_data})}\n\n"
 
-                # For now, we'll use sequential generation for streaming
-                # TODO: Implement proper streaming for parallel generation
-                for color_name, color_data in skeleton_data.items():
-                    for rarity_name, rarity_data in color_data.items():
-                        # Handle different skeleton structures
-                        slots_to_process = []
-                        if isinstance(rarity_data, list):
-                            slots_to_process = rarity_data
-                        elif isinstance(rarity_data, dict):
-                            for card_type, type_data in rarity_data.items():
-                                if isinstance(type_data, list):
-                                    slots_to_process.extend(type_data)
-
-                        for slot in slots_to_process:
-                            try:
-                                card = get_card_generator().generate_skeleton_card(
-                                    theme,
-                                    color_name,
-                                    rarity_name,
-                                    slot["id"],
-                                    slot,
-                                    api_key,
-                                )
-                                update = {
-                                    "type": "card",
-                                    "color": color_name,
-                                    "rarity": rarity_name,
-                                    "slot_id": slot["id"],
-                                    "card": card,
-                                }
-                                yield f"data: {json.dumps(update)}\n\n"
-                            except Exception as e:
-                                error_update = {
-                                    "type": "error",
-                                    "color": color_name,
-                                    "rarity": rarity_name,
-                                    "slot_id": slot["id"],
-                                    "error": str(e),
-                                }
-                                yield f"data: {json.dumps(error_update)}\n\n"
-
-                # Send completion status
-                yield f"data: {json.dumps({'type': 'complete', 'message': 'Generation complete!'})}\n\n"
-
+                # Batches stream in on worker threads; each card is forwarded
+                # through this queue as soon as its JSON object is complete
+                updates = queue.Queue()
+                job = GenerationJob(
+                    on_card=lambda color, rarity, slot_id, card: updates.put(
+                        {
+                            "type": "card",
+                            "color": color,
+                            "rarity": rarity,
+                            "slot_id": slot_id,
+                            "card": card,
+                        }
+                    ),
+                    # A failed batch reports its slots and the rest keep going
+                    on_slot_error=lambda color, rarity, slot_id, error: updates.put(
+                        {
+                            "type": "error",
+                            "color": color,
+                            "rarity": rarity,
+                            "slot_id": slot_id,
+                            "error": str(error),
+                        }
+                    ),
+                    priority=PRIORITY_STREAMING,
+                    deadline=_request_deadline(data),
+                )
+
+                def run_generation():
+                    try:
+                        get_card_generator().generate_complete_set(
+                            theme,
+                            skeleton_data,
+                            api_key,
+                            max_concurrency=max_concurrency,
+                            job=job,
+                        )
+                        generation = job.to_dict()
+                        updates.put(
+                            {
+                                "type": "complete",
+                                "message": "Generation complete!",
+                                "failed_slots": generation["failed_slots"],
+                                "generation": generation,
+                            }
+                        )
+                    except Exception as e:
+                        updates.put(
+                            {
+                                "type": "error",
+                                "message": str(e),
+                                "generation": job.to_dict(),
+                            }
+                        )
+
+                threading.Thread(
+                    target=run_generation, name="set-stream", daemon=True
+                ).start()
+
+                while True:
+                    try:
+                        update = updates.get(timeout=SSE_HEARTBEAT_SECONDS)
+                    except queue.Empty:
+                        # A write to a closed connection is how a disconnect shows up
+                        yield ": keep-alive\n\n"
+                        continue
+                    yield f"data: {json.dumps(update)}\n\n"
+                    # Slot errors carry a slot_id; only the final update ends the stream
+                    if update["type"] == "complete" or "slot_id" not in update:
+                        break
+
+            except GeneratorExit:
+                # The client went away: stop starting batches nobody will see
+                if job is not None:
+                    print("API: Streaming client disconnected, cancelling generation")
+                    job.cancel()
+                raise
             except Exception as e:
                 yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
 
@@ -653,7 +1010,7 @@ def generate_set_concept():
         if not pitch.strip():
             return jsonify({"error": "Pitch is required"}), 400
 
-        if not api_key:
+        if not api_key and not api_key_pool:
             return jsonify({"error": "OpenAI API key is required"}), 400
 
         print(f"Generating set concept from pitch: {pitch}")
@@ -704,6 +1061,8 @@ Each archetype should have a distinct identity that fits the set's theme and cre
                 ],
                 temperature=0.8,
                 api_key=api_key,
+                response_schema=("mtg_set_concept", CONCEPT_SCHEMA),
+                deadline=_request_deadline(data, CONCEPT_DEADLINE_SECONDS),
             )
 
             concept_json = response.choices[0].message.content
@@ -807,20 +1166,18 @@ Each archetype should have a distinct identity that fits the set's theme and cre
             print(f"OpenAI API error: {str(api_error)}")
             raise api_error
 
-        # Extract JSON from response
-        start = concept_json.find("{")
-        end = concept_json.rfind("}") + 1
-
-        if start == -1 or end == 0:
-            raise ValueError("No valid JSON found in response")
-
-        concept_data = json.loads(concept_json[start:end])
+        concept_data = decode_json_object(
+            concept_json, CONCEPT_SCHEMA, CONCEPT_REQUIRED_FIELDS
+        )
 
         print(
             f"Successfully generated set concept: {concept_data.get('name', 'Unknown')}"
         )
         return jsonify({"success": True, "concept": concept_data})
 
+    except DeadlineExceeded as e:
+        print(f"Set concept generation ran out of time: {str(e)}")
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         print(f"Error generating set concept: {str(e)}")
         import traceback
@@ -834,6 +1191,23 @@ def health_check():
     return jsonify({"status": "healthy"})
 
 
+@app.route("/api/health/models", methods=["GET"])
+def model_health():
+    """Return model health, batch sizing, prompt and concurrency stats"""
+    return jsonify(
+        {
+            "models": model_router.snapshot(),
+            "batch_sizes": get_batch_size_controller().snapshot(),
+            "output_tokens": get_token_budget_planner().snapshot(),
+            "batch_latency": get_batch_latency_tracker().snapshot(),
+            "prompt_cache": get_prompt_cache_stats().snapshot(),
+            "concurrency": get_concurrency_governor().snapshot(),
+            "circuit_breakers": model_router.circuits_snapshot(),
+            "model_tiers": get_model_tier_policy().snapshot(),
+        }
+    )
+
+
 @socketio.on("connect")
 def handle_connect():
     print("Client connected to WebSocket")
@@ -851,7 +1225,10 @@ def handle_disconnect():
 def initialize_card_generator():
     """Initialize the card generator with socketio reference"""
     global card_generator
-    card_generator = CardGenerator(socketio)
+    card_generator = _create_card_generator()
+    # Load tokenizer encodings now rather than during the first request
+    warm_up_encodings(["gpt-4o-mini", *model_router.models])
+    check_static_prefixes()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,539 @@
+"""
+Asyncio-native card generation engine built on AsyncOpenAI
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from card_generator import COMPLETION_TOKENS_PER_CARD, CardGenerator
+from card_schema import batch_schema, card_schema
+from deadline import Deadline, DeadlineExceeded
+from generation_job import GenerationJob
+from governor import PRIORITY_BULK
+from openai_clients import AsyncOpenAIClientRegistry, fingerprint_api_key
+from retry_policy import classify_error
+from streaming import ChatStreamCollector
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on LLM calls in flight on the engine's event loop
+DEFAULT_MAX_IN_FLIGHT = int(os.getenv("MTG_ASYNC_MAX_IN_FLIGHT", "256"))
+
+
+class AsyncCardGenerator(CardGenerator):
+    """Card generator whose LLM calls are coroutines on a single event loop.
+
+    Prompt building, response parsing and WebSocket emits are shared with
+    CardGenerator; generate_skeleton_card, generate_batch_cards and the
+    generate_complete_set* methods are coroutines here instead of blocking
+    calls, so one process can keep hundreds of requests in flight.
+    """
+
+    def __init__(
+        self,
+        socketio=None,
+        default_api_key=None,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+        **kwargs,
+    ):
+        super().__init__(socketio, default_api_key, **kwargs)
+        self.max_in_flight = max(1, max_in_flight)
+        self.async_client_registry = AsyncOpenAIClientRegistry()
+
+        # Created lazily so they bind to the loop the engine runs on
+        self._in_flight = None
+        self._async_key_semaphores = {}
+
+    def _in_flight_semaphore(self):
+        """Get the semaphore bounding all in-flight LLM calls"""
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        return self._in_flight
+
+    def _async_key_semaphore(self, api_key):
+        """Get the semaphore bounding concurrent batches for an API key"""
+        key_hash = fingerprint_api_key(api_key)
+        semaphore = self._async_key_semaphores.get(key_hash)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(
+                self.per_key_concurrency * self._key_count(api_key)
+            )
+            self._async_key_semaphores[key_hash] = semaphore
+        return semaphore
+
+    async def _collect_stream_async(self, stream, on_delta, deadline):
+        """Read a completion stream, passing content deltas to on_delta"""
+        collector = ChatStreamCollector(on_delta)
+        async for chunk in stream:
+            if deadline.expired():
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    await close()
+                deadline.check("the response finished streaming")
+            collector.add(chunk)
+        return collector.completion()
+
+    async def _make_api_request_async(
+        self,
+        messages,
+        temperature=1.0,
+        api_key=None,
+        expected_completion_tokens=COMPLETION_TOKENS_PER_CARD,
+        call_info=None,
+        set_max_tokens=False,
+        on_delta=None,
+        response_schema=None,
+        priority=PRIORITY_BULK,
+        deadline=None,
+        preferred_model=None,
+    ):
+        """Make an API request with rate limiting and model fallback on quota errors"""
+        pooled = self._uses_pool(api_key)
+        # Use provided API key or fall back to default
+        if not api_key and not pooled:
+            api_key = self.default_api_key
+
+        if not api_key and not pooled:
+            raise ValueError("OpenAI API key is required")
+
+        estimated_tokens = self._estimate_request_tokens(
+            messages, expected_completion_tokens
+        )
+        attempts = {
+            "tried_models": set(),
+            "rate_limit_retries": 0,
+            "last_error": None,
+            "pooled": pooled,
+        }
+        deadline = deadline or Deadline()
+
+        while True:
+            if pooled:
+                api_key = self._pool_key(estimated_tokens, attempts)
+            client = self.async_client_registry.get_client(api_key)
+            limiter = self.rate_limiters.get(api_key)
+            current_model = self._next_model(api_key, attempts, preferred_model)
+            if call_info is not None:
+                call_info["model"] = current_model
+            request_options = self._completion_options(
+                current_model,
+                estimated_tokens,
+                expected_completion_tokens,
+                set_max_tokens,
+                stream=on_delta is not None,
+                response_schema=response_schema,
+            )
+            started = time.monotonic()
+            try:
+                # Pace every worker sharing this key before calling upstream
+                waited = await limiter.acquire_async(estimated_tokens, deadline)
+                if waited > 0:
+                    logger.info(f"Rate limiter paced request by {waited:.2f}s")
+
+                logger.info(f"Making async API request with model: {current_model}")
+                async with self._in_flight_semaphore(), self.governor.slot_async(
+                    api_key, priority, deadline.remaining()
+                ):
+                    started = time.monotonic()
+                    raw_response = (
+                        await client.chat.completions.with_raw_response.create(
+                            model=current_model,
+                            messages=messages,
+                            temperature=temperature,
+                            timeout=deadline.call_timeout(),
+                            **request_options,
+                        )
+                    )
+                    response = raw_response.parse()
+                    if on_delta is not None:
+                        response = await self._collect_stream_async(
+                            response, on_delta, deadline
+                        )
+                return self._record_response(
+                    current_model,
+                    raw_response.headers,
+                    response,
+                    limiter,
+                    estimated_tokens,
+                    started,
+                    call_info,
+                )
+
+            except Exception as e:
+                self._handle_request_error(
+                    e, current_model, api_key, limiter, attempts, started, deadline
+                )
+            finally:
+                self.model_router.end_call(current_model)
+
+    async def generate_skeleton_card(
+        self, theme, color, rarity, slot_id, slot_data, api_key=None, job=None
+    ):
+        """Generate a card based on skeleton slot specifications"""
+        job = job or GenerationJob()
+        start_time = datetime.now()
+        logger.info(
+            f"Starting async card generation for slot {slot_id} - {color} {rarity} with theme '{theme}'"
+        )
+        messages = self._build_skeleton_card_messages(
+            theme, color, rarity, slot_id, slot_data
+        )
+
+        request = (color, rarity, slot_id, slot_data)
+
+        async def attempt():
+            call_info = {}
+            response = await self._make_api_request_async(
+                messages,
+                temperature=1.0,
+                api_key=api_key,
+                call_info=call_info,
+                response_schema=("mtg_card", card_schema()),
+                priority=job.priority,
+                deadline=job.deadline,
+                preferred_model=self.tier_policy.model_for(request),
+            )
+            card = self._parse_skeleton_card(
+                response.choices[0].message.content,
+                theme,
+                slot_id,
+                call_info["model"],
+            )
+            self.tier_policy.record([request], {slot_id: card}, call_info["model"])
+            return card
+
+        try:
+            # Transient failures retry just this slot
+            card_data = await job.retry_policy.call_async(
+                attempt,
+                f"card {slot_id}",
+                on_retry=job.retry_callback("slot", slot_id),
+                deadline=job.deadline,
+            )
+
+            generation_time = (datetime.now() - start_time).total_seconds()
+            logger.info(
+                f"Successfully generated card '{card_data.get('name', 'Unknown')}' for slot {slot_id} in {generation_time:.2f}s"
+            )
+
+            # Emit the card via WebSocket immediately after generation
+            self._publish_card(color, rarity, slot_id, card_data, job)
+            return card_data
+
+        except Exception as e:
+            generation_time = (datetime.now() - start_time).total_seconds()
+            logger.error(
+                f"Failed to generate card for slot {slot_id} after {generation_time:.2f}s: {str(e)}"
+            )
+            raise e
+
+    def _can_cancel_hedges(self):
+        """Cancelling a task aborts its request, streamed or not"""
+        return True
+
+    async def _call_batch_attempt_async(self, attempt, card_requests, api_key, job):
+        """Run one batch attempt, racing a duplicate if it outlives its p95"""
+        threshold = self._hedge_threshold(api_key, card_requests, job)
+        if threshold is None:
+            return await attempt()
+
+        tasks = [asyncio.ensure_future(attempt())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=threshold)
+            if not done and job.reserve_hedge():
+                logger.info(
+                    f"Hedging batch {self._batch_label(card_requests)} after {threshold:.2f}s"
+                )
+                tasks.append(asyncio.ensure_future(attempt()))
+
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            winner = "primary" if task is tasks[0] else "hedge"
+                            job.record_hedge(
+                                self._batch_label(card_requests), threshold, winner
+                            )
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Unlike threads, the slower request can simply be cancelled
+            for task in tasks:
+                task.cancel()
+
+    async def generate_batch_cards(
+        self,
+        theme,
+        card_requests,
+        api_key=None,
+        job=None,
+        repair_depth=0,
+        context=None,
+    ):
+        """Generate multiple cards in a single API call"""
+        if not card_requests:
+            return {}
+
+        job = job or GenerationJob()
+        start_time = datetime.now()
+        logger.info(
+            f"Starting async batch generation of {len(card_requests)} cards for theme '{theme}'"
+        )
+        messages = self._build_batch_messages(theme, card_requests, context)
+        if self._samples_slot_encoding():
+            # Tokenizing the verbose prompt would stall every batch on the loop
+            await asyncio.to_thread(
+                self._report_slot_encoding, theme, card_requests, context
+            )
+        expected_completion = self.token_planner.estimate_batch_completion(
+            card_requests
+        )
+        # Cards received by any attempt, so a retry never re-emits a slot
+        received = {}
+        response_schema = (
+            "mtg_card_batch",
+            batch_schema([slot_id for _, _, slot_id, _ in card_requests]),
+        )
+        preferred_model = self.tier_policy.model_for_batch(card_requests)
+
+        async def attempt():
+            attempt_started = datetime.now()
+            call_info = {}
+            parser, feed = self._batch_card_parser(
+                theme, card_requests, received, job, call_info
+            )
+            try:
+                # Slightly lower temperature for more consistent JSON formatting
+                response = await self._make_api_request_async(
+                    messages,
+                    temperature=0.9,
+                    api_key=api_key,
+                    expected_completion_tokens=expected_completion,
+                    call_info=call_info,
+                    set_max_tokens=True,
+                    on_delta=feed if self.stream_batches else None,
+                    response_schema=response_schema,
+                    priority=job.priority,
+                    deadline=job.deadline,
+                    preferred_model=preferred_model,
+                )
+                if not self.stream_batches:
+                    feed(response.choices[0].message.content)
+                result = self._check_batch_parse(parser, card_requests, received, job)
+            except Exception as e:
+                self._record_batch_failure(call_info, card_requests, e)
+                reason = classify_error(e)
+                if not received or reason is None:
+                    raise
+                # The stream broke after some cards arrived: repair only the rest
+                return self._salvage_batch(card_requests, received, job, reason)
+            self._record_batch_outcome(call_info, card_requests, result)
+            self._log_batch_result(
+                result, card_requests, attempt_started, call_info["model"]
+            )
+            return result
+
+        try:
+            # Transient failures retry this batch only, not the whole set
+            batch_label = self._batch_label(card_requests)
+            result = await job.retry_policy.call_async(
+                lambda: self._call_batch_attempt_async(
+                    attempt, card_requests, api_key, job
+                ),
+                f"batch {batch_label}",
+                on_retry=job.retry_callback("batch", batch_label),
+                deadline=job.deadline,
+            )
+
+            # Keep the cards we got and only re-request the missing slots
+            missing = self._missing_requests(result, card_requests)
+            if missing:
+                self._check_repair(result, card_requests, missing, repair_depth, job)
+                result.update(
+                    await self.generate_batch_cards(
+                        theme,
+                        missing,
+                        api_key,
+                        job=job,
+                        repair_depth=repair_depth + 1,
+                        context=context,
+                    )
+                )
+            return result
+
+        except DeadlineExceeded as e:
+            # Out of time: keep the cards that arrived and report the rest
+            missed = [slot for _, _, slot, _ in card_requests if slot not in received]
+            job.record_missed(missed, e)
+            logger.warning(
+                f"Batch {self._batch_label(card_requests)} stopped by its deadline with {len(card_requests) - len(missed)}/{len(card_requests)} cards"
+            )
+            return dict(received)
+
+        except Exception as e:
+            generation_time = (datetime.now() - start_time).total_seconds()
+            logger.error(f"Batch generation failed after {generation_time:.2f}s: {e}")
+            raise e
+
+    async def _dispatch_batches_async(
+        self,
+        theme,
+        plan,
+        complete_set,
+        batch_size,
+        api_key,
+        label,
+        max_concurrency=None,
+        job=None,
+    ):
+        """Run batches as concurrent tasks, placing cards as each batch lands.
+
+        As in the threaded engine, each batch is carved off the pending slots
+        when a slot frees up, at the controller's current size for the model.
+        """
+        if not plan:
+            return
+
+        max_tasks = max(
+            1, max_concurrency or self.batch_concurrency * self._key_count(api_key)
+        )
+        key_semaphore = self._async_key_semaphore(api_key)
+
+        async def run_batch(batch_num, batch_requests, context):
+            async with key_semaphore:
+                logger.info(
+                    f"Processing {label} {batch_num} ({len(batch_requests)} cards in single API call)"
+                )
+                return await self.generate_batch_cards(
+                    theme, batch_requests, api_key, job=job, context=context
+                )
+
+        tasks = {}
+        batch_num = 0
+        try:
+            while (plan and not job.stopped()) or tasks:
+                while plan and len(tasks) < max_tasks and not job.stopped():
+                    # Packing counts prompt tokens, which would stall the loop
+                    batch_requests, context = await asyncio.to_thread(
+                        self._next_batch, theme, plan, api_key, batch_size
+                    )
+                    batch_num += 1
+                    task = asyncio.ensure_future(
+                        run_batch(batch_num, batch_requests, context)
+                    )
+                    tasks[task] = batch_requests
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    self._land_batch(complete_set, tasks.pop(task), task, label, job)
+            self._record_unstarted(plan, job)
+        finally:
+            # Don't keep generating once the set has failed
+            for task in tasks:
+                task.cancel()
+            # Let the cancelled batches release their slots and reservations
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _generate_set_async(
+        self, theme, skeleton, api_key, batch_size, label, max_concurrency, job
+    ):
+        """Collect the skeleton slots and generate them in concurrent batches"""
+        start_time = datetime.now()
+        complete_set, plan = self._collect_set_requests(skeleton)
+        total_cards = len(plan)
+        logger.info(
+            f"Processing {total_cards} cards in async {label}ES starting at {batch_size}..."
+        )
+
+        await self._dispatch_batches_async(
+            theme,
+            plan,
+            complete_set,
+            batch_size,
+            api_key,
+            label,
+            max_concurrency=max_concurrency,
+            job=job or GenerationJob(),
+        )
+
+        generation_time = (datetime.now() - start_time).total_seconds()
+        logger.info(
+            f"Completed async {label} set generation for '{theme}' in {generation_time:.2f}s ({total_cards} cards)"
+        )
+        return complete_set
+
+    async def generate_complete_set(
+        self,
+        theme,
+        skeleton,
+        api_key=None,
+        max_concurrency=None,
+        job=None,
+        offline=False,
+    ):
+        """Generate all cards for a complete set, starting from batches of 15"""
+        if offline:
+            # The Batch API round trip is mostly waiting; keep it off the loop
+            return await asyncio.to_thread(
+                self.generate_complete_set_offline, theme, skeleton, api_key, job
+            )
+        return await self._generate_set_async(
+            theme, skeleton, api_key, 15, "TRUE BATCH", max_concurrency, job
+        )
+
+    async def generate_complete_set_large_batches(
+        self, theme, skeleton, api_key=None, max_concurrency=None, job=None
+    ):
+        """Generate all cards for a complete set, starting from batches of 25"""
+        return await self._generate_set_async(
+            theme, skeleton, api_key, 25, "LARGE BATCH", max_concurrency, job
+        )
+
+
+class SyncCardGenerator:
+    """Blocking facade over AsyncCardGenerator for the Flask routes.
+
+    Runs the engine's event loop on a background thread; each call submits a
+    coroutine to that loop and waits for its result, so the calling thread
+    blocks but LLM calls themselves don't each pin a thread.
+    """
+
+    ASYNC_METHODS = (
+        "generate_skeleton_card",
+        "generate_batch_cards",
+        "generate_complete_set",
+        "generate_complete_set_large_batches",
+    )
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="card-generator-loop", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, coroutine):
+        """Run a coroutine on the engine loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.engine, name)
+        if name in self.ASYNC_METHODS:
+            return lambda *args, **kwargs: self._run(attribute(*args, **kwargs))
+        # Synchronous helpers (e.g. generate_commons) are used as-is
+        return attribute
+
+    def close(self):
+        """Close the async transport and stop the event loop"""
+        self._run(self.engine.async_client_registry.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -0,0 +1,205 @@
+"""
+Local stand-in for the OpenAI files and batches endpoints, for trying out
+offline set generation without spending tokens
+
+Run it with `python batch_api_standin.py` and point the backend at it with
+MTG_OFFLINE_BASE_URL=http://127.0.0.1:8765/v1. Every request gets one
+placeholder card per slot it asks for.
+"""
+
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+
+from flask import Flask, jsonify, request
+
+app = Flask(__name__)
+
+_files = {}
+_batches = {}
+_ids = itertools.count(1)
+_lock = threading.Lock()
+# Status checks before a batch completes, and cards dropped from each
+# first-round request so the repair rounds get exercised
+settings = {"polls": 2, "drop": 0}
+
+_SLOT_IDS = (
+    re.compile(r'"id": ?"([^"]+)"'),  # Compact slot encoding
+    re.compile(r"Slot ID: ([^)\s]+)\)"),  # Verbose slot encoding
+)
+
+
+def _slot_ids(body):
+    prompt = body["messages"][-1]["content"]
+    for pattern in _SLOT_IDS:
+        slot_ids = pattern.findall(prompt)
+        if slot_ids:
+            return list(dict.fromkeys(slot_ids))
+    return []
+
+
+def _result_line(item):
+    """Batch API output line answering one input line"""
+    body = item["body"]
+    slot_ids = _slot_ids(body)
+    if settings["drop"] and item["custom_id"].startswith("round0"):
+        slot_ids = slot_ids[: -settings["drop"]]
+    cards = [
+        {
+            "slot_id": slot_id,
+            "name": f"Stand-in {slot_id}",
+            "mana_cost": "1",
+            "type": "Artifact",
+            "rules_text": "{T}: Add {C}.",
+            "flavor_text": "Generated by the Batch API stand-in.",
+        }
+        for slot_id in slot_ids
+    ]
+    content = json.dumps({"cards": cards})
+    return {
+        "id": f"batch_req_{next(_ids)}",
+        "custom_id": item["custom_id"],
+        "response": {
+            "status_code": 200,
+            "body": {
+                "model": body.get("model"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0},
+            },
+        },
+        "error": None,
+    }
+
+
+def _complete(batch):
+    lines = _files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+    output = [_result_line(json.loads(line)) for line in lines if line.strip()]
+    file_id = f"file-{next(_ids)}"
+    _files[file_id] = {
+        "content": ("\n".join(json.dumps(line) for line in output) + "\n").encode(),
+        "filename": "batch_output.jsonl",
+        "purpose": "batch_output",
+    }
+    batch.update(
+        status="completed",
+        output_file_id=file_id,
+        completed_at=int(time.time()),
+        request_counts={"total": len(output), "completed": len(output), "failed": 0},
+    )
+
+
+def _batch_view(batch):
+    return {key: value for key, value in batch.items() if not key.startswith("_")}
+
+
+@app.post("/v1/files")
+def create_file():
+    upload = request.files["file"]
+    with _lock:
+        file_id = f"file-{next(_ids)}"
+        _files[file_id] = {
+            "content": upload.read(),
+            "filename": upload.filename,
+            "purpose": request.form.get("purpose", "batch"),
+        }
+        stored = _files[file_id]
+    return jsonify(
+        {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(stored["content"]),
+            "created_at": int(time.time()),
+            "filename": stored["filename"],
+            "purpose": stored["purpose"],
+            "status": "processed",
+        }
+    )
+
+
+@app.get("/v1/files/<file_id>/content")
+def file_content(file_id):
+    with _lock:
+        if file_id not in _files:
+            return jsonify({"error": {"message": f"No file {file_id}"}}), 404
+        return _files[file_id]["content"]
+
+
+@app.post("/v1/batches")
+def create_batch():
+    data = request.json
+    with _lock:
+        if data.get("input_file_id") not in _files:
+            return jsonify({"error": {"message": "Unknown input file"}}), 400
+        batch_id = f"batch_{next(_ids)}"
+        _batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": data["endpoint"],
+            "input_file_id": data["input_file_id"],
+            "completion_window": data["completion_window"],
+            "status": "validating",
+            "created_at": int(time.time()),
+            "metadata": data.get("metadata"),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "_polls": 0,
+        }
+        return jsonify(_batch_view(_batches[batch_id]))
+
+
+@app.get("/v1/batches/<batch_id>")
+def retrieve_batch(batch_id):
+    with _lock:
+        batch = _batches.get(batch_id)
+        if batch is None:
+            return jsonify({"error": {"message": f"No batch {batch_id}"}}), 404
+        batch["_polls"] += 1
+        if batch["status"] in ("validating", "in_progress"):
+            if batch["_polls"] > settings["polls"]:
+                _complete(batch)
+            else:
+                batch["status"] = "in_progress"
+        elif batch["status"] == "cancelling":
+            batch["status"] = "cancelled"
+        return jsonify(_batch_view(batch))
+
+
+@app.post("/v1/batches/<batch_id>/cancel")
+def cancel_batch(batch_id):
+    with _lock:
+        batch = _batches.get(batch_id)
+        if batch is None:
+            return jsonify({"error": {"message": f"No batch {batch_id}"}}), 404
+        if batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+            batch["status"] = "cancelling"
+        return jsonify(_batch_view(batch))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--polls",
+        type=int,
+        default=settings["polls"],
+        help="status checks before a batch completes",
+    )
+    parser.add_argument(
+        "--drop",
+        type=int,
+        default=0,
+        help="cards to drop from each first-round request, to exercise repairs",
+    )
+    args = parser.parse_args()
+    settings.update(polls=args.polls, drop=args.drop)
+    app.run(port=args.port)
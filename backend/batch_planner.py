@@ -0,0 +1,154 @@
+"""
+Color/rarity-coherent batch planning for set generation
+"""
+
+import math
+from collections import Counter, deque
+
+# Skeleton fields that describe a whole color/rarity section rather than a slot
+SECTION_CONTEXT_FIELDS = ("keywords", "notes", "spell_options")
+
+
+def _section_context(section_data):
+    """The context fields present on a skeleton color or rarity dict"""
+    if not isinstance(section_data, dict):
+        return {}
+    return {
+        field: section_data[field]
+        for field in SECTION_CONTEXT_FIELDS
+        if section_data.get(field)
+    }
+
+
+def section_contexts(skeleton):
+    """Shared context per (color, rarity) section from the skeleton.
+
+    Rarity-level keywords/notes apply to their rarity; color-level ones (as
+    in the colorless section) apply to every rarity of that color.
+    """
+    contexts = {}
+    for color, color_data in (skeleton or {}).items():
+        if not isinstance(color_data, dict):
+            continue
+        color_context = _section_context(color_data)
+        for rarity, rarity_data in color_data.items():
+            if rarity in SECTION_CONTEXT_FIELDS:
+                continue
+            context = dict(color_context)
+            context.update(_section_context(rarity_data))
+            if context:
+                contexts[(color, rarity)] = context
+    return contexts
+
+
+def _section(request):
+    return request[0], request[1]
+
+
+class BatchPlanner:
+    """Carve batches that stay within one color and rarity section.
+
+    A section larger than a batch is split into evenly sized batches; small
+    sections of the same color are combined while they fit in one batch.
+    Each batch carries the skeleton context of the sections it covers.
+    Slots routed to different models never share a batch.
+    """
+
+    def __init__(self, all_requests, skeleton=None, route=None):
+        # route(request) is the slot's preferred model; batches never mix them
+        self.route = route or (lambda request: None)
+        self.contexts = section_contexts(skeleton)
+        self.section_slots = Counter(_section(request) for request in all_requests)
+        # Within a section, slots routed to the same model are made adjacent
+        sections = {}
+        routes = {}
+        for request in all_requests:
+            sections.setdefault(_section(request), len(sections))
+            routes.setdefault(self.route(request), len(routes))
+        self.pending = deque(
+            sorted(
+                all_requests,
+                key=lambda request: (
+                    sections[_section(request)],
+                    routes[self.route(request)],
+                ),
+            )
+        )
+
+    def __bool__(self):
+        return bool(self.pending)
+
+    def __len__(self):
+        return len(self.pending)
+
+    def _group(self, request):
+        return _section(request) + (self.route(request),)
+
+    def next_route(self):
+        """Preferred model of the next batch"""
+        return self.route(self.pending[0]) if self.pending else None
+
+    def _run_at(self, start):
+        """Number of adjacent pending slots from start that share a section and route"""
+        group = self._group(self.pending[start])
+        run = 0
+        for index in range(start, len(self.pending)):
+            if self._group(self.pending[index]) != group:
+                break
+            run += 1
+        return run
+
+    def _leading_run(self):
+        return self._run_at(0)
+
+    def candidates(self, max_cards):
+        """Slots the next batch may draw from: whole sections of one color.
+
+        The leading section is always included; later sections of the same
+        color and route are added whole while the total stays within max_cards.
+        """
+        if not self.pending:
+            return []
+        count = self._leading_run()
+        color, _, route = self._group(self.pending[0])
+        while count < max_cards and count < len(self.pending):
+            next_group = self._group(self.pending[count])
+            if next_group[0] != color or next_group[2] != route:
+                break
+            size = self._run_at(count)
+            if count + size > max_cards:
+                break
+            count += size
+        return [self.pending[i] for i in range(count)]
+
+    def take(self, candidates, fits):
+        """Pop the next batch given how many candidate slots fit the budget.
+
+        When the budget splits the leading section, it is split evenly so
+        the last batch of the section isn't a small remainder.
+        """
+        if fits >= len(candidates):
+            size = len(candidates)
+        else:
+            run = self._leading_run()
+            if run <= fits:
+                size = run
+            else:
+                size = math.ceil(run / math.ceil(run / max(1, fits)))
+        return [self.pending.popleft() for _ in range(max(1, size))]
+
+    def requeue(self, requests):
+        """Put slots back at the end of the plan to be batched again"""
+        self.pending.extend(requests)
+
+    def context_for(self, batch):
+        """Skeleton context for the sections a batch covers"""
+        sections = dict.fromkeys(_section(request) for request in batch)
+        return {
+            section: {
+                "section_slots": self.section_slots[section],
+                **self.contexts[section],
+            }
+            for section in sections
+            if section in self.contexts
+        }
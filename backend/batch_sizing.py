@@ -0,0 +1,132 @@
+"""
+Adaptive (AIMD) batch sizing for set generation, tracked per model
+"""
+
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+MIN_BATCH_SIZE = int(os.getenv("MTG_MIN_BATCH_SIZE", "3"))
+MAX_BATCH_SIZE = int(os.getenv("MTG_MAX_BATCH_SIZE", "40"))
+# Cards added after each complete, on-time batch
+BATCH_SIZE_INCREASE = int(os.getenv("MTG_BATCH_SIZE_INCREASE", "2"))
+# Factor applied after a truncated, incomplete, unparseable or slow batch
+BATCH_SIZE_DECREASE = float(os.getenv("MTG_BATCH_SIZE_DECREASE", "0.5"))
+# A batch is a latency spike when its seconds-per-card exceed the average by this
+LATENCY_SPIKE_FACTOR = float(os.getenv("MTG_BATCH_LATENCY_SPIKE", "2.0"))
+
+
+class _ModelBatchState:
+    """Current batch size and seconds-per-card average for one model"""
+
+    def __init__(self, size):
+        self.size = size
+        self.seconds_per_card = None
+        self.batches = 0
+
+    def to_dict(self):
+        return {
+            "batch_size": self.size,
+            "seconds_per_card": (
+                round(self.seconds_per_card, 3) if self.seconds_per_card else None
+            ),
+            "batches": self.batches,
+        }
+
+
+class BatchSizeController:
+    """Additive-increase / multiplicative-decrease batch sizing per model.
+
+    The size grows while batches come back complete and at the usual speed,
+    and is cut on truncation, missing slots, parse failures or latency
+    spikes, so each model settles near the largest batch it handles well.
+    """
+
+    def __init__(
+        self,
+        min_size=MIN_BATCH_SIZE,
+        max_size=MAX_BATCH_SIZE,
+        increase=BATCH_SIZE_INCREASE,
+        decrease=BATCH_SIZE_DECREASE,
+        spike_factor=LATENCY_SPIKE_FACTOR,
+    ):
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.increase = increase
+        self.decrease = decrease
+        self.spike_factor = spike_factor
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _state_locked(self, model, initial_size):
+        state = self._states.get(model)
+        if state is None:
+            size = min(self.max_size, max(self.min_size, initial_size))
+            state = self._states[model] = _ModelBatchState(size)
+        return state
+
+    def size_for(self, model, initial_size):
+        """Batch size to use next for this model"""
+        with self._lock:
+            return self._state_locked(model, initial_size).size
+
+    def record_success(self, model, requested, returned, latency, truncated=False):
+        """Adjust a model's batch size after a batch response was parsed"""
+        with self._lock:
+            state = self._state_locked(model, requested)
+            state.batches += 1
+            per_card = latency / max(returned, 1)
+            spike = (
+                state.seconds_per_card is not None
+                and per_card > state.seconds_per_card * self.spike_factor
+            )
+            if state.seconds_per_card is None:
+                state.seconds_per_card = per_card
+            else:
+                state.seconds_per_card = 0.8 * state.seconds_per_card + 0.2 * per_card
+
+            if truncated or returned < requested or spike:
+                reason = (
+                    "truncated"
+                    if truncated
+                    else ("missing slots" if returned < requested else "latency spike")
+                )
+                self._decrease_locked(model, state, reason)
+            elif requested >= state.size:
+                # Only grow once the current size has actually been proven
+                state.size = min(self.max_size, state.size + self.increase)
+
+    def record_failure(self, model, requested):
+        """Shrink a model's batch size after a failed or unparseable batch"""
+        with self._lock:
+            state = self._state_locked(model, requested)
+            state.batches += 1
+            self._decrease_locked(model, state, "failed batch")
+
+    def _decrease_locked(self, model, state, reason):
+        new_size = max(self.min_size, int(state.size * self.decrease))
+        if new_size != state.size:
+            logger.info(
+                f"Reducing {model} batch size {state.size} -> {new_size} ({reason})"
+            )
+        state.size = new_size
+
+    def snapshot(self):
+        """Per-model batch sizing state for monitoring"""
+        with self._lock:
+            return {model: state.to_dict() for model, state in self._states.items()}
+
+
+_default_controller = None
+_default_controller_lock = threading.Lock()
+
+
+def get_batch_size_controller():
+    """Get the process-wide batch size controller, creating it on first use"""
+    global _default_controller
+    with _default_controller_lock:
+        if _default_controller is None:
+            _default_controller = BatchSizeController()
+        return _default_controller
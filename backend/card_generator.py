@@ -2,35 +2,141 @@ import openai
 import json
 import os
 import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
+from deadline import Deadline, DeadlineExceeded
+from batch_planner import BatchPlanner
+from batch_sizing import get_batch_size_controller
+from circuit_breaker import CircuitOpenError
+from card_schema import (
+    batch_schema,
+    card_schema,
+    decode_card,
+    response_format_for,
+    validate_batch_card,
+)
+from generation_job import GenerationJob
+from governor import PRIORITY_BULK, get_concurrency_governor
+from hedging import HEDGING_ENABLED, RequestCancelled, get_batch_latency_tracker
+from key_pool import get_api_key_pool
+from model_router import get_model_router
+from model_tiers import get_model_tier_policy
+from offline_batch import (
+    OFFLINE_DEADLINE_SECONDS,
+    OfflineBatchRunner,
+    batch_request_line,
+)
+from openai_clients import fingerprint_api_key, get_client_registry
+from rate_limiter import (
+    MAX_RATE_LIMIT_RETRIES,
+    estimate_tokens,
+    get_rate_limiter_registry,
+)
+from prompt_templates import (
+    build_batch_messages,
+    COMPACT_SLOTS,
+    SLOT_ENCODING_SAMPLE_RATE,
+    batch_prompt_tokens,
+    build_skeleton_card_messages,
+    cached_prompt_tokens,
+    format_batch_slot,
+    get_prompt_cache_stats,
+)
+from retry_policy import MalformedResponseError, classify_error
+from streaming import ChatStreamCollector, JSONArrayStream
+from token_budget import count_tokens, get_token_budget_planner
 
 # Configure logging for card generation
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# Number of batches dispatched concurrently for a single set generation request
+DEFAULT_BATCH_CONCURRENCY = int(os.getenv("MTG_BATCH_CONCURRENCY", "4"))
+# Upper bound on in-flight batches sharing one API key, across all requests
+DEFAULT_PER_KEY_CONCURRENCY = int(os.getenv("MTG_PER_KEY_CONCURRENCY", "6"))
+# How many follow-up batches may regenerate slots missing from a batch response
+DEFAULT_MAX_REPAIR_DEPTH = int(os.getenv("MTG_BATCH_REPAIR_DEPTH", "2"))
+# Rough completion size of one generated card, used to pre-reserve token budget
+COMPLETION_TOKENS_PER_CARD = 250
+# Stream batch completions so each card is emitted as soon as it is complete
+DEFAULT_STREAM_BATCHES = os.getenv("MTG_STREAM_BATCHES", "1") != "0"
+
+
 class CardGenerator:
-    def __init__(self, socketio=None, default_api_key=None):
+    def __init__(
+        self,
+        socketio=None,
+        default_api_key=None,
+        batch_concurrency=DEFAULT_BATCH_CONCURRENCY,
+        per_key_concurrency=DEFAULT_PER_KEY_CONCURRENCY,
+        client_registry=None,
+        rate_limiters=None,
+        model_router=None,
+        max_repair_depth=DEFAULT_MAX_REPAIR_DEPTH,
+        batch_sizer=None,
+        token_planner=None,
+        stream_batches=DEFAULT_STREAM_BATCHES,
+        latency_tracker=None,
+        hedging=HEDGING_ENABLED,
+        prompt_stats=None,
+        compact_slots=COMPACT_SLOTS,
+        slot_encoding_sample_rate=SLOT_ENCODING_SAMPLE_RATE,
+        governor=None,
+        tier_policy=None,
+        offline_runner=None,
+        key_pool=None,
+    ):
         self.socketio = socketio
         self.default_api_key = default_api_key
+        self.batch_concurrency = max(1, batch_concurrency)
+        self.per_key_concurrency = max(1, per_key_concurrency)
+        self.max_repair_depth = max(0, max_repair_depth)
+        self.stream_batches = stream_batches
+        self.compact_slots = compact_slots
+        self.slot_encoding_sample_rate = slot_encoding_sample_rate
+        self.hedging = hedging
+        self._hedge_executor = None
+        self._hedge_executor_lock = threading.Lock()
+
+        # Semaphores bounding concurrent batches per API key (keyed by key hash)
+        self._key_semaphores = {}
+        self._key_semaphores_lock = threading.Lock()
 
         if not self.default_api_key:
             print("INFO: No default API key provided - will use per-request keys")
         else:
             print("Using default OpenAI API key: ", self.default_api_key[:10] + "...")
 
-        # Client will be created per request with the appropriate API key
-        self.client = None
-
-        # Define model fallback chain (in order of preference)
-        self.model_fallback_chain = [
-            "gpt-4o-mini",  # Cheapest and fastest
-            "gpt-4o",  # More capable
-            "gpt-4-turbo",  # Fallback
-            "gpt-4",  # Last resort
-            "gpt-3.5-turbo",  # Final fallback
-        ]
-        self.current_model_index = 0
+        # Clients are pooled per API key and share keep-alive connections
+        self.client_registry = client_registry or get_client_registry()
+        # Rate limiters are shared by every worker using the same API key
+        self.rate_limiters = rate_limiters or get_rate_limiter_registry()
+
+        # Model fallback state is tracked per API key by the shared router
+        self.model_router = model_router or get_model_router()
+        self.model_fallback_chain = self.model_router.models
+        # Batch sizes adapt per model to how well it handles large batches
+        self.batch_sizer = batch_sizer or get_batch_size_controller()
+        # Batches are packed to a token budget and get a matching max_tokens
+        self.token_planner = token_planner or get_token_budget_planner()
+        # Rolling batch latencies decide when a slow batch is hedged
+        self.latency_tracker = latency_tracker or get_batch_latency_tracker()
+        # Process-wide cap on in-flight calls, shared fairly between API keys
+        self.governor = governor or get_concurrency_governor()
+        # Preferred model per slot by rarity, section and slot type
+        self.tier_policy = tier_policy or get_model_tier_policy()
+        # Offline set generation goes through the Batch API instead
+        self.offline_runner = offline_runner or OfflineBatchRunner(self.client_registry)
+        # Prompt and prefix-cached token sizes reported by the API
+        self.prompt_stats = prompt_stats or get_prompt_cache_stats()
+        # Server-side keys that calls without their own key are spread across
+        self.key_pool = key_pool or get_api_key_pool()
+        if self.key_pool:
+            print(f"Using server-side API key pool of {len(self.key_pool)} keys")
 
     def _is_insufficient_quota_error(self, error: Exception) -> bool:
         """Best-effort detection of insufficient quota errors from the OpenAI SDK."""
@@ -42,43 +148,252 @@ class CardGenerator:
             and "quota" in message
         )
 
-    def _get_current_model(self):
-        """Get the current model to use from the fallback chain"""
-        if self.current_model_index < len(self.model_fallback_chain):
-            return self.model_fallback_chain[self.current_model_index]
-        return self.model_fallback_chain[
-            -1
-        ]  # Use last model if we've exhausted the chain
-
-    def _try_next_model(self):
-        """Switch to the next model in the fallback chain"""
-        if self.current_model_index < len(self.model_fallback_chain) - 1:
-            self.current_model_index += 1
-            logger.info(f"Switching to fallback model: {self._get_current_model()}")
-            return True
-        else:
-            logger.warning("All models exhausted")
-            return False
+    def _uses_pool(self, api_key):
+        """Whether a call without its own key draws its keys from the pool"""
+        return not api_key and bool(self.key_pool)
+
+    def _key_count(self, api_key):
+        """API keys a call with this key can spread its batches across"""
+        return len(self.key_pool) if self._uses_pool(api_key) else 1
+
+    def _pool_key(self, estimated_tokens, attempts):
+        """Pick the pooled key with the most headroom for the next attempt"""
+        api_key = self.key_pool.choose(estimated_tokens)
+        if api_key is None:
+            logger.warning("Every key in the API key pool is out of quota")
+            if attempts["last_error"] is not None:
+                raise attempts["last_error"]
+            raise Exception("Every key in the API key pool is out of quota")
+        return api_key
+
+    def _key_semaphore(self, api_key):
+        """Get the semaphore bounding concurrent batches for an API key.
+
+        The pool shares one semaphore sized for all of its keys.
+        """
+        key_hash = fingerprint_api_key(api_key)
+        with self._key_semaphores_lock:
+            semaphore = self._key_semaphores.get(key_hash)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(
+                    self.per_key_concurrency * self._key_count(api_key)
+                )
+                self._key_semaphores[key_hash] = semaphore
+            return semaphore
+
+    def _is_rate_limit_error(self, error: Exception) -> bool:
+        """Detect plain 429 rate-limit errors (as opposed to exhausted quota)"""
+        return getattr(error, "status_code", None) == 429 or isinstance(
+            error, openai.RateLimitError
+        )
+
+    def _estimate_request_tokens(self, messages, expected_completion_tokens):
+        """Estimate the total tokens a call will consume, for rate limiting"""
+        prompt_tokens = sum(
+            estimate_tokens(message.get("content", "")) for message in messages
+        )
+        return prompt_tokens + expected_completion_tokens
+
+    def _next_model(self, api_key, attempts, preferred=None):
+        """Pick the model for the next attempt of a call and admit it.
+
+        A model whose circuit rejects the call is skipped like one out of
+        quota; the caller must release the admitted model with end_call.
+        """
+        while True:
+            model = self.model_router.select_model(
+                api_key, exclude=attempts["tried_models"], preferred=preferred
+            )
+            if model is None:
+                logger.warning("All models exhausted")
+                if attempts["last_error"] is not None:
+                    raise attempts["last_error"]  # Re-raise if no more models to try
+                open_circuits = self.model_router.open_circuits()
+                if open_circuits:
+                    raise CircuitOpenError(
+                        f"Circuit open for {', '.join(open_circuits)} and no other model available"
+                    )
+                raise Exception("All models in fallback chain have exceeded quota")
+            if self.model_router.begin_call(model):
+                return model
+            attempts["tried_models"].add(model)
 
-    def _make_api_request(self, messages, temperature=1.0, api_key=None):
-        """Make an API request with automatic model fallback on quota errors"""
+    def _record_response(
+        self, model, headers, response, limiter, estimated_tokens, started, call_info
+    ):
+        """Feed a successful response back into the limiter and router"""
+        limiter.update_from_headers(headers)
+        latency = time.monotonic() - started
+        usage = getattr(response, "usage", None)
+        limiter.record_usage(estimated_tokens, getattr(usage, "total_tokens", None))
+        self.prompt_stats.record(model, usage)
+        self.model_router.record_success(
+            model,
+            latency,
+            completion_tokens=getattr(usage, "completion_tokens", None),
+        )
+        if call_info is not None:
+            choices = getattr(response, "choices", None) or [None]
+            call_info["latency"] = latency
+            call_info["finish_reason"] = getattr(choices[0], "finish_reason", None)
+            call_info["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+            call_info["cached_tokens"] = cached_prompt_tokens(usage)
+        return response
+
+    def _completion_options(
+        self,
+        model,
+        estimated_tokens,
+        expected_completion_tokens,
+        set_max_tokens,
+        stream,
+        response_schema,
+    ):
+        """Extra create() arguments that depend on the call and its model"""
+        options = {}
+        if response_schema is not None:
+            response_format = response_format_for(model, *response_schema)
+            if response_format is not None:
+                options["response_format"] = response_format
+        if set_max_tokens:
+            prompt_tokens = estimated_tokens - expected_completion_tokens
+            options["max_tokens"] = self.token_planner.max_tokens_for(
+                model, expected_completion_tokens, prompt_tokens
+            )
+        if stream:
+            options["stream"] = True
+            options["stream_options"] = {"include_usage": True}
+        return options
+
+    def _collect_stream(self, stream, on_delta, deadline, cancel=None):
+        """Read a completion stream, passing content deltas to on_delta.
+
+        Setting the cancel event closes the stream, so an abandoned request
+        stops using tokens and its call slot.
+        """
+        collector = ChatStreamCollector(on_delta)
+        for chunk in stream:
+            if deadline.expired():
+                getattr(stream, "close", lambda: None)()
+                deadline.check("the response finished streaming")
+            if cancel is not None and cancel.is_set():
+                getattr(stream, "close", lambda: None)()
+                raise RequestCancelled("Request abandoned while streaming")
+            collector.add(chunk)
+        return collector.completion()
+
+    def _handle_request_error(
+        self, error, model, api_key, limiter, attempts, started, deadline
+    ):
+        """Prepare a retry for recoverable errors, re-raise anything else"""
+        if isinstance(error, (DeadlineExceeded, RequestCancelled)):
+            raise error
+        if deadline.expired():
+            # Cut off by the job's deadline, not a fault of the model
+            raise DeadlineExceeded(
+                f"Deadline of {deadline.seconds:.0f}s exceeded during the API call"
+            ) from error
+        if self._is_insufficient_quota_error(error) and attempts["pooled"]:
+            # The key is spent, not the model: retry on another pooled key
+            self.key_pool.mark_quota_exhausted(api_key)
+            attempts["last_error"] = error
+        elif self._is_insufficient_quota_error(error):
+            logger.warning(f"Quota exceeded for model {model}: {str(error)}")
+            # Only this key falls back; other users keep their models
+            self.model_router.mark_quota_exhausted(api_key, model)
+            attempts["tried_models"].add(model)
+            attempts["last_error"] = error
+        elif (
+            self._is_rate_limit_error(error)
+            and attempts["rate_limit_retries"] < MAX_RATE_LIMIT_RETRIES
+        ):
+            # Plain RPM/TPM limit: pause all workers on this key and retry
+            attempts["rate_limit_retries"] += 1
+            headers = getattr(getattr(error, "response", None), "headers", None)
+            pause = limiter.penalize(headers)
+            logger.warning(
+                f"Rate limited on model {model}, pausing key for {pause:.2f}s (retry {attempts['rate_limit_retries']}/{MAX_RATE_LIMIT_RETRIES})"
+            )
+        else:
+            # For non-quota errors, record the failure and re-raise immediately
+            self.model_router.record_failure(
+                model, time.monotonic() - started, error=error
+            )
+            raise error
+
+    def _make_api_request(
+        self,
+        messages,
+        temperature=1.0,
+        api_key=None,
+        expected_completion_tokens=COMPLETION_TOKENS_PER_CARD,
+        call_info=None,
+        set_max_tokens=False,
+        on_delta=None,
+        response_schema=None,
+        priority=PRIORITY_BULK,
+        deadline=None,
+        preferred_model=None,
+        cancel=None,
+    ):
+        """Make an API request with rate limiting and model fallback on quota errors.
+
+        With set_max_tokens, max_tokens is derived from the expected completion
+        size and the limits of whichever model serves the call. With on_delta
+        the completion is streamed and each content delta is passed to it as
+        it arrives. response_schema is a (name, JSON schema) pair used for
+        structured outputs on models that support them. priority is the
+        governor lane the call queues in. Each attempt's timeout comes from
+        the deadline's remaining budget. preferred_model is tried ahead of
+        the fallback chain order. Setting the cancel event abandons a
+        streamed call. If call_info is a dict it is filled with
+        the serving model, its latency and finish_reason. Without an API key
+        each attempt uses the pooled key with the most headroom, if a key
+        pool is configured.
+        """
+        pooled = self._uses_pool(api_key)
         # Use provided API key or fall back to default
-        if not api_key:
+        if not api_key and not pooled:
             api_key = self.default_api_key
 
-        if not api_key:
+        if not api_key and not pooled:
             raise ValueError("OpenAI API key is required")
 
-        # Create client with the appropriate API key
-        try:
-            client = openai.OpenAI(api_key=api_key, max_retries=0)
-        except TypeError:
-            # Fallback if installed SDK version doesn't support max_retries kwarg
-            client = openai.OpenAI(api_key=api_key)
-
-        while self.current_model_index < len(self.model_fallback_chain):
-            current_model = self._get_current_model()
+        estimated_tokens = self._estimate_request_tokens(
+            messages, expected_completion_tokens
+        )
+        attempts = {
+            "tried_models": set(),
+            "rate_limit_retries": 0,
+            "last_error": None,
+            "pooled": pooled,
+        }
+        deadline = deadline or Deadline()
+
+        while True:
+            if pooled:
+                api_key = self._pool_key(estimated_tokens, attempts)
+            # Reuse the pooled client for this API key
+            client = self.client_registry.get_client(api_key)
+            limiter = self.rate_limiters.get(api_key)
+            current_model = self._next_model(api_key, attempts, preferred_model)
+            if call_info is not None:
+                call_info["model"] = current_model
+            request_options = self._completion_options(
+                current_model,
+                estimated_tokens,
+                expected_completion_tokens,
+                set_max_tokens,
+                stream=on_delta is not None,
+                response_schema=response_schema,
+            )
+            started = time.monotonic()
             try:
+                # Pace every worker sharing this key before calling upstream
+                waited = limiter.acquire(estimated_tokens, deadline)
+                if waited > 0:
+                    logger.info(f"Rate limiter paced request by {waited:.2f}s")
+
                 # Log the API key being used (first 10 chars for security)
                 logger.info(
                     f"Using OpenAI API key: {api_key[:10]}..."
@@ -87,26 +402,36 @@ class CardGenerator:
                 )
                 logger.info(f"Making API request with model: {current_model}")
 
-                response = client.chat.completions.create(
-                    model=current_model,
-                    messages=messages,
-                    temperature=temperature,
+                with self.governor.slot(api_key, priority, deadline.remaining()):
+                    started = time.monotonic()
+                    raw_response = client.chat.completions.with_raw_response.create(
+                        model=current_model,
+                        messages=messages,
+                        temperature=temperature,
+                        timeout=deadline.call_timeout(),
+                        **request_options,
+                    )
+                    response = raw_response.parse()
+                    if on_delta is not None:
+                        response = self._collect_stream(
+                            response, on_delta, deadline, cancel
+                        )
+                return self._record_response(
+                    current_model,
+                    raw_response.headers,
+                    response,
+                    limiter,
+                    estimated_tokens,
+                    started,
+                    call_info,
                 )
-                return response
 
             except Exception as e:
-                if self._is_insufficient_quota_error(e):
-                    logger.warning(
-                        f"Quota exceeded for model {current_model}: {str(e)}"
-                    )
-                    if not self._try_next_model():
-                        raise e  # Re-raise if no more models to try
-                else:
-                    # For non-quota errors, just re-raise immediately
-                    raise e
-
-        # If we get here, all models have been exhausted
-        raise Exception("All models in fallback chain have exceeded quota")
+                self._handle_request_error(
+                    e, current_model, api_key, limiter, attempts, started, deadline
+                )
+            finally:
+                self.model_router.end_call(current_model)
 
     def _emit_card_generated(self, color, rarity, slot_id, card):
         """Emit card via WebSocket when generated"""
@@ -124,6 +449,7 @@ class CardGenerator:
                     "rarity": card.get("rarity", "Common"),
                     "slot_id": card.get("slot_id", slot_id),
                     "generated_for_theme": card.get("generated_for_theme", ""),
+                    "generated_by_model": card.get("generated_by_model"),
                     "error": card.get("error"),  # Include error if present
                 }
 
@@ -149,6 +475,12 @@ class CardGenerator:
         else:
             logger.debug("WebSocket: No socketio instance available for card emission")
 
+    def _publish_card(self, color, rarity, slot_id, card, job=None):
+        """Emit a finished card via WebSocket and to the job's card listener"""
+        self._emit_card_generated(color, rarity, slot_id, card)
+        if job is not None:
+            job.notify_card(color, rarity, slot_id, card)
+
     def generate_commons(self, theme, api_key=None):
         """Generate a full set of commons based on the theme and ChatGPT-generated design skeleton"""
         # First, generate a design skeleton based on the theme
@@ -253,15 +585,10 @@ class CardGenerator:
                 ],
                 temperature=1.0,
                 api_key=api_key,
+                response_schema=("mtg_card", card_schema()),
             )
 
-            card_json = response.choices[0].message.content
-            # Extract JSON from response
-            start = card_json.find("{")
-            end = card_json.rfind("}") + 1
-            card_data = json.loads(card_json[start:end])
-
-            return card_data
+            return decode_card(response.choices[0].message.content)
 
         except Exception as e:
             # Re-raise the exception instead of returning a fallback card
@@ -394,117 +721,76 @@ class CardGenerator:
                 ],
                 temperature=1.0,
                 api_key=api_key,
+                response_schema=("mtg_card", card_schema()),
             )
 
-            card_json = response.choices[0].message.content
-            # Extract JSON from response
-            start = card_json.find("{")
-            end = card_json.rfind("}") + 1
-            card_data = json.loads(card_json[start:end])
-
-            return card_data
+            return decode_card(response.choices[0].message.content)
 
         except Exception as e:
             # Re-raise the exception instead of returning a fallback card
             raise e
 
+    def _build_skeleton_card_messages(self, theme, color, rarity, slot_id, slot_data):
+        """Build the chat messages for a single skeleton slot"""
+        return build_skeleton_card_messages(theme, color, rarity, slot_id, slot_data)
+
+    def _parse_skeleton_card(self, card_json, theme, slot_id, model=None):
+        """Parse a single card JSON object from the model response"""
+        card_data = decode_card(card_json)
+
+        # Add metadata
+        card_data["slot_id"] = slot_id
+        card_data["generated_for_theme"] = theme
+        if model:
+            card_data["generated_by_model"] = model
+        return card_data
+
     def generate_skeleton_card(
-        self, theme, color, rarity, slot_id, slot_data, api_key=None
+        self, theme, color, rarity, slot_id, slot_data, api_key=None, job=None
     ):
         """Generate a card based on skeleton slot specifications"""
+        job = job or GenerationJob()
         start_time = datetime.now()
         logger.info(
             f"Starting card generation for slot {slot_id} - {color} {rarity} with theme '{theme}'"
         )
         logger.info(f"Slot data: {slot_data}")
 
-        # Build detailed prompt based on slot data
-        color_identity = "colorless" if color == "colorless" else color
-
-        prompt = f"""
-        Create a Magic: The Gathering {rarity} card with the following specifications:
-        
-        Theme: {theme}
-        Color: {color_identity}
-        Slot ID: {slot_id}
-        Slot Requirements: {slot_data.get('description', '')}
-        
-        Additional Context:
-        - Mana Value: {slot_data.get('mana_value', 'flexible')}
-        - Card Type: {slot_data.get('type', 'flexible')}
-        
-        The card should:
-        1. Perfectly fit the "{theme}" theme with creative, immersive flavor
-        2. Meet the specific requirements of slot {slot_id}
-        3. Be appropriate for {rarity} rarity with balanced power level
-        4. Follow Mark Rosewater's design principles and modern Magic templating
-        5. Have properly costed stats and effects following established curves
-        6. Include a memorable, thematic name and evocative flavor text
-        7. Adhere to the color pie and rarity expectations strictly
-        
-        Balance and Design Guidelines:
-        - Follow established mana cost to power/toughness ratios (e.g., 1-mana: 2/1 or 1/2, 2-mana: 2/2 or 3/1, etc.)
-        - {rarity.title()} rarity should have appropriate complexity and power level
-        - Abilities should be costed fairly according to Magic's established precedents
-        - Avoid overpowered effects that break Limited or Constructed formats
-        - Ensure the card fits within {color}'s slice of the color pie
-        - Create meaningful gameplay decisions without being overly complex
-        
-        {"For colorless cards, use generic mana costs and focus on artifacts, Equipment, or colorless creatures with unique abilities." if color == "colorless" else ""}
-        
-        CRITICAL BALANCE REQUIREMENTS:
-        - Creatures: Follow the "Vanilla Test" - stats should be reasonable even without abilities
-        - 1-mana creatures: Usually 2/1, 1/2, or 1/1 with upside
-        - 2-mana creatures: Usually 2/2, 3/1, 1/3, or 2/1 with ability
-        - 3-mana creatures: Usually 3/3, 4/2, 2/4, or 3/2 with ability
-        - Higher costs: Scale appropriately with more stats or powerful abilities
-        - Spells: Cost effects fairly based on existing Magic cards
-        - Avoid "strictly better" versions of existing cards
-        
-        Return the card in this JSON format:
-        {{
-            "name": "Card Name",
-            "mana_cost": "1W",
-            "type": "Creature — Human Soldier",
-            "power": 2,
-            "toughness": 1,
-            "rules_text": "Card abilities text",
-            "flavor_text": "Flavor text here",
-            "rarity": "{rarity.title()}"
-        }}
-        
-        For non-creatures, omit power/toughness fields.
-        """
+        messages = self._build_skeleton_card_messages(
+            theme, color, rarity, slot_id, slot_data
+        )
+        request = (color, rarity, slot_id, slot_data)
 
-        try:
+        def attempt():
             logger.info(f"Sending API request for card {slot_id}...")
+            call_info = {}
             response = self._make_api_request(
-                [
-                    {
-                        "role": "system",
-                        "content": "You are an expert Magic: The Gathering card designer with deep knowledge of game balance, the color pie, and rarity expectations. Create cards that are perfectly balanced according to established Magic design principles. Every card must pass the 'vanilla test' for stats and be appropriately costed. Prioritize balance and playability over flashy effects. Follow Mark Rosewater's design philosophy strictly.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
+                messages,
                 temperature=1.0,
                 api_key=api_key,
+                call_info=call_info,
+                response_schema=("mtg_card", card_schema()),
+                priority=job.priority,
+                deadline=job.deadline,
+                preferred_model=self.tier_policy.model_for(request),
             )
 
             card_json = response.choices[0].message.content
             logger.info(f"Received API response for card {slot_id}, parsing JSON...")
+            card = self._parse_skeleton_card(
+                card_json, theme, slot_id, call_info["model"]
+            )
+            self.tier_policy.record([request], {slot_id: card}, call_info["model"])
+            return card
 
-            # Extract JSON from response
-            start = card_json.find("{")
-            end = card_json.rfind("}") + 1
-
-            if start == -1 or end == 0:
-                raise ValueError("No valid JSON found in response")
-
-            card_data = json.loads(card_json[start:end])
-
-            # Add metadata
-            card_data["slot_id"] = slot_id
-            card_data["generated_for_theme"] = theme
+        try:
+            # Transient failures retry just this slot
+            card_data = job.retry_policy.call(
+                attempt,
+                f"card {slot_id}",
+                on_retry=job.retry_callback("slot", slot_id),
+                deadline=job.deadline,
+            )
 
             generation_time = (datetime.now() - start_time).total_seconds()
             logger.info(
@@ -512,7 +798,7 @@ class CardGenerator:
             )
 
             # Emit the card via WebSocket immediately after generation
-            self._emit_card_generated(color, rarity, slot_id, card_data)
+            self._publish_card(color, rarity, slot_id, card_data, job)
 
             return card_data
 
@@ -524,178 +810,395 @@ class CardGenerator:
             # Re-raise the exception instead of returning a fallback card
             raise e
 
-    def generate_batch_cards(self, theme, card_requests, api_key=None):
-        """Generate multiple cards in a single API call for maximum efficiency"""
-        if not card_requests:
-            return {}
+    def _format_batch_slot(self, index, theme, request):
+        """Prompt section describing one slot of a batch"""
+        return format_batch_slot(index, theme, request, self.compact_slots)
 
-        start_time = datetime.now()
+    def _build_batch_messages(self, theme, card_requests, context=None):
+        """Build the chat messages for a batch of skeleton slots"""
+        return build_batch_messages(theme, card_requests, self.compact_slots, context)
+
+    def _samples_slot_encoding(self):
+        """Whether to report the slot encoding savings of the next batch"""
+        return self.compact_slots and random.random() < self.slot_encoding_sample_rate
+
+    def _report_slot_encoding(self, theme, card_requests, context=None):
+        """Log and record how many prompt tokens the compact slot encoding saved"""
+        compact, verbose = batch_prompt_tokens(theme, card_requests, context)
+        self.prompt_stats.record_encoding(compact, verbose)
         logger.info(
-            f"Starting TRUE BATCH generation of {len(card_requests)} cards for theme '{theme}' in SINGLE API CALL"
+            f"Batch prompt: {compact} tokens for {len(card_requests)} slots "
+            f"({verbose} with the verbose slot encoding, {1 - compact / verbose:.0%} saved)"
         )
 
-        # Log the cards being generated
-        for i, (color, rarity, slot_id, slot_data) in enumerate(card_requests, 1):
-            logger.info(f"  Batch card {i}: {slot_id} ({color} {rarity})")
+    def _accept_batch_card(
+        self, index, card_data, theme, card_requests, received, job, model=None
+    ):
+        """Key one parsed batch card by slot_id and publish it the first time"""
+        if not isinstance(card_data, dict):
+            return
+        # Ensure slot_id is present
+        if "slot_id" not in card_data and index < len(card_requests):
+            card_data["slot_id"] = card_requests[index][2]
+        if "slot_id" not in card_data:
+            logger.warning(f"Card {index+1} missing slot_id: {card_data}")
+            return
+        if card_data["slot_id"] in received:
+            # Already streamed by an earlier attempt at this batch
+            return
+        try:
+            card_data = validate_batch_card(
+                card_data, [slot_id for _, _, slot_id, _ in card_requests]
+            )
+        except MalformedResponseError as e:
+            # Leave the slot missing so only it gets regenerated
+            logger.warning(f"Discarding invalid batch card {index+1}: {e}")
+            return
+
+        card_data["generated_for_theme"] = theme
+        if model:
+            card_data["generated_by_model"] = model
+        if received.setdefault(card_data["slot_id"], card_data) is not card_data:
+            # A hedged duplicate of this batch delivered the slot first
+            return
+        logger.info(
+            f"Parsed batch card {index+1}: '{card_data.get('name', 'Unknown')}' for slot {card_data['slot_id']}"
+        )
 
-        # Build comprehensive batch prompt
-        batch_prompt = f"""
-        Create exactly {len(card_requests)} Magic: The Gathering cards for the "{theme}" theme in a single response.
-        
-        IMPORTANT: You must create exactly {len(card_requests)} cards, one for each specification below.
-        
-        Cards to generate:
-        """
+        # Find the corresponding request to get color and rarity info for WebSocket
+        for color, rarity, slot_id, slot_data in card_requests:
+            if slot_id == card_data["slot_id"]:
+                self._publish_card(color, rarity, slot_id, card_data, job)
+                break
 
-        for i, req in enumerate(card_requests, 1):
-            color, rarity, slot_id, slot_data = req
-            color_identity = "colorless" if color == "colorless" else color
-            batch_prompt += f"""
-        
-        Card {i} (Slot ID: {slot_id}):
-        - Theme: {theme}
-        - Color: {color_identity}
-        - Rarity: {rarity}
-        - Slot ID: {slot_id}
-        - Requirements: {slot_data.get('description', 'Generic slot')}
-        - Mana Value: {slot_data.get('mana_value', 'flexible')}
-        - Card Type: {slot_data.get('type', 'flexible')}
+    def _batch_card_parser(self, theme, card_requests, received, job, call_info=None):
+        """Incremental parser that publishes batch cards as soon as each one closes.
+
+        Returns the parser and a feed(text) callback; text may be a streamed
+        delta or a whole response. Cards are tagged with the model call_info
+        names, which is set before the first delta arrives.
         """
+        parser = JSONArrayStream()
+
+        def feed(text):
+            for index, card_data in parser.feed(text):
+                self._accept_batch_card(
+                    index,
+                    card_data,
+                    theme,
+                    card_requests,
+                    received,
+                    job,
+                    (call_info or {}).get("model"),
+                )
 
-        batch_prompt += f"""
-        
-        DESIGN REQUIREMENTS:
-        1. Each card must perfectly fit the "{theme}" theme with immersive flavor
-        2. Follow Mark Rosewater's design principles and modern Magic templating
-        3. Be appropriate for the specified rarity with balanced power level
-        4. Have memorable, thematic names and evocative flavor text
-        5. Create meaningful gameplay decisions without being overly complex
-        
-        CRITICAL BALANCE REQUIREMENTS:
-        - Creatures: Follow the "Vanilla Test" - stats must be reasonable even without abilities
-        - 1-mana creatures: Usually 2/1, 1/2, or 1/1 with upside
-        - 2-mana creatures: Usually 2/2, 3/1, 1/3, or 2/1 with ability
-        - 3-mana creatures: Usually 3/3, 4/2, 2/4, or 3/2 with ability
-        - Higher costs: Scale appropriately with more stats or powerful abilities
-        - Spells: Cost effects fairly based on existing Magic cards
-        - Avoid "strictly better" versions of existing cards
-        - Respect each color's slice of the color pie strictly
-        - Match rarity expectations for complexity and power level
-        
-        For colorless cards, use generic mana costs and focus on artifacts, Equipment, or colorless creatures.
-        
-        CRITICAL: Return exactly {len(card_requests)} cards as a JSON array. Each card must include the slot_id field.
-        
-        Format:
-        [
-            {{
-                "slot_id": "{card_requests[0][2]}",
-                "name": "Card Name",
-                "mana_cost": "1W",
-                "type": "Creature — Human Soldier",
-                "power": 2,
-                "toughness": 1,
-                "rules_text": "Card abilities text",
-                "flavor_text": "Flavor text here",
-                "rarity": "{card_requests[0][1].title()}"
-            }},
-            {{
-                "slot_id": "{card_requests[1][2] if len(card_requests) > 1 else 'example'}",
-                "name": "Another Card Name",
-                "mana_cost": "2U",
-                "type": "Instant",
-                "rules_text": "Card effect",
-                "flavor_text": "Flavor text",
-                "rarity": "{card_requests[1][1].title() if len(card_requests) > 1 else 'Common'}"
-            }}
+        return parser, feed
+
+    def _check_batch_parse(self, parser, card_requests, received, job=None):
+        """Return the cards received, salvaging truncated or malformed arrays"""
+        if not parser.started:
+            logger.error("No valid JSON array found in response")
+            raise MalformedResponseError("No valid JSON array found in response")
+        logger.info(
+            f"Expected {len(card_requests)} cards, received {len(received)} cards"
+        )
+        if parser.closed and not parser.errors:
+            return dict(received)
+        if not received:
+            raise MalformedResponseError("Batch response ended inside the JSON array")
+        # Keep every complete card; the lost ones are left for repair
+        reason = "malformed" if parser.closed else "truncated"
+        return self._salvage_batch(card_requests, received, job, reason)
+
+    def _salvage_batch(self, card_requests, received, job, reason):
+        """Keep the complete cards of a damaged batch and report the lost slots"""
+        lost_slots = [
+            slot_id for _, _, slot_id, _ in card_requests if slot_id not in received
         ]
-        
-        For non-creatures, omit power/toughness fields.
-        ENSURE: Each card has a unique slot_id matching the specifications above.
-        """
+        logger.warning(
+            f"Salvaged {len(card_requests) - len(lost_slots)}/{len(card_requests)} cards from {reason} batch response, lost slots: {lost_slots}"
+        )
+        if job is not None:
+            job.record_salvage(lost_slots, len(card_requests), reason)
+        return dict(received)
 
-        try:
-            logger.info(f"Sending SINGLE API request for {len(card_requests)} cards...")
-            response = self._make_api_request(
-                [
-                    {
-                        "role": "system",
-                        "content": "You are an expert Magic: The Gathering card designer specializing in batch card creation. You excel at creating multiple balanced, thematic cards in a single response. Always return exactly the number of cards requested in valid JSON array format. Every creature must have appropriate stats for its mana cost, and every spell must be fairly costed according to established Magic design principles.",
-                    },
-                    {"role": "user", "content": batch_prompt},
-                ],
-                temperature=0.9,
-                api_key=api_key,
-            )  # Slightly lower temperature for more consistent JSON formatting
+    def _parse_batch_cards(
+        self, response_text, theme, card_requests, job=None, model=None
+    ):
+        """Parse a JSON array of cards, emitting each one, keyed by slot_id"""
+        received = {}
+        parser, feed = self._batch_card_parser(
+            theme, card_requests, received, job, {"model": model}
+        )
+        feed(response_text)
+        return self._check_batch_parse(parser, card_requests, received, job)
+
+    def _batch_label(self, card_requests):
+        """Short human-readable label for a batch of slots"""
+        first_slot, last_slot = card_requests[0][2], card_requests[-1][2]
+        if first_slot == last_slot:
+            return first_slot
+        return f"{first_slot}..{last_slot} ({len(card_requests)} cards)"
 
-            response_text = response.choices[0].message.content
-            logger.info("Received batch API response, parsing JSON array...")
+    def _log_batch_result(self, result, card_requests, start_time, model):
+        """Log batch throughput and feed it into the hedging latency stats.
 
-            # Extract JSON array from response with better error handling
-            start = response_text.find("[")
-            end = response_text.rfind("]") + 1
+        An entirely empty batch counts as malformed.
+        """
+        generation_time = (datetime.now() - start_time).total_seconds()
+        if result:
+            self.latency_tracker.record(model, len(card_requests), generation_time)
+        logger.info(
+            f"Successfully generated {len(result)} cards in SINGLE BATCH API CALL in {generation_time:.2f}s"
+        )
+        logger.info(
+            f"Batch efficiency: {len(result)/max(generation_time, 0.001):.1f} cards/second"
+        )
+        if not result:
+            raise MalformedResponseError(
+                f"Batch generated 0/{len(card_requests)} cards"
+            )
 
-            if start == -1 or end == 0:
-                logger.error("No valid JSON array found in response")
-                logger.debug(f"Response text: {response_text[:500]}...")
-                raise ValueError("No valid JSON array found in response")
+    def _can_cancel_hedges(self):
+        """Whether the losing attempt of a hedged batch can be stopped early.
 
-            json_text = response_text[start:end]
-            cards_data = json.loads(json_text)
+        Threads only notice cancellation between stream chunks, so without
+        streaming the loser would run to completion and double the tokens.
+        """
+        return self.stream_batches
+
+    def _hedge_threshold(self, api_key, card_requests, job):
+        """Seconds after which a batch gets a hedged duplicate, or None"""
+        if not self.hedging or job.hedge_budget <= 0 or not self._can_cancel_hedges():
+            return None
+        model = self.model_router.select_model(
+            api_key or self.default_api_key,
+            preferred=self.tier_policy.model_for_batch(card_requests),
+        )
+        if model is None:
+            return None
+        return self.latency_tracker.threshold(model, len(card_requests))
+
+    def _hedge_pool(self):
+        """Get the worker pool that runs hedged batch attempts"""
+        with self._hedge_executor_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=self.batch_concurrency * 2 + 2,
+                    thread_name_prefix="card-hedge",
+                )
+            return self._hedge_executor
 
-            if not isinstance(cards_data, list):
-                raise ValueError("Response is not a JSON array")
+    def _call_batch_attempt(self, attempt, card_requests, api_key, job):
+        """Run one batch attempt, racing a duplicate if it outlives its p95.
 
-            # Create result dictionary keyed by slot_id
-            result = {}
-            expected_cards = len(card_requests)
-            actual_cards = len(cards_data)
+        The primary request runs on the calling thread; only the hedge goes
+        to the hedge pool. Both stream into the same received cards, so each
+        slot is emitted once by whichever request delivers it first, and the
+        request that loses the race is cancelled.
+        """
+        threshold = self._hedge_threshold(api_key, card_requests, job)
+        if threshold is None:
+            return attempt()
+
+        label = self._batch_label(card_requests)
+        primary_cancel, hedge_cancel = threading.Event(), threading.Event()
+        hedges = []
+        hedge_lock = threading.Lock()
+
+        def stop_primary(future):
+            if not future.cancelled() and future.exception() is None:
+                primary_cancel.set()
+
+        def launch_hedge():
+            with hedge_lock:
+                if hedge_cancel.is_set() or not job.reserve_hedge():
+                    return
+                logger.info(f"Hedging batch {label} after {threshold:.2f}s")
+                hedges.append(self._hedge_pool().submit(attempt, hedge_cancel))
+                hedges[0].add_done_callback(stop_primary)
+
+        timer = threading.Timer(threshold, launch_hedge)
+        timer.daemon = True
+        timer.start()
+        result, error = None, None
+        try:
+            result = attempt(primary_cancel)
+        except Exception as e:
+            error = e
+        finally:
+            timer.cancel()
+            with hedge_lock:
+                if error is None or not hedges:
+                    # Stop a running hedge, or keep one from starting
+                    hedge_cancel.set()
+
+        if error is None:
+            if hedges:
+                job.record_hedge(label, threshold, "primary")
+            return result
+        if not hedges:
+            raise error
+        try:
+            result = hedges[0].result()
+        except Exception:
+            raise error
+        job.record_hedge(label, threshold, "hedge")
+        return result
+
+    def _record_batch_outcome(self, call_info, card_requests, result):
+        """Feed a parsed batch back into batch sizing and output-size stats"""
+        self.token_planner.record_cards(card_requests, result, call_info["model"])
+        self.tier_policy.record(card_requests, result, call_info["model"])
+        self.batch_sizer.record_success(
+            call_info["model"],
+            len(card_requests),
+            len(result),
+            call_info["latency"],
+            truncated=call_info.get("finish_reason") == "length",
+        )
 
-            logger.info(
-                f"Expected {expected_cards} cards, received {actual_cards} cards"
+    def _record_batch_failure(self, call_info, card_requests, error):
+        """Shrink batches for a model whose batch timed out or came back unparseable"""
+        model = call_info.get("model")
+        if model and classify_error(error) in (
+            "timeout",
+            "invalid_json",
+            "malformed_response",
+        ):
+            self.batch_sizer.record_failure(model, len(card_requests))
+
+    def _missing_requests(self, result, card_requests):
+        """Slot requests a batch response did not cover"""
+        return [request for request in card_requests if request[2] not in result]
+
+    def _check_repair(self, result, card_requests, missing, repair_depth, job):
+        """Decide whether missing slots get a follow-up batch; raise if capped"""
+        if repair_depth >= self.max_repair_depth:
+            missing_slots = [slot_id for _, _, slot_id, _ in missing]
+            raise MalformedResponseError(
+                f"Batch generated {len(card_requests) - len(missing)}/{len(card_requests)} cards, missing slots: {missing_slots}"
             )
+        logger.warning(
+            f"Batch returned {len(card_requests) - len(missing)}/{len(card_requests)} cards, regenerating {len(missing)} missing slots (repair {repair_depth + 1}/{self.max_repair_depth})"
+        )
+        job.record_repair(
+            [slot_id for _, _, slot_id, _ in missing], len(card_requests), repair_depth
+        )
 
-            for i, card_data in enumerate(cards_data):
-                if isinstance(card_data, dict):
-                    # Ensure slot_id is present
-                    if "slot_id" not in card_data and i < len(card_requests):
-                        card_data["slot_id"] = card_requests[i][2]
-
-                    if "slot_id" in card_data:
-                        card_data["generated_for_theme"] = theme
-                        result[card_data["slot_id"]] = card_data
-                        logger.info(
-                            f"Parsed batch card {i+1}: '{card_data.get('name', 'Unknown')}' for slot {card_data['slot_id']}"
-                        )
+    def generate_batch_cards(
+        self,
+        theme,
+        card_requests,
+        api_key=None,
+        job=None,
+        repair_depth=0,
+        context=None,
+    ):
+        """Generate multiple cards in a single API call for maximum efficiency"""
+        if not card_requests:
+            return {}
 
-                        # Find the corresponding request to get color and rarity info for WebSocket
-                        if i < len(card_requests):
-                            color, rarity, slot_id, slot_data = card_requests[i]
-                            self._emit_card_generated(color, rarity, slot_id, card_data)
-                    else:
-                        logger.warning(f"Card {i+1} missing slot_id: {card_data}")
+        job = job or GenerationJob()
+        start_time = datetime.now()
+        logger.info(
+            f"Starting TRUE BATCH generation of {len(card_requests)} cards for theme '{theme}' in SINGLE API CALL"
+        )
 
-            generation_time = (datetime.now() - start_time).total_seconds()
-            logger.info(
-                f"Successfully generated {len(result)} cards in SINGLE BATCH API CALL in {generation_time:.2f}s"
+        # Log the cards being generated
+        for i, (color, rarity, slot_id, slot_data) in enumerate(card_requests, 1):
+            logger.info(f"  Batch card {i}: {slot_id} ({color} {rarity})")
+
+        messages = self._build_batch_messages(theme, card_requests, context)
+        if self._samples_slot_encoding():
+            self._report_slot_encoding(theme, card_requests, context)
+        expected_completion = self.token_planner.estimate_batch_completion(
+            card_requests
+        )
+        # Cards received by any attempt, so a retry never re-emits a slot
+        received = {}
+        response_schema = (
+            "mtg_card_batch",
+            batch_schema([slot_id for _, _, slot_id, _ in card_requests]),
+        )
+        preferred_model = self.tier_policy.model_for_batch(card_requests)
+
+        def attempt(cancel=None):
+            logger.info(f"Sending SINGLE API request for {len(card_requests)} cards...")
+            attempt_started = datetime.now()
+            call_info = {}
+            parser, feed = self._batch_card_parser(
+                theme, card_requests, received, job, call_info
             )
-            logger.info(
-                f"Batch efficiency: {len(result)/generation_time:.1f} cards/second"
+            try:
+                # Slightly lower temperature for more consistent JSON formatting
+                response = self._make_api_request(
+                    messages,
+                    temperature=0.9,
+                    api_key=api_key,
+                    expected_completion_tokens=expected_completion,
+                    call_info=call_info,
+                    set_max_tokens=True,
+                    on_delta=feed if self.stream_batches else None,
+                    response_schema=response_schema,
+                    priority=job.priority,
+                    deadline=job.deadline,
+                    preferred_model=preferred_model,
+                    cancel=cancel,
+                )
+
+                if not self.stream_batches:
+                    logger.info("Received batch API response, parsing JSON array...")
+                    feed(response.choices[0].message.content)
+                result = self._check_batch_parse(parser, card_requests, received, job)
+            except Exception as e:
+                self._record_batch_failure(call_info, card_requests, e)
+                reason = classify_error(e)
+                if not received or reason is None:
+                    raise
+                # The stream broke after some cards arrived: repair only the rest
+                return self._salvage_batch(card_requests, received, job, reason)
+            self._record_batch_outcome(call_info, card_requests, result)
+            self._log_batch_result(
+                result, card_requests, attempt_started, call_info["model"]
             )
+            return result
 
-            # If we didn't get all expected cards, raise an error
-            if len(result) < expected_cards:
-                missing_slots = [
-                    slot_id
-                    for _, _, slot_id, _ in card_requests
-                    if slot_id not in result
-                ]
-                raise ValueError(
-                    f"Batch generated {len(result)}/{expected_cards} cards, missing slots: {missing_slots}"
-                )
+        try:
+            # Transient failures retry this batch only, not the whole set
+            batch_label = self._batch_label(card_requests)
+            result = job.retry_policy.call(
+                lambda: self._call_batch_attempt(attempt, card_requests, api_key, job),
+                f"batch {batch_label}",
+                on_retry=job.retry_callback("batch", batch_label),
+                deadline=job.deadline,
+            )
 
+            # Keep the cards we got and only re-request the missing slots
+            missing = self._missing_requests(result, card_requests)
+            if missing:
+                self._check_repair(result, card_requests, missing, repair_depth, job)
+                result.update(
+                    self.generate_batch_cards(
+                        theme,
+                        missing,
+                        api_key,
+                        job=job,
+                        repair_depth=repair_depth + 1,
+                        context=context,
+                    )
+                )
             return result
 
+        except DeadlineExceeded as e:
+            # Out of time: keep the cards that arrived and report the rest
+            missed = [slot for _, _, slot, _ in card_requests if slot not in received]
+            job.record_missed(missed, e)
+            logger.warning(
+                f"Batch {self._batch_label(card_requests)} stopped by its deadline with {len(card_requests) - len(missed)}/{len(card_requests)} cards"
+            )
+            return dict(received)
+
         except Exception as e:
             generation_time = (datetime.now() - start_time).total_seconds()
             logger.error(f"Batch generation failed after {generation_time:.2f}s: {e}")
@@ -703,12 +1206,8 @@ class CardGenerator:
             # Re-raise the exception instead of falling back to individual generation
             raise e
 
-    def generate_complete_set(self, theme, skeleton, api_key=None):
-        """Generate all cards for a complete set using true batch processing"""
-        start_time = datetime.now()
-        logger.info(
-            f"Starting complete set generation for theme '{theme}' using TRUE BATCH PROCESSING"
-        )
+    def _collect_set_requests(self, skeleton):
+        """Build the empty complete_set structure and the batch plan of slot requests"""
         complete_set = {}
 
         # Handle both skeleton objects and direct skeleton data
@@ -761,34 +1260,210 @@ class CardGenerator:
                                     (color_name, rarity_name, slot["id"], slot)
                                 )
 
-        # Process requests in TRUE batches - generate multiple cards per API call
-        total_cards = len(all_requests)
-        batch_size = 15  # Optimal batch size for GPT-4 to handle reliably
-        logger.info(
-            f"Processing {total_cards} cards in TRUE BATCHES of {batch_size}..."
+        return complete_set, BatchPlanner(
+            all_requests, skeleton_data, route=self.tier_policy.model_for
+        )
+
+    def _place_batch_cards(
+        self, complete_set, batch_requests, batch_cards, label, job=None
+    ):
+        """Place generated cards in the correct positions of complete_set"""
+        unplaced = []
+        for color_name, rarity_name, slot_id, slot_data in batch_requests:
+            if slot_id in batch_cards:
+                complete_set[color_name][rarity_name][slot_id] = batch_cards[slot_id]
+            elif job is not None and job.deadline.expired():
+                # Already reported in job.missed; the set is returned partial
+                continue
+            else:
+                unplaced.append((color_name, rarity_name, slot_id, slot_data))
+        if not unplaced:
+            return
+        error = ValueError(
+            f"{label.title()} generation missed cards {[slot for _, _, slot, _ in unplaced]}"
         )
+        if job is None or job.on_slot_error is None:
+            # If batch generation missed a card, the set fails
+            raise error
+        job.fail_slots(unplaced, error)
 
-        for i in range(0, len(all_requests), batch_size):
-            batch_requests = all_requests[i : i + batch_size]
-            batch_num = (i // batch_size) + 1
-            total_batches = (total_cards + batch_size - 1) // batch_size
+    def _land_batch(self, complete_set, batch_requests, outcome, label, job):
+        """Place the cards of a finished batch future or task.
 
-            logger.info(
-                f"Processing TRUE BATCH {batch_num}/{total_batches} ({len(batch_requests)} cards in single API call)"
+        A batch that raised fails the set, unless the job has a slot error
+        listener: then its slots are reported failed and the set goes on.
+        """
+        try:
+            batch_cards = outcome.result()
+        except Exception as e:
+            if job.on_slot_error is None:
+                raise
+            logger.error(
+                f"{label.title()} {self._batch_label(batch_requests)} failed: {e}"
             )
+            job.fail_slots(batch_requests, e)
+            return
+        self._place_batch_cards(complete_set, batch_requests, batch_cards, label, job)
+
+    def _record_unstarted(self, plan, job):
+        """Report the slots never dispatched because the job stopped early"""
+        if plan:
+            unstarted = [slot_id for _, _, slot_id, _ in plan.pending]
+            reason = "job cancelled" if job.cancelled() else "deadline passed"
+            job.record_missed(unstarted, f"{reason} before the batch started")
+            logger.warning(
+                f"{reason.capitalize()} with {len(unstarted)} slots never dispatched"
+            )
+
+    def _planning_model(self, plan, api_key):
+        """Model the next batch of the plan is sized and routed for"""
+        preferred = plan.next_route()
+        return (
+            self.model_router.select_model(api_key, preferred=preferred)
+            or preferred
+            or self.model_fallback_chain[0]
+        )
+
+    def _next_batch(self, theme, plan, api_key, initial_size):
+        """Carve the next batch off the batch plan; returns (batch, context).
+
+        The batch stays within one color (and, unless they are small, one
+        rarity) and one model tier, holds at most the adaptive batch size for
+        the model the router would pick, and is packed to that model's token
+        budget.
+        """
+        model = self._planning_model(plan, api_key)
+        max_cards = self.batch_sizer.size_for(model, initial_size)
+        candidates = plan.candidates(max_cards)
+
+        def slot_prompt_tokens(request):
+            return count_tokens(self._format_batch_slot(1, theme, request), model)
+
+        sample_messages = self._build_batch_messages(
+            theme, candidates[:1], plan.context_for(candidates)
+        )
+        base_prompt_tokens = sum(
+            count_tokens(message["content"], model) for message in sample_messages
+        ) - slot_prompt_tokens(candidates[0])
+        fits, prompt_tokens, completion_tokens = self.token_planner.fit(
+            candidates, model, max_cards, slot_prompt_tokens, base_prompt_tokens
+        )
+        batch = plan.take(candidates, fits)
+        logger.info(
+            f"Planned {len(batch)} slots ({self._batch_label(batch)}) for {model}: ~{prompt_tokens} prompt + ~{completion_tokens} completion tokens"
+        )
+        return batch, plan.context_for(batch)
+
+    def _dispatch_batches(
+        self,
+        theme,
+        plan,
+        complete_set,
+        batch_size,
+        api_key,
+        label,
+        max_concurrency=None,
+        job=None,
+    ):
+        """Run batches on a bounded worker pool, placing cards as each batch lands.
+
+        Batches are carved from the pending slots as workers free up, so each
+        one uses the batch size the controller currently recommends for the
+        model; batch_size is only the starting size for a model not seen yet.
+        """
+        if not plan:
+            return
+
+        keys = self._key_count(api_key)
+        workers = max(
+            1,
+            min(
+                max_concurrency or self.batch_concurrency * keys,
+                self.per_key_concurrency * keys,
+            ),
+        )
+        key_semaphore = self._key_semaphore(api_key)
+        logger.info(
+            f"Dispatching {len(plan)} cards in {label}ES with up to {workers} in flight"
+        )
+
+        def run_batch(batch_num, batch_requests, context):
+            with key_semaphore:
+                logger.info(
+                    f"Processing {label} {batch_num} ({len(batch_requests)} cards in single API call)"
+                )
+                # Cards are emitted via WebSocket as soon as their batch is parsed
+                return self.generate_batch_cards(
+                    theme, batch_requests, api_key, job=job, context=context
+                )
+
+        executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="card-batch"
+        )
+        futures = {}
+        batch_num = 0
+        try:
+            while (plan and not job.stopped()) or futures:
+                while plan and len(futures) < workers and not job.stopped():
+                    batch_requests, context = self._next_batch(
+                        theme, plan, api_key, batch_size
+                    )
+                    batch_num += 1
+                    future = executor.submit(
+                        run_batch, batch_num, batch_requests, context
+                    )
+                    futures[future] = batch_requests
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._land_batch(
+                        complete_set, futures.pop(future), future, label, job
+                    )
+            self._record_unstarted(plan, job)
+        finally:
+            # Don't start queued batches once the set has failed
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def generate_complete_set(
+        self,
+        theme,
+        skeleton,
+        api_key=None,
+        max_concurrency=None,
+        job=None,
+        offline=False,
+    ):
+        """Generate all cards for a complete set using true batch processing.
+
+        With offline, the set goes through the Batch API; see
+        generate_complete_set_offline.
+        """
+        if offline:
+            return self.generate_complete_set_offline(theme, skeleton, api_key, job)
+        start_time = datetime.now()
+        logger.info(
+            f"Starting complete set generation for theme '{theme}' using TRUE BATCH PROCESSING"
+        )
+        complete_set, plan = self._collect_set_requests(skeleton)
 
-            # Use the actual batch generation method that generates multiple cards in one API call
-            batch_cards = self.generate_batch_cards(theme, batch_requests, api_key)
+        # Process requests in TRUE batches - generate multiple cards per API call
+        total_cards = len(plan)
+        batch_size = 15  # Starting size; adapts per model as batches complete
+        logger.info(
+            f"Processing {total_cards} cards in TRUE BATCHES starting at {batch_size}..."
+        )
 
-            # Place generated cards in the correct positions
-            for color_name, rarity_name, slot_id, slot_data in batch_requests:
-                if slot_id in batch_cards:
-                    complete_set[color_name][rarity_name][slot_id] = batch_cards[
-                        slot_id
-                    ]
-                else:
-                    # If batch generation missed this card, raise an error
-                    raise ValueError(f"Batch generation missed card {slot_id}")
+        self._dispatch_batches(
+            theme,
+            plan,
+            complete_set,
+            batch_size,
+            api_key,
+            "TRUE BATCH",
+            max_concurrency=max_concurrency,
+            job=job or GenerationJob(),
+        )
 
         generation_time = (datetime.now() - start_time).total_seconds()
         logger.info(
@@ -796,90 +1471,145 @@ class CardGenerator:
         )
         return complete_set
 
-    def generate_complete_set_large_batches(self, theme, skeleton, api_key=None):
-        """Generate all cards using large batches for maximum efficiency"""
-        start_time = datetime.now()
-        logger.info(f"Starting LARGE BATCH set generation for theme '{theme}'")
-        complete_set = {}
+    def _offline_request(self, theme, batch_requests, context, model):
+        """Batch API request body for one batch of slots"""
+        messages = self._build_batch_messages(theme, batch_requests, context)
+        expected_completion = self.token_planner.estimate_batch_completion(
+            batch_requests
+        )
+        body = {"model": model, "messages": messages, "temperature": 0.9}
+        body.update(
+            self._completion_options(
+                model,
+                self._estimate_request_tokens(messages, expected_completion),
+                expected_completion,
+                set_max_tokens=True,
+                stream=False,
+                response_schema=(
+                    "mtg_card_batch",
+                    batch_schema([slot_id for _, _, slot_id, _ in batch_requests]),
+                ),
+            )
+        )
+        return body
+
+    def _offline_batch_cards(self, theme, batch_requests, result, model, job):
+        """Cards of one Batch API result; empty if the request failed"""
+        label = self._batch_label(batch_requests)
+        if result is None or "error" in result:
+            logger.warning(
+                f"Offline batch request {label} failed: {(result or {}).get('error', 'no result')}"
+            )
+            return {}
+        try:
+            cards = self._parse_batch_cards(
+                result["content"], theme, batch_requests, job, model
+            )
+        except MalformedResponseError as e:
+            logger.warning(f"Offline batch request {label} was unparseable: {e}")
+            return {}
+        self.token_planner.record_cards(batch_requests, cards, model)
+        self.tier_policy.record(batch_requests, cards, model)
+        return cards
 
-        # Handle both skeleton objects and direct skeleton data
-        if hasattr(skeleton, "get_skeleton_data"):
-            skeleton_data = skeleton.get_skeleton_data()
-        elif hasattr(skeleton, "get_commons_only"):
-            skeleton_data = skeleton.get_commons_only()
-        else:
-            skeleton_data = skeleton
+    def generate_complete_set_offline(self, theme, skeleton, api_key=None, job=None):
+        """Generate all cards for a complete set through the OpenAI Batch API.
 
-        # Collect all card requests for batch processing
-        all_requests = []
+        Every batch is written to one JSONL file, submitted, and polled until
+        the Batch API finishes it; results are mapped back by custom_id.
+        Slots missing from the results are resubmitted in another round, up
+        to the repair depth, and then reported as missed.
+        """
+        api_key = api_key or self.key_pool.choose() or self.default_api_key
+        job = job or GenerationJob(deadline=Deadline(OFFLINE_DEADLINE_SECONDS))
+        start_time = datetime.now()
+        logger.info(f"Starting OFFLINE set generation for theme '{theme}'")
+        complete_set, plan = self._collect_set_requests(skeleton)
+        total_cards = len(plan)
+        unplaced = {slot_id for _, _, slot_id, _ in plan.pending}
 
-        # Initialize complete_set structure
-        for color_name, color_data in skeleton_data.items():
-            complete_set[color_name] = {}
+        try:
+            for round_num in range(self.max_repair_depth + 1):
+                if not plan:
+                    break
+                batches, lines = {}, []
+                while plan:
+                    model = self._planning_model(plan, api_key)
+                    batch_requests, context = self._next_batch(theme, plan, api_key, 25)
+                    custom_id = f"round{round_num}-batch{len(batches) + 1}"
+                    batches[custom_id] = (batch_requests, model)
+                    lines.append(
+                        batch_request_line(
+                            custom_id,
+                            self._offline_request(
+                                theme, batch_requests, context, model
+                            ),
+                        )
+                    )
+                results = self.offline_runner.run(
+                    api_key,
+                    lines,
+                    job.deadline,
+                    metadata={"theme": theme[:200], "round": str(round_num)},
+                    on_submit=lambda batch_id: job.record_offline_batch(
+                        batch_id, round_num
+                    ),
+                )
 
-            if color_name in ["multicolor", "colorless", "lands"]:
-                # Handle special sections
-                for rarity_name, rarity_data in color_data.items():
-                    complete_set[color_name][rarity_name] = {}
+                for custom_id, (batch_requests, model) in batches.items():
+                    cards = self._offline_batch_cards(
+                        theme, batch_requests, results.get(custom_id), model, job
+                    )
+                    missing = self._missing_requests(cards, batch_requests)
+                    for color, rarity, slot_id, _ in batch_requests:
+                        if slot_id in cards:
+                            complete_set[color][rarity][slot_id] = cards[slot_id]
+                            unplaced.discard(slot_id)
+                    if missing and round_num < self.max_repair_depth:
+                        job.record_repair(
+                            [slot_id for _, _, slot_id, _ in missing],
+                            len(batch_requests),
+                            round_num,
+                        )
+                    plan.requeue(missing)
+            job.record_missed(
+                sorted(unplaced), "missing from the offline batch results"
+            )
+        except DeadlineExceeded as e:
+            # The set is returned with the cards of the rounds that finished
+            job.record_missed(sorted(unplaced), e)
 
-                    if isinstance(rarity_data, list):
-                        for slot in rarity_data:
-                            if isinstance(slot, dict) and "id" in slot:
-                                all_requests.append(
-                                    (color_name, rarity_name, slot["id"], slot)
-                                )
-            else:
-                # Handle regular colors
-                for rarity_name, rarity_data in color_data.items():
-                    complete_set[color_name][rarity_name] = {}
+        generation_time = (datetime.now() - start_time).total_seconds()
+        logger.info(
+            f"Completed OFFLINE set generation for '{theme}' in {generation_time:.2f}s ({total_cards} cards)"
+        )
+        return complete_set
 
-                    if isinstance(rarity_data, dict) and not isinstance(
-                        rarity_data, list
-                    ):
-                        # Handle common/uncommon with creatures/spells structure
-                        for card_type, cards in rarity_data.items():
-                            if isinstance(cards, list):
-                                for slot in cards:
-                                    if isinstance(slot, dict) and "id" in slot:
-                                        all_requests.append(
-                                            (color_name, rarity_name, slot["id"], slot)
-                                        )
-                    elif isinstance(rarity_data, list):
-                        # Handle rare/mythic as direct lists
-                        for slot in rarity_data:
-                            if isinstance(slot, dict) and "id" in slot:
-                                all_requests.append(
-                                    (color_name, rarity_name, slot["id"], slot)
-                                )
+    def generate_complete_set_large_batches(
+        self, theme, skeleton, api_key=None, max_concurrency=None, job=None
+    ):
+        """Generate all cards using large batches for maximum efficiency"""
+        start_time = datetime.now()
+        logger.info(f"Starting LARGE BATCH set generation for theme '{theme}'")
+        complete_set, plan = self._collect_set_requests(skeleton)
 
         # Process requests in LARGE batches for maximum efficiency
-        total_cards = len(all_requests)
-        batch_size = 25  # Large batch size for maximum efficiency
+        total_cards = len(plan)
+        batch_size = 25  # Large starting size; adapts per model as batches complete
         logger.info(
-            f"Processing {total_cards} cards in LARGE BATCHES of {batch_size}..."
+            f"Processing {total_cards} cards in LARGE BATCHES starting at {batch_size}..."
         )
 
-        for i in range(0, len(all_requests), batch_size):
-            batch_requests = all_requests[i : i + batch_size]
-            batch_num = (i // batch_size) + 1
-            total_batches = (total_cards + batch_size - 1) // batch_size
-
-            logger.info(
-                f"Processing LARGE BATCH {batch_num}/{total_batches} ({len(batch_requests)} cards in single API call)"
-            )
-
-            # Use the batch generation method for maximum efficiency
-            batch_cards = self.generate_batch_cards(theme, batch_requests, api_key)
-
-            # Place generated cards in the correct positions
-            for color_name, rarity_name, slot_id, slot_data in batch_requests:
-                if slot_id in batch_cards:
-                    complete_set[color_name][rarity_name][slot_id] = batch_cards[
-                        slot_id
-                    ]
-                else:
-                    # If batch generation missed this card, raise an error
-                    raise ValueError(f"Large batch generation missed card {slot_id}")
+        self._dispatch_batches(
+            theme,
+            plan,
+            complete_set,
+            batch_size,
+            api_key,
+            "LARGE BATCH",
+            max_concurrency=max_concurrency,
+            job=job or GenerationJob(),
+        )
 
         generation_time = (datetime.now() - start_time).total_seconds()
         logger.info(
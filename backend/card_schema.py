@@ -0,0 +1,190 @@
+"""
+JSON schemas for structured outputs and the shared validated response decoder
+"""
+
+import json
+import logging
+
+from retry_policy import MalformedResponseError
+
+logger = logging.getLogger(__name__)
+
+# Models that accept response_format={"type": "json_schema", ...}
+STRUCTURED_OUTPUT_MODELS = {"gpt-4o-mini", "gpt-4o"}
+# Models that only support JSON mode (any JSON object, no schema)
+JSON_MODE_MODELS = {"gpt-4-turbo", "gpt-3.5-turbo"}
+
+_STAT = {"anyOf": [{"type": "integer"}, {"type": "string"}, {"type": "null"}]}
+
+CARD_PROPERTIES = {
+    "name": {"type": "string"},
+    "mana_cost": {"type": "string"},
+    "type": {"type": "string"},
+    "power": _STAT,
+    "toughness": _STAT,
+    "rules_text": {"type": "string"},
+    "flavor_text": {"type": "string"},
+    "rarity": {"type": "string"},
+}
+# Fields a decoded card must have; the rest may be omitted by models without
+# structured outputs (e.g. power/toughness on non-creatures)
+CARD_REQUIRED_FIELDS = ("name", "type")
+
+CONCEPT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "description": {"type": "string"},
+        "mechanics": {"type": "array", "items": {"type": "string"}},
+        "archetypes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "colors": {"type": "string"},
+                    "name": {"type": "string"},
+                    "description": {"type": "string"},
+                    "key_cards": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["colors", "name", "description", "key_cards"],
+                "additionalProperties": False,
+            },
+        },
+        "flavor_themes": {"type": "array", "items": {"type": "string"}},
+        "design_notes": {"type": "string"},
+    },
+    "required": [
+        "name",
+        "description",
+        "mechanics",
+        "archetypes",
+        "flavor_themes",
+        "design_notes",
+    ],
+    "additionalProperties": False,
+}
+CONCEPT_REQUIRED_FIELDS = ("name", "description", "archetypes")
+
+
+def card_schema(slot_ids=None):
+    """Strict schema for one card; with slot_ids, slot_id must be one of them"""
+    properties = dict(CARD_PROPERTIES)
+    if slot_ids is not None:
+        properties = {"slot_id": {"type": "string", "enum": list(slot_ids)}}
+        properties.update(CARD_PROPERTIES)
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+def batch_schema(slot_ids):
+    """Strict schema for a batch response: {"cards": [card, ...]}"""
+    return {
+        "type": "object",
+        "properties": {"cards": {"type": "array", "items": card_schema(slot_ids)}},
+        "required": ["cards"],
+        "additionalProperties": False,
+    }
+
+
+def response_format_for(model, name, schema):
+    """response_format for a model: its JSON schema, JSON mode, or None"""
+    if model in STRUCTURED_OUTPUT_MODELS:
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": name, "strict": True, "schema": schema},
+        }
+    if model in JSON_MODE_MODELS:
+        return {"type": "json_object"}
+    return None
+
+
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def _matches(value, schema):
+    """Whether value satisfies the subset of JSON schema used in this module"""
+    if "anyOf" in schema:
+        return any(_matches(value, option) for option in schema["anyOf"])
+    expected = _JSON_TYPES.get(schema.get("type"))
+    if expected is not None:
+        if isinstance(value, bool) and schema["type"] in ("integer", "number"):
+            return False
+        if not isinstance(value, expected):
+            return False
+    if "enum" in schema and value not in schema["enum"]:
+        return False
+    if isinstance(value, list) and "items" in schema:
+        return all(_matches(item, schema["items"]) for item in value)
+    if isinstance(value, dict) and "properties" in schema:
+        return all(
+            _matches(value[key], subschema)
+            for key, subschema in schema["properties"].items()
+            if key in value
+        )
+    return True
+
+
+def validate(instance, schema, required):
+    """Raise MalformedResponseError unless instance matches schema.
+
+    Only the `required` top-level fields must be present; every field that
+    is present must have the type the schema gives it.
+    """
+    if not isinstance(instance, dict):
+        raise MalformedResponseError("Response is not a JSON object")
+    missing = [field for field in required if instance.get(field) in (None, "")]
+    if missing:
+        raise MalformedResponseError(f"Response is missing fields: {missing}")
+    for key, subschema in schema["properties"].items():
+        if key in instance and not _matches(instance[key], subschema):
+            raise MalformedResponseError(
+                f"Field '{key}' does not match the schema: {instance[key]!r}"
+            )
+    return instance
+
+
+def decode_json_object(text, schema, required):
+    """Decode and validate a JSON object response.
+
+    Structured outputs are plain JSON; for models without them the outermost
+    {...} is extracted from the surrounding text first.
+    """
+    text = (text or "").strip()
+    try:
+        instance = json.loads(text)
+    except json.JSONDecodeError:
+        start = text.find("{")
+        end = text.rfind("}") + 1
+        if start == -1 or end == 0:
+            raise MalformedResponseError("No valid JSON found in response")
+        instance = json.loads(text[start:end])
+    return validate(instance, schema, required)
+
+
+def clean_card(card):
+    """Drop null fields, which strict schemas use for omitted power/toughness"""
+    return {key: value for key, value in card.items() if value is not None}
+
+
+def decode_card(text, slot_ids=None):
+    """Decode one card response through the shared validated decoder"""
+    card = decode_json_object(text, card_schema(slot_ids), CARD_REQUIRED_FIELDS)
+    return clean_card(card)
+
+
+def validate_batch_card(card, slot_ids):
+    """Validate one card parsed out of a batch response; returns it cleaned"""
+    required = CARD_REQUIRED_FIELDS + ("slot_id",)
+    return clean_card(validate(card, card_schema(slot_ids), required))
@@ -0,0 +1,180 @@
+"""
+Circuit breakers that stop sending calls to a failing or slow model endpoint
+"""
+
+import os
+import time
+from collections import deque
+
+import openai
+
+# Recent calls per model and endpoint the breaker judges health on
+BREAKER_WINDOW = int(os.getenv("MTG_BREAKER_WINDOW", "20"))
+# Calls in the window before the breaker may open
+BREAKER_MIN_CALLS = int(os.getenv("MTG_BREAKER_MIN_CALLS", "5"))
+# Share of failed calls (timeouts, connection errors, 5xx) that opens the breaker
+BREAKER_ERROR_RATE = float(
+    os.getenv("MTG_BREAKER_ERROR_RATE", os.getenv("MTG_MODEL_MAX_ERROR_RATE", "0.5"))
+)
+# A successful call slower than this, plus the allowance for its completion
+# tokens below, counts as slow
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("MTG_BREAKER_SLOW_CALL_SECONDS", "90"))
+# Extra seconds a call is allowed per 1000 completion tokens it returned
+BREAKER_SLOW_SECONDS_PER_1K_TOKENS = float(
+    os.getenv("MTG_BREAKER_SLOW_SECONDS_PER_1K_TOKENS", "30")
+)
+# Share of slow calls that opens the breaker
+BREAKER_SLOW_CALL_RATE = float(os.getenv("MTG_BREAKER_SLOW_CALL_RATE", "0.5"))
+# Seconds an open breaker rejects calls before letting a probe through
+BREAKER_OPEN_SECONDS = float(os.getenv("MTG_BREAKER_OPEN_SECONDS", "30"))
+# Concurrent probes while half-open, and successes needed to close again
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("MTG_BREAKER_HALF_OPEN_PROBES", "1"))
+
+# Upstream endpoint of the card, batch and concept calls
+CHAT_COMPLETIONS = "chat.completions"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Every model that could serve the call has its circuit open"""
+
+
+def counts_against_circuit(error):
+    """Whether an error says the upstream endpoint is unhealthy.
+
+    Client errors (bad requests, auth, quota) say nothing about the
+    endpoint, so they never open a breaker.
+    """
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and status_code >= 500
+
+
+class CircuitBreaker:
+    """Closed, open and half-open state for one model on one endpoint.
+
+    Opens when the error rate or the slow-call rate over the recent window
+    crosses its threshold. While open every call is rejected, so callers
+    move on to the next model; after open_seconds it turns half-open and
+    lets a few probe calls through, closing again once they succeed and
+    reopening if one fails. Not thread-safe; the model router locks it.
+    """
+
+    def __init__(
+        self,
+        window=BREAKER_WINDOW,
+        min_calls=BREAKER_MIN_CALLS,
+        error_rate=BREAKER_ERROR_RATE,
+        slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+        slow_call_rate=BREAKER_SLOW_CALL_RATE,
+        slow_seconds_per_1k_tokens=BREAKER_SLOW_SECONDS_PER_1K_TOKENS,
+        open_seconds=BREAKER_OPEN_SECONDS,
+        half_open_probes=BREAKER_HALF_OPEN_PROBES,
+    ):
+        self.outcomes = deque(maxlen=window)  # (failed, slow)
+        self.min_calls = max(1, min_calls)
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.slow_seconds_per_1k_tokens = slow_seconds_per_1k_tokens
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.state = CLOSED
+        self.opened_at = None
+        self.reason = None
+        self.trips = 0
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+
+    def _refresh(self, now):
+        if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self.probes_in_flight = 0
+            self.probe_successes = 0
+
+    def allows(self, now=None):
+        """Whether a call could be admitted right now"""
+        self._refresh(time.monotonic() if now is None else now)
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN:
+            return self.probes_in_flight < self.half_open_probes
+        return False
+
+    def admit(self, now=None):
+        """Admit a call, counting it as a probe while half-open"""
+        if not self.allows(now):
+            return False
+        if self.state == HALF_OPEN:
+            self.probes_in_flight += 1
+        return True
+
+    def release(self):
+        """A call admitted by admit() has finished, whatever its outcome"""
+        if self.state == HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+
+    def _open(self, now, reason):
+        self.state = OPEN
+        self.opened_at = now
+        self.reason = reason
+        self.trips += 1
+        self.outcomes.clear()
+
+    def slow_threshold(self, completion_tokens=None):
+        """Seconds after which a call returning this many tokens counts as slow"""
+        allowance = (completion_tokens or 0) / 1000 * self.slow_seconds_per_1k_tokens
+        return self.slow_call_seconds + allowance
+
+    def record(self, latency, failed, now=None, completion_tokens=None):
+        """Record a call's outcome; returns the new state if it changed.
+
+        Large streamed batches take longer, so the slow-call threshold grows
+        with the completion tokens the call returned.
+        """
+        now = time.monotonic() if now is None else now
+        slow = (
+            not failed
+            and latency is not None
+            and latency >= self.slow_threshold(completion_tokens)
+        )
+        previous = self.state
+        self._refresh(now)
+        if self.state == HALF_OPEN:
+            if failed or slow:
+                self._open(now, "probe failed" if failed else "probe slow")
+            else:
+                self.probe_successes += 1
+                if self.probe_successes >= self.half_open_probes:
+                    self.state = CLOSED
+                    self.reason = None
+        elif self.state == CLOSED:
+            self.outcomes.append((failed, slow))
+            if len(self.outcomes) >= self.min_calls:
+                calls = len(self.outcomes)
+                failures = sum(1 for failed, _ in self.outcomes if failed) / calls
+                slow_calls = sum(1 for _, slow in self.outcomes if slow) / calls
+                if failures >= self.error_rate:
+                    self._open(now, f"error rate {failures:.2f}")
+                elif slow_calls >= self.slow_call_rate:
+                    self._open(now, f"slow call rate {slow_calls:.2f}")
+        return self.state if self.state != previous else None
+
+    def to_dict(self, now=None):
+        self._refresh(time.monotonic() if now is None else now)
+        calls = len(self.outcomes)
+        return {
+            "state": self.state,
+            "reason": self.reason,
+            "trips": self.trips,
+            "calls": calls,
+            "error_rate": (
+                round(sum(1 for failed, _ in self.outcomes if failed) / calls, 3)
+                if calls
+                else 0.0
+            ),
+        }
@@ -0,0 +1,65 @@
+"""
+Per-job deadlines and the per-call timeouts derived from them
+"""
+
+import os
+import time
+
+# Upper bound on a single LLM call, with or without a job deadline
+MAX_CALL_TIMEOUT = float(os.getenv("MTG_CALL_TIMEOUT_SECONDS", "120"))
+# Default time budgets for the generation routes (0 disables the deadline)
+CARD_DEADLINE_SECONDS = float(os.getenv("MTG_CARD_DEADLINE_SECONDS", "60"))
+SET_DEADLINE_SECONDS = float(os.getenv("MTG_SET_DEADLINE_SECONDS", "600"))
+CONCEPT_DEADLINE_SECONDS = float(os.getenv("MTG_CONCEPT_DEADLINE_SECONDS", "180"))
+# A call is never given less than this, so it can at least connect
+MIN_CALL_TIMEOUT = 1.0
+
+
+class DeadlineExceeded(Exception):
+    """The job ran out of time before the work could finish"""
+
+
+class Deadline:
+    """A point in time by which a generation job must finish.
+
+    Created by a route and passed down to every LLM call, which derives its
+    timeout from the remaining budget. Without seconds it never expires.
+    """
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds if seconds and seconds > 0 else None
+        self.expires_at = (
+            time.monotonic() + self.seconds if self.seconds is not None else None
+        )
+
+    def remaining(self):
+        """Seconds left, or None without a deadline"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, description="generation"):
+        """Raise DeadlineExceeded once the deadline has passed"""
+        if self.expired():
+            raise DeadlineExceeded(
+                f"Deadline of {self.seconds:.0f}s exceeded before {description}"
+            )
+
+    def allows(self, seconds):
+        """Whether waiting this long still leaves time for the work itself"""
+        remaining = self.remaining()
+        return remaining is None or seconds < remaining
+
+    def call_timeout(self, cap=MAX_CALL_TIMEOUT):
+        """Timeout for the next LLM call: the remaining budget, at most cap"""
+        self.check("the next API call")
+        remaining = self.remaining()
+        if remaining is None:
+            return cap
+        return max(MIN_CALL_TIMEOUT, min(cap, remaining))
+
+    def to_dict(self):
+        return {"seconds": self.seconds, "expired": self.expired()}
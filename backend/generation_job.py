@@ -0,0 +1,176 @@
+"""
+Per-request generation state threaded from the routes down to each LLM call
+"""
+
+import threading
+
+from deadline import Deadline
+from governor import PRIORITY_BULK, PRIORITY_NAMES
+from hedging import HEDGE_BUDGET_PER_JOB
+from retry_policy import RetryPolicy, classify_batch_error
+
+
+class GenerationJob:
+    """Settings and bookkeeping for one generation request.
+
+    Routes create a job, pass it down through the card generator and
+    include job.to_dict() in their response.
+    """
+
+    def __init__(
+        self,
+        retry_policy=None,
+        on_card=None,
+        hedge_budget=None,
+        priority=PRIORITY_BULK,
+        deadline=None,
+        on_slot_error=None,
+    ):
+        self.retry_policy = retry_policy or RetryPolicy(classify=classify_batch_error)
+        # Every LLM call of the job derives its timeout from this deadline
+        self.deadline = deadline or Deadline()
+        self.missed = []
+        # Governor lane for this job's LLM calls (interactive, streaming or bulk)
+        self.priority = priority
+        # Duplicate requests this job may still fire for slow batches
+        self.hedge_budget = (
+            HEDGE_BUDGET_PER_JOB if hedge_budget is None else hedge_budget
+        )
+        self.hedges = []
+        # Called as on_card(color, rarity, slot_id, card) for each finished card
+        self.on_card = on_card
+        # Called as on_slot_error(color, rarity, slot_id, error) for each slot
+        # of a failed batch; with a listener a failed batch no longer fails
+        # the whole set, the rest of the batches keep generating
+        self.on_slot_error = on_slot_error
+        self.failed = []
+        self.retries = []
+        self.repairs = []
+        self.salvaged = []
+        # Batch API batches submitted for an offline set, in order
+        self.offline_batches = []
+        # Set when the client waiting on the job has gone away
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """Stop dispatching new work for the job; in-flight calls finish"""
+        self._cancelled.set()
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def stopped(self):
+        """Whether new work should no longer start: cancelled or out of time"""
+        return self.cancelled() or self.deadline.expired()
+
+    def record_retry(self, scope, target, attempt, reason, error):
+        """Record that a batch or slot is being retried"""
+        with self._lock:
+            self.retries.append(
+                {
+                    "scope": scope,
+                    "target": target,
+                    "attempt": attempt,
+                    "reason": reason,
+                    "error": str(error)[:200],
+                }
+            )
+
+    def record_repair(self, missing_slots, batch_size, depth):
+        """Record a follow-up batch that regenerates slots missing from a batch"""
+        with self._lock:
+            self.repairs.append(
+                {
+                    "missing_slots": list(missing_slots),
+                    "batch_size": batch_size,
+                    "depth": depth + 1,
+                }
+            )
+
+    def record_salvage(self, lost_slots, batch_size, reason):
+        """Record a truncated or broken batch whose complete cards were kept"""
+        with self._lock:
+            self.salvaged.append(
+                {
+                    "lost_slots": list(lost_slots),
+                    "batch_size": batch_size,
+                    "reason": reason,
+                }
+            )
+
+    def record_missed(self, slots, reason):
+        """Record slots left ungenerated because the deadline ran out"""
+        if not slots:
+            return
+        with self._lock:
+            self.missed.append({"slots": list(slots), "reason": str(reason)[:200]})
+
+    def fail_slots(self, card_requests, error):
+        """Record the slots a failed batch left empty and notify the listener"""
+        with self._lock:
+            self.failed.append(
+                {
+                    "slots": [slot_id for _, _, slot_id, _ in card_requests],
+                    "error": str(error)[:200],
+                }
+            )
+        for color, rarity, slot_id, _ in card_requests:
+            self.on_slot_error(color, rarity, slot_id, error)
+
+    def reserve_hedge(self):
+        """Take one hedge from the job's budget; False if it is used up"""
+        with self._lock:
+            if self.hedge_budget <= 0:
+                return False
+            self.hedge_budget -= 1
+            return True
+
+    def record_hedge(self, target, threshold, winner):
+        """Record a hedged batch and which request answered first"""
+        with self._lock:
+            self.hedges.append(
+                {"target": target, "hedge_after": round(threshold, 3), "winner": winner}
+            )
+
+    def record_offline_batch(self, batch_id, round_num):
+        """Record a Batch API batch submitted for an offline round"""
+        with self._lock:
+            self.offline_batches.append({"batch_id": batch_id, "round": round_num})
+
+    def notify_card(self, color, rarity, slot_id, card):
+        """Pass a finished card to the job's listener, if it has one"""
+        if self.on_card:
+            self.on_card(color, rarity, slot_id, card)
+
+    def retry_callback(self, scope, target):
+        """Build an on_retry callback for RetryPolicy.call"""
+        return lambda attempt, reason, error: self.record_retry(
+            scope, target, attempt, reason, error
+        )
+
+    def to_dict(self):
+        """Summary of the run for API responses"""
+        with self._lock:
+            return {
+                "retry_count": len(self.retries),
+                "retries": list(self.retries),
+                "repaired_slots": sum(
+                    len(repair["missing_slots"]) for repair in self.repairs
+                ),
+                "repairs": list(self.repairs),
+                "salvaged_batches": list(self.salvaged),
+                "hedges": list(self.hedges),
+                "offline_batches": list(self.offline_batches),
+                "priority": PRIORITY_NAMES[self.priority],
+                "deadline": self.deadline.to_dict(),
+                "cancelled": self.cancelled(),
+                "partial": bool(self.missed or self.failed),
+                "missed_slots": [
+                    slot for miss in self.missed for slot in miss["slots"]
+                ],
+                "failed_slots": [
+                    slot for failure in self.failed for slot in failure["slots"]
+                ],
+                "failures": list(self.failed),
+            }
@@ -0,0 +1,309 @@
+"""
+Process-wide cap on in-flight LLM calls with priority lanes and weighted fair
+queuing per API key
+"""
+
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from deadline import DeadlineExceeded
+from openai_clients import fingerprint_api_key
+
+logger = logging.getLogger(__name__)
+
+# Upstream LLM calls allowed in flight across the whole process
+MAX_IN_FLIGHT_CALLS = int(os.getenv("MTG_MAX_INFLIGHT_CALLS", "32"))
+# Share of queued capacity per API key, as "<key fingerprint prefix>=<weight>,..."
+KEY_WEIGHTS = os.getenv("MTG_KEY_WEIGHTS", "")
+# Slots only interactive calls may use, so single cards never queue behind bulk
+INTERACTIVE_RESERVED_SLOTS = int(os.getenv("MTG_INTERACTIVE_RESERVED_SLOTS", "4"))
+# Recent queue waits kept for the wait-time percentiles
+WAIT_WINDOW = int(os.getenv("MTG_GOVERNOR_WAIT_WINDOW", "500"))
+
+
+# Priority lanes, served in this order
+PRIORITY_INTERACTIVE = 0  # Single-card requests a user is waiting on
+PRIORITY_STREAMING = 1  # Streamed set generation
+PRIORITY_BULK = 2  # Full-set generation returned in one response
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_STREAMING: "streaming",
+    PRIORITY_BULK: "bulk",
+}
+
+
+def parse_key_weights(value):
+    """Parse MTG_KEY_WEIGHTS into {fingerprint prefix: weight}"""
+    weights = {}
+    for item in (value or "").split(","):
+        prefix, _, weight = item.partition("=")
+        if prefix.strip() and weight.strip():
+            weights[prefix.strip().lower()] = max(0.01, float(weight))
+    return weights
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return None
+    index = min(len(samples) - 1, math.ceil(fraction * len(samples)) - 1)
+    return round(samples[max(0, index)], 3)
+
+
+class _Waiter:
+    """A caller queued for a slot; grant() wakes it once a slot is assigned"""
+
+    def __init__(self, grant, priority):
+        self.grant = grant
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.waited = 0.0
+
+
+class _KeyQueue:
+    """Queued callers and fair-queuing state for one API key"""
+
+    def __init__(self, weight):
+        self.weight = weight
+        self.tag = 0.0  # Virtual start time of the key's next grant
+        self.waiters = {priority: deque() for priority in PRIORITY_NAMES}
+        self.in_flight = 0
+        self.granted = 0
+
+    def queued(self):
+        return sum(len(waiters) for waiters in self.waiters.values())
+
+
+class ConcurrencyGovernor:
+    """Cap in-flight LLM calls process-wide and share them fairly between keys.
+
+    Callers over the cap wait in per-key FIFO queues instead of calling
+    upstream. A freed slot goes to the highest priority lane with queued
+    callers, and within a lane to the backlogged key with the lowest virtual
+    time (start-time fair queuing), so each key gets slots in proportion to
+    its weight no matter how much work it has queued. Streaming and bulk
+    calls can't take the slots reserved for interactive calls.
+    """
+
+    def __init__(
+        self,
+        max_in_flight=MAX_IN_FLIGHT_CALLS,
+        weights=None,
+        wait_window=WAIT_WINDOW,
+        reserved_slots=INTERACTIVE_RESERVED_SLOTS,
+    ):
+        self.max_in_flight = max(1, max_in_flight)
+        # Always leave at least one slot for streaming and bulk calls
+        self.reserved_slots = min(max(0, reserved_slots), self.max_in_flight - 1)
+        self.weights = parse_key_weights(KEY_WEIGHTS) if weights is None else weights
+        self._keys = {}
+        self._in_flight = 0
+        self._queued = {priority: 0 for priority in PRIORITY_NAMES}
+        self._virtual_time = 0.0
+        self._waits = {
+            priority: deque(maxlen=wait_window) for priority in PRIORITY_NAMES
+        }
+        self._lock = threading.Lock()
+
+    def _weight(self, key_hash):
+        for prefix, weight in self.weights.items():
+            if key_hash.startswith(prefix):
+                return weight
+        return 1.0
+
+    def _key_locked(self, key_hash):
+        key = self._keys.get(key_hash)
+        if key is None:
+            key = self._keys[key_hash] = _KeyQueue(self._weight(key_hash))
+        return key
+
+    def _grant_locked(self, key, waiter):
+        """Give a slot to a waiter of this key and advance its virtual time"""
+        self._virtual_time = key.tag
+        key.tag += 1.0 / key.weight
+        key.in_flight += 1
+        key.granted += 1
+        self._in_flight += 1
+        waiter.granted = True
+        waiter.waited = time.monotonic() - waiter.enqueued
+        self._waits[waiter.priority].append(waiter.waited)
+        waiter.grant()
+
+    def _lane_limit(self, priority):
+        """In-flight calls below which a lane may be granted a slot"""
+        if priority == PRIORITY_INTERACTIVE:
+            return self.max_in_flight
+        return self.max_in_flight - self.reserved_slots
+
+    def _dispatch_locked(self):
+        """Hand free slots to queued callers, by lane and then by fair share"""
+        for priority in PRIORITY_NAMES:
+            while self._queued[priority] and self._in_flight < self._lane_limit(
+                priority
+            ):
+                key = min(
+                    (key for key in self._keys.values() if key.waiters[priority]),
+                    key=lambda key: key.tag,
+                )
+                self._queued[priority] -= 1
+                self._grant_locked(key, key.waiters[priority].popleft())
+            if self._queued[priority]:
+                # Lower lanes wait until this one is drained
+                return
+
+    def _enqueue(self, api_key, grant, priority):
+        """Queue a caller for a slot, granting it right away if one is free"""
+        waiter = _Waiter(grant, priority)
+        with self._lock:
+            key = self._key_locked(fingerprint_api_key(api_key))
+            if not key.queued():
+                # A key returning from idle can't claim slots for time it sat out
+                key.tag = max(key.tag, self._virtual_time)
+            key.waiters[priority].append(waiter)
+            self._queued[priority] += 1
+            self._dispatch_locked()
+        return waiter
+
+    def _cancel(self, api_key, waiter):
+        """Withdraw a queued caller; returns False if it was already granted"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            key = self._keys[fingerprint_api_key(api_key)]
+            key.waiters[waiter.priority].remove(waiter)
+            self._queued[waiter.priority] -= 1
+            return True
+
+    def acquire(self, api_key, priority=PRIORITY_BULK, timeout=None):
+        """Block until a slot is free for this key; returns seconds waited.
+
+        Raises DeadlineExceeded if no slot frees up within timeout seconds.
+        """
+        granted = threading.Event()
+        waiter = self._enqueue(api_key, granted.set, priority)
+        if not granted.wait(timeout) and self._cancel(api_key, waiter):
+            raise DeadlineExceeded(
+                f"Deadline exceeded after queueing {timeout:.1f}s for a call slot"
+            )
+        return waiter.waited
+
+    async def acquire_async(self, api_key, priority=PRIORITY_BULK, timeout=None):
+        """Wait without blocking the event loop; returns seconds waited"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def deliver():
+            if future.cancelled():
+                self.release(api_key)
+            else:
+                future.set_result(None)
+
+        waiter = self._enqueue(
+            api_key, lambda: loop.call_soon_threadsafe(deliver), priority
+        )
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            # A grant racing the timeout is handed back by deliver()
+            self._cancel(api_key, waiter)
+            raise DeadlineExceeded(
+                f"Deadline exceeded after queueing {timeout:.1f}s for a call slot"
+            )
+        except asyncio.CancelledError:
+            if not self._cancel(api_key, waiter) and future.done():
+                if not future.cancelled():
+                    self.release(api_key)
+            raise
+        return waiter.waited
+
+    def release(self, api_key):
+        """Return a slot and pass it to the next queued caller"""
+        key_hash = fingerprint_api_key(api_key)
+        with self._lock:
+            key = self._keys[key_hash]
+            key.in_flight -= 1
+            self._in_flight -= 1
+            self._dispatch_locked()
+            if not key.in_flight and not key.queued() and key.tag <= self._virtual_time:
+                # Idle and not ahead of its share: nothing worth remembering
+                del self._keys[key_hash]
+
+    @contextmanager
+    def slot(self, api_key, priority=PRIORITY_BULK, timeout=None):
+        """Hold one in-flight call slot for the duration of the block"""
+        waited = self.acquire(api_key, priority, timeout)
+        if waited > 0.001:
+            logger.info(
+                f"Concurrency governor queued {PRIORITY_NAMES[priority]} call for {waited:.2f}s"
+            )
+        try:
+            yield
+        finally:
+            self.release(api_key)
+
+    @asynccontextmanager
+    async def slot_async(self, api_key, priority=PRIORITY_BULK, timeout=None):
+        """Async version of slot()"""
+        waited = await self.acquire_async(api_key, priority, timeout)
+        if waited > 0.001:
+            logger.info(
+                f"Concurrency governor queued {PRIORITY_NAMES[priority]} call for {waited:.2f}s"
+            )
+        try:
+            yield
+        finally:
+            self.release(api_key)
+
+    def snapshot(self):
+        """In-flight calls, queue depth per lane and key, and queue waits"""
+        with self._lock:
+            lanes = {}
+            for priority, name in PRIORITY_NAMES.items():
+                waits = sorted(self._waits[priority])
+                lanes[name] = {
+                    "queued": self._queued[priority],
+                    "wait_seconds": {
+                        "samples": len(waits),
+                        "p50": _percentile(waits, 0.5),
+                        "p95": _percentile(waits, 0.95),
+                        "p99": _percentile(waits, 0.99),
+                        "max": round(waits[-1], 3) if waits else None,
+                    },
+                }
+            keys = {
+                key_hash[:12]: {
+                    "weight": key.weight,
+                    "in_flight": key.in_flight,
+                    "queued": key.queued(),
+                    "granted": key.granted,
+                }
+                for key_hash, key in self._keys.items()
+                if key.in_flight or key.queued()
+            }
+            return {
+                "max_in_flight": self.max_in_flight,
+                "interactive_reserved": self.reserved_slots,
+                "in_flight": self._in_flight,
+                "queued": sum(self._queued.values()),
+                "lanes": lanes,
+                "keys": keys,
+            }
+
+
+_default_governor = None
+_default_governor_lock = threading.Lock()
+
+
+def get_concurrency_governor():
+    """Get the process-wide concurrency governor, creating it on first use"""
+    global _default_governor
+    with _default_governor_lock:
+        if _default_governor is None:
+            _default_governor = ConcurrencyGovernor()
+        return _default_governor
@@ -0,0 +1,83 @@
+"""
+Rolling batch latency percentiles used to hedge slow batch requests
+"""
+
+import math
+import os
+import threading
+from collections import deque
+
+# Hedged requests are optional; set MTG_HEDGING=1 to enable them
+HEDGING_ENABLED = os.getenv("MTG_HEDGING", "").lower() in ("1", "true", "yes")
+# A batch slower than this latency percentile for its model and size is hedged
+HEDGE_PERCENTILE = float(os.getenv("MTG_HEDGE_PERCENTILE", "0.95"))
+# Duplicate requests a single generation job may fire
+HEDGE_BUDGET_PER_JOB = int(os.getenv("MTG_HEDGE_BUDGET", "3"))
+# Batches observed for a model and size before its percentile is trusted
+HEDGE_MIN_SAMPLES = int(os.getenv("MTG_HEDGE_MIN_SAMPLES", "10"))
+LATENCY_WINDOW = int(os.getenv("MTG_HEDGE_LATENCY_WINDOW", "100"))
+
+
+class RequestCancelled(Exception):
+    """A hedged request lost the race and was abandoned mid-stream"""
+
+
+def size_bucket(batch_size):
+    """Group batch sizes into powers of two (1, 2-3, 4-7, 8-15, ...)"""
+    return 2 ** (max(1, batch_size).bit_length() - 1)
+
+
+class BatchLatencyTracker:
+    """Rolling batch latencies per (model, batch size bucket)"""
+
+    def __init__(
+        self,
+        percentile=HEDGE_PERCENTILE,
+        min_samples=HEDGE_MIN_SAMPLES,
+        window=LATENCY_WINDOW,
+    ):
+        self.percentile = percentile
+        self.min_samples = max(1, min_samples)
+        self.window = window
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, batch_size, seconds):
+        """Record how long a batch of this size took on this model"""
+        key = (model, size_bucket(batch_size))
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def threshold(self, model, batch_size):
+        """Latency past which a batch should be hedged, or None without data"""
+        with self._lock:
+            samples = sorted(self._latencies.get((model, size_bucket(batch_size)), ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, math.ceil(self.percentile * len(samples)) - 1)
+        return samples[index]
+
+    def snapshot(self):
+        """Sample counts and hedge thresholds for monitoring"""
+        with self._lock:
+            keys = list(self._latencies)
+        return {
+            f"{model}/{bucket}+": {
+                "samples": len(self._latencies[(model, bucket)]),
+                "hedge_after": self.threshold(model, bucket),
+            }
+            for model, bucket in keys
+        }
+
+
+_default_tracker = None
+_default_tracker_lock = threading.Lock()
+
+
+def get_batch_latency_tracker():
+    """Get the process-wide batch latency tracker, creating it on first use"""
+    global _default_tracker
+    with _default_tracker_lock:
+        if _default_tracker is None:
+            _default_tracker = BatchLatencyTracker()
+        return _default_tracker
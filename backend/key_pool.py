@@ -0,0 +1,123 @@
+"""
+Optional server-side pool of OpenAI API keys that batches are spread across
+"""
+
+import logging
+import os
+import threading
+import time
+
+from openai_clients import fingerprint_api_key
+from rate_limiter import get_rate_limiter_registry
+
+logger = logging.getLogger(__name__)
+
+# Server-side keys, comma separated, and/or a file with one key per line
+POOL_KEYS = os.getenv("MTG_API_KEYS", "")
+POOL_KEYS_FILE = os.getenv("MTG_API_KEYS_FILE", "")
+# Seconds a key that ran out of quota stays out of rotation
+KEY_QUOTA_RECOVERY_SECONDS = float(os.getenv("MTG_KEY_POOL_RECOVERY_SECONDS", "300"))
+
+
+def load_pool_keys(value=POOL_KEYS, path=POOL_KEYS_FILE):
+    """Keys from MTG_API_KEYS and MTG_API_KEYS_FILE, without duplicates"""
+    keys = [key.strip() for key in (value or "").split(",")]
+    if path:
+        try:
+            with open(path, encoding="utf-8") as handle:
+                keys.extend(line.split("#", 1)[0].strip() for line in handle)
+        except OSError as e:
+            # A bad path shouldn't stop the server; the env keys still apply
+            logger.warning(f"Could not read MTG_API_KEYS_FILE {path}: {e}")
+    return list(dict.fromkeys(key for key in keys if key))
+
+
+class ApiKeyPool:
+    """Pick the pooled key with the most rate-limit headroom for each call.
+
+    Headroom comes from each key's shared rate limiter, so keys fill up
+    evenly and a key paused by a 429 is passed over. A key that runs out of
+    quota leaves the rotation for a recovery period instead of the call
+    falling back to a weaker model.
+    """
+
+    def __init__(
+        self,
+        keys=None,
+        rate_limiters=None,
+        recovery_seconds=KEY_QUOTA_RECOVERY_SECONDS,
+    ):
+        self.keys = load_pool_keys() if keys is None else list(keys)
+        self.rate_limiters = rate_limiters or get_rate_limiter_registry()
+        self.recovery_seconds = recovery_seconds
+        self._blocked = {}  # key -> out of rotation until
+        self._calls = {key: 0 for key in self.keys}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __bool__(self):
+        return bool(self.keys)
+
+    def _available_locked(self, now):
+        for key, until in list(self._blocked.items()):
+            if until <= now:
+                del self._blocked[key]
+                logger.info(
+                    f"Pooled key {fingerprint_api_key(key)[:8]} back in rotation"
+                )
+        return [key for key in self.keys if key not in self._blocked]
+
+    def choose(self, tokens=0):
+        """Key with the most headroom for a call of this size, or None"""
+        with self._lock:
+            available = self._available_locked(time.monotonic())
+            if not available:
+                return None
+            # Least wait first, then the key that has served the fewest calls
+            key = min(
+                available,
+                key=lambda key: (
+                    self.rate_limiters.get(key).headroom(tokens),
+                    self._calls[key],
+                ),
+            )
+            self._calls[key] += 1
+            return key
+
+    def mark_quota_exhausted(self, key):
+        """Take a key out of rotation until its recovery period passes"""
+        with self._lock:
+            self._blocked[key] = time.monotonic() + self.recovery_seconds
+            remaining = len(self.keys) - len(self._blocked)
+        logger.warning(
+            f"Pooled key {fingerprint_api_key(key)[:8]} out of quota, {remaining}/{len(self.keys)} keys left in rotation"
+        )
+
+    def snapshot(self):
+        """Rotation state, calls served and rate-limit headroom per key"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                fingerprint_api_key(key)[:12]: {
+                    "in_rotation": key not in self._blocked,
+                    "out_for": round(max(0.0, self._blocked.get(key, now) - now), 1),
+                    "calls": self._calls[key],
+                    "headroom": self.rate_limiters.get(key).snapshot(),
+                }
+                for key in self.keys
+            }
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_api_key_pool():
+    """Get the process-wide API key pool, creating it on first use"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ApiKeyPool()
+        return _default_pool
@@ -0,0 +1,158 @@
+"""
+Micro-batching of single-card requests into batch generation calls
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import Future
+
+from deadline import CARD_DEADLINE_SECONDS, Deadline, DeadlineExceeded
+from generation_job import GenerationJob
+from governor import PRIORITY_INTERACTIVE
+from model_tiers import get_model_tier_policy
+from openai_clients import fingerprint_api_key
+
+logger = logging.getLogger(__name__)
+
+# How long a single-card request waits for others to share its call (0 disables)
+MICRO_BATCH_WINDOW_MS = float(os.getenv("MTG_MICRO_BATCH_WINDOW_MS", "150"))
+# A pending micro-batch is dispatched early once it holds this many cards
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MTG_MICRO_BATCH_MAX_SIZE", "15"))
+
+
+class _PendingBatch:
+    """Single-card requests collected for one API key and theme"""
+
+    def __init__(self, api_key, theme):
+        self.api_key = api_key
+        self.theme = theme
+        self.requests = []  # (color, rarity, slot_id, slot_data)
+        self.futures = {}  # slot_id -> Future
+        self.timer = None
+
+
+class MicroBatcher:
+    """Hold single-card requests briefly and generate them in one call.
+
+    Requests for the same API key, theme and model tier that arrive within
+    the window are sent as one generate_batch_cards call; each caller gets
+    its own card back. A window with a single request uses generate_skeleton_card.
+    """
+
+    def __init__(
+        self,
+        get_generator,
+        window_ms=MICRO_BATCH_WINDOW_MS,
+        max_batch_size=MICRO_BATCH_MAX_SIZE,
+        tier_policy=None,
+    ):
+        self.get_generator = get_generator
+        self.tier_policy = tier_policy or get_model_tier_policy()
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self._pending = {}  # (key hash, theme, preferred model) -> _PendingBatch
+        self._lock = threading.Lock()
+
+    def generate_card(self, theme, color, rarity, slot_id, slot_data, api_key):
+        """Generate one card, possibly batched with others.
+
+        Returns (card, job, batch_size), where job is shared by the batch.
+        """
+        if self.window <= 0:
+            job = GenerationJob(
+                priority=PRIORITY_INTERACTIVE, deadline=Deadline(CARD_DEADLINE_SECONDS)
+            )
+            card = self.get_generator().generate_skeleton_card(
+                theme, color, rarity, slot_id, slot_data, api_key, job=job
+            )
+            return card, job, 1
+
+        future = Future()
+        request = (color, rarity, slot_id, slot_data)
+        # A common never rides along in a mythic's batch, or the reverse
+        key = (fingerprint_api_key(api_key), theme, self.tier_policy.model_for(request))
+        ready = []
+        with self._lock:
+            batch = self._pending.get(key)
+            if batch is not None and slot_id in batch.futures:
+                # The same slot can't appear twice in one batch; send this one now
+                ready.append(self._detach_locked(key))
+                batch = None
+            if batch is None:
+                batch = self._pending[key] = _PendingBatch(api_key, theme)
+                batch.timer = threading.Timer(self.window, self._flush, args=(key,))
+                batch.timer.daemon = True
+                batch.timer.start()
+            batch.requests.append(request)
+            batch.futures[slot_id] = future
+            if len(batch.requests) >= self.max_batch_size:
+                ready.append(self._detach_locked(key))
+
+        for full_batch in ready:
+            threading.Thread(
+                target=self._dispatch,
+                args=(full_batch,),
+                name="micro-batch",
+                daemon=True,
+            ).start()
+        return future.result()
+
+    def _detach_locked(self, key):
+        """Remove a pending batch so no more requests join it"""
+        batch = self._pending.pop(key)
+        batch.timer.cancel()
+        return batch
+
+    def _flush(self, key):
+        """Timer callback: dispatch the batch whose window has closed"""
+        with self._lock:
+            batch = self._pending.get(key)
+            if batch is None or batch.timer is not threading.current_thread():
+                return  # Already dispatched early
+            del self._pending[key]
+        self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        """Generate a collected batch and hand each card to its caller"""
+        job = GenerationJob(
+            priority=PRIORITY_INTERACTIVE, deadline=Deadline(CARD_DEADLINE_SECONDS)
+        )
+        try:
+            generator = self.get_generator()
+            if len(batch.requests) == 1:
+                color, rarity, slot_id, slot_data = batch.requests[0]
+                cards = {
+                    slot_id: generator.generate_skeleton_card(
+                        batch.theme,
+                        color,
+                        rarity,
+                        slot_id,
+                        slot_data,
+                        batch.api_key,
+                        job=job,
+                    )
+                }
+            else:
+                logger.info(
+                    f"Micro-batching {len(batch.requests)} single-card requests for theme '{batch.theme}'"
+                )
+                cards = generator.generate_batch_cards(
+                    batch.theme, batch.requests, batch.api_key, job=job
+                )
+        except Exception as e:
+            for future in batch.futures.values():
+                future.set_exception(e)
+            return
+
+        for slot_id, future in batch.futures.items():
+            if slot_id in cards:
+                future.set_result((cards[slot_id], job, len(batch.requests)))
+            elif job.deadline.expired():
+                future.set_exception(
+                    DeadlineExceeded(f"Deadline exceeded before card {slot_id}")
+                )
+            else:
+                future.set_exception(
+                    ValueError(f"Micro-batch generation missed card {slot_id}")
+                )
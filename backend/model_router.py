@@ -0,0 +1,258 @@
+"""
+Adaptive model routing with per-API-key fallback state and rolling model health
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from circuit_breaker import (
+    CHAT_COMPLETIONS,
+    CLOSED,
+    CircuitBreaker,
+    counts_against_circuit,
+)
+from openai_clients import fingerprint_api_key
+
+logger = logging.getLogger(__name__)
+
+# Define model fallback chain (in order of preference)
+MODEL_FALLBACK_CHAIN = [
+    "gpt-4o-mini",  # Cheapest and fastest
+    "gpt-4o",  # More capable
+    "gpt-4-turbo",  # Fallback
+    "gpt-4",  # Last resort
+    "gpt-3.5-turbo",  # Final fallback
+]
+
+# Seconds before a model that hit quota for a key is tried again for that key
+QUOTA_RECOVERY_SECONDS = float(os.getenv("MTG_MODEL_RECOVERY_SECONDS", "300"))
+# Number of recent calls per model used for latency and error-rate stats
+STATS_WINDOW = int(os.getenv("MTG_MODEL_STATS_WINDOW", "50"))
+# Another model must be this much faster (seconds per completion token ratio)
+# to override chain order
+SPEEDUP_THRESHOLD = float(os.getenv("MTG_MODEL_SPEEDUP_THRESHOLD", "0.75"))
+
+
+class ModelStats:
+    """Rolling latency and error rate over a model's most recent calls"""
+
+    def __init__(self, window=STATS_WINDOW):
+        # (latency seconds or None, succeeded, completion tokens or None)
+        self.calls = deque(maxlen=window)
+
+    def record(self, latency, succeeded, completion_tokens=None):
+        self.calls.append((latency, succeeded, completion_tokens))
+
+    @property
+    def error_rate(self):
+        if not self.calls:
+            return 0.0
+        return sum(1 for _, ok, _ in self.calls if not ok) / len(self.calls)
+
+    @property
+    def average_latency(self):
+        latencies = [latency for latency, ok, _ in self.calls if ok and latency]
+        if not latencies:
+            return None
+        return sum(latencies) / len(latencies)
+
+    @property
+    def seconds_per_token(self):
+        """Latency per completion token, comparable across call sizes"""
+        timed = [
+            (latency, tokens)
+            for latency, ok, tokens in self.calls
+            if ok and latency and tokens
+        ]
+        if not timed:
+            return None
+        return sum(latency for latency, _ in timed) / sum(tokens for _, tokens in timed)
+
+    def to_dict(self):
+        return {
+            "calls": len(self.calls),
+            "error_rate": round(self.error_rate, 3),
+            "average_latency": (
+                round(self.average_latency, 3) if self.average_latency else None
+            ),
+            "ms_per_token": (
+                round(self.seconds_per_token * 1000, 3)
+                if self.seconds_per_token
+                else None
+            ),
+        }
+
+
+class ModelRouter:
+    """Pick a model per call from the fallback chain.
+
+    Quota exhaustion is tracked per API key and expires after a recovery
+    period, so one user's quota never downgrades another user's requests.
+    Among the models a key may use, the first in chain order is
+    picked unless another one is clearly faster per completion token over
+    the rolling window, so big batches on one model and single cards on
+    another compare fairly.
+    Models whose circuit breaker is open for the endpoint are skipped
+    entirely until a half-open probe shows they have recovered.
+    """
+
+    def __init__(
+        self,
+        models=None,
+        recovery_seconds=QUOTA_RECOVERY_SECONDS,
+        speedup_threshold=SPEEDUP_THRESHOLD,
+    ):
+        self.models = list(models or MODEL_FALLBACK_CHAIN)
+        self.recovery_seconds = recovery_seconds
+        self.speedup_threshold = speedup_threshold
+        self._stats = {model: ModelStats() for model in self.models}
+        self._quota_blocked = {}  # key hash -> {model: blocked until}
+        self._breakers = {}  # (endpoint, model) -> CircuitBreaker
+        self._lock = threading.Lock()
+
+    def _available_models_locked(self, key_hash, now):
+        """Models not currently blocked by quota for this key"""
+        blocked = self._quota_blocked.get(key_hash, {})
+        for model, until in list(blocked.items()):
+            if until <= now:
+                del blocked[model]
+                logger.info(f"Model {model} recovered for key {key_hash[:8]}")
+        return [model for model in self.models if model not in blocked]
+
+    def _breaker_locked(self, endpoint, model):
+        breaker = self._breakers.get((endpoint, model))
+        if breaker is None:
+            breaker = self._breakers[(endpoint, model)] = CircuitBreaker()
+        return breaker
+
+    def select_model(
+        self, api_key, exclude=(), endpoint=CHAT_COMPLETIONS, preferred=None
+    ):
+        """Return the best model for this key, or None if every model is blocked.
+
+        A preferred model (from the tier policy) is picked whenever it is
+        available; otherwise the rest of the chain is used in order.
+        """
+        key_hash = fingerprint_api_key(api_key)
+        with self._lock:
+            now = time.monotonic()
+            candidates = [
+                model
+                for model in self._available_models_locked(key_hash, now)
+                if model not in exclude
+                and self._breaker_locked(endpoint, model).allows(now)
+            ]
+            if not candidates:
+                return None
+            if preferred in candidates:
+                return preferred
+
+            # Keep chain order unless another healthy model is clearly faster
+            preferred = candidates[0]
+            preferred_latency = self._stats[preferred].seconds_per_token
+            if preferred_latency is None:
+                return preferred
+            timed = [
+                (self._stats[model].seconds_per_token, model)
+                for model in candidates
+                if self._stats[model].seconds_per_token is not None
+            ]
+            fastest_latency, fastest = min(timed)
+            if fastest_latency < preferred_latency * self.speedup_threshold:
+                return fastest
+            return preferred
+
+    def mark_quota_exhausted(self, api_key, model):
+        """Stop routing this key to a model until its recovery period passes"""
+        key_hash = fingerprint_api_key(api_key)
+        with self._lock:
+            blocked = self._quota_blocked.setdefault(key_hash, {})
+            blocked[model] = time.monotonic() + self.recovery_seconds
+        logger.info(
+            f"Model {model} quota exhausted for key {key_hash[:8]}, retrying it in {self.recovery_seconds:.0f}s"
+        )
+
+    def begin_call(self, model, endpoint=CHAT_COMPLETIONS):
+        """Admit a call through the model's circuit; False if it is open"""
+        with self._lock:
+            return self._breaker_locked(endpoint, model).admit()
+
+    def end_call(self, model, endpoint=CHAT_COMPLETIONS):
+        """Release a call admitted by begin_call, after its outcome is recorded"""
+        with self._lock:
+            self._breaker_locked(endpoint, model).release()
+
+    def open_circuits(self, endpoint=CHAT_COMPLETIONS):
+        """Models whose circuit currently rejects calls on this endpoint"""
+        with self._lock:
+            return [
+                model
+                for model in self.models
+                if not self._breaker_locked(endpoint, model).allows()
+            ]
+
+    def _record_circuit_locked(
+        self, endpoint, model, latency, failed, completion_tokens=None
+    ):
+        breaker = self._breaker_locked(endpoint, model)
+        changed = breaker.record(latency, failed, completion_tokens=completion_tokens)
+        if changed == CLOSED:
+            logger.info(f"Circuit for {model} on {endpoint} closed after probe")
+        elif changed:
+            logger.warning(
+                f"Circuit for {model} on {endpoint} is {changed} ({breaker.reason}), routing to the next model"
+            )
+
+    def record_success(
+        self, model, latency, endpoint=CHAT_COMPLETIONS, completion_tokens=None
+    ):
+        """Record a successful call, its latency and completion size"""
+        with self._lock:
+            self._stats.setdefault(model, ModelStats()).record(
+                latency, True, completion_tokens
+            )
+            self._record_circuit_locked(
+                endpoint, model, latency, False, completion_tokens
+            )
+
+    def record_failure(
+        self, model, latency=None, error=None, endpoint=CHAT_COMPLETIONS
+    ):
+        """Record a failed call (timeouts, server errors, bad responses).
+
+        Only upstream failures count against the model's circuit; without
+        an error the failure is assumed to be one.
+        """
+        with self._lock:
+            self._stats.setdefault(model, ModelStats()).record(latency, False)
+            if error is None or counts_against_circuit(error):
+                self._record_circuit_locked(endpoint, model, latency, True)
+
+    def snapshot(self):
+        """Per-model health stats for monitoring"""
+        with self._lock:
+            return {model: stats.to_dict() for model, stats in self._stats.items()}
+
+    def circuits_snapshot(self):
+        """Circuit breaker state per endpoint and model"""
+        with self._lock:
+            circuits = {}
+            for (endpoint, model), breaker in self._breakers.items():
+                circuits.setdefault(endpoint, {})[model] = breaker.to_dict()
+            return circuits
+
+
+_default_router = None
+_default_router_lock = threading.Lock()
+
+
+def get_model_router():
+    """Get the process-wide model router, creating it on first use"""
+    global _default_router
+    with _default_router_lock:
+        if _default_router is None:
+            _default_router = ModelRouter()
+        return _default_router
@@ -0,0 +1,118 @@
+"""
+Rarity-tiered model routing: the preferred model for each skeleton slot
+"""
+
+import os
+import threading
+from collections import Counter
+
+from token_budget import normalize_rarity, slot_kind
+
+# Ordered "<selector>=<model>" rules; the first rule a slot matches picks its
+# model. A selector is one or more ":"-joined tags that must all match the
+# slot: its rarity, color section, slot kind or skeleton type, or "signpost".
+# Slots no rule matches follow the fallback chain (fastest model first).
+MODEL_ROUTES = os.getenv(
+    "MTG_MODEL_ROUTES",
+    "mythic=gpt-4o,rare=gpt-4o,signpost=gpt-4o,planeswalker=gpt-4o",
+)
+
+
+def parse_model_routes(value):
+    """Parse MTG_MODEL_ROUTES into [(frozenset of tags, model)]"""
+    rules = []
+    for item in (value or "").split(","):
+        selector, _, model = item.partition("=")
+        tags = frozenset(
+            tag.strip().lower() for tag in selector.split(":") if tag.strip()
+        )
+        if tags and model.strip():
+            rules.append((tags, model.strip()))
+    return rules
+
+
+def slot_tags(color, rarity, slot_data):
+    """Tags a routing rule can match for one skeleton slot"""
+    slot_data = slot_data if isinstance(slot_data, dict) else {}
+    section = (rarity or "").lower()
+    tags = {
+        (color or "").lower(),
+        section,
+        normalize_rarity(rarity),
+        slot_kind(color, slot_data),
+    }
+    if slot_data.get("type"):
+        tags.add(str(slot_data["type"]).lower())
+    if (
+        "signpost" in section
+        or "signpost" in str(slot_data.get("description", "")).lower()
+    ):
+        tags.add("signpost")
+    return tags
+
+
+class ModelTierPolicy:
+    """Route each slot to a preferred model by rarity, section and slot type.
+
+    The preferred model is tried first; the rest of the fallback chain still
+    applies when it is out of quota or its circuit is open. Counts of the
+    slots routed and the model that served each card are kept for monitoring.
+    """
+
+    def __init__(self, rules=None):
+        self.rules = parse_model_routes(MODEL_ROUTES) if rules is None else rules
+        self._routed = Counter()
+        self._served = Counter()
+        self._lock = threading.Lock()
+
+    def _rule_index(self, request):
+        color, rarity, _, slot_data = request
+        tags = slot_tags(color, rarity, slot_data)
+        for index, (selector, _) in enumerate(self.rules):
+            if selector <= tags:
+                return index
+        return None
+
+    def model_for(self, request):
+        """Preferred model for a (color, rarity, slot_id, slot_data) request"""
+        index = self._rule_index(request)
+        return None if index is None else self.rules[index][1]
+
+    def model_for_batch(self, card_requests):
+        """Preferred model for a batch: that of its highest-priority rule"""
+        indexes = [self._rule_index(request) for request in card_requests]
+        matched = [index for index in indexes if index is not None]
+        return self.rules[min(matched)][1] if matched else None
+
+    def record(self, card_requests, cards, model):
+        """Count the slots routed per tier and the cards each model served"""
+        with self._lock:
+            for request in card_requests:
+                if request[2] in cards:
+                    self._routed[self.model_for(request) or "default"] += 1
+            self._served[model] += len(cards)
+
+    def snapshot(self):
+        """Routing rules and the cards routed and served per model"""
+        with self._lock:
+            return {
+                "rules": [
+                    {"selector": ":".join(sorted(selector)), "model": model}
+                    for selector, model in self.rules
+                ],
+                "routed_cards": dict(self._routed),
+                "served_cards": dict(self._served),
+            }
+
+
+_default_policy = None
+_default_policy_lock = threading.Lock()
+
+
+def get_model_tier_policy():
+    """Get the process-wide model tier policy, creating it on first use"""
+    global _default_policy
+    with _default_policy_lock:
+        if _default_policy is None:
+            _default_policy = ModelTierPolicy()
+        return _default_policy
@@ -0,0 +1,235 @@
+"""
+Offline set generation through the OpenAI Batch API (files + batches endpoints)
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from openai_clients import get_client_registry
+
+logger = logging.getLogger(__name__)
+
+# Seconds between status checks of a submitted batch
+OFFLINE_POLL_SECONDS = float(os.getenv("MTG_OFFLINE_POLL_SECONDS", "30"))
+# Completion window requested from the Batch API
+OFFLINE_COMPLETION_WINDOW = os.getenv("MTG_OFFLINE_COMPLETION_WINDOW", "24h")
+# Alternate API base URL for offline batches, e.g. a local stand-in server
+OFFLINE_BASE_URL = os.getenv("MTG_OFFLINE_BASE_URL", "")
+# Time budget for an offline set; batches can wait in the queue for hours
+OFFLINE_DEADLINE_SECONDS = float(os.getenv("MTG_OFFLINE_DEADLINE_SECONDS", "90000"))
+# Seconds a finished offline job stays available from its status route
+OFFLINE_RESULT_TTL_SECONDS = float(os.getenv("MTG_OFFLINE_RESULT_TTL_SECONDS", "86400"))
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class OfflineBatchError(Exception):
+    """The Batch API rejected a batch or finished it without output"""
+
+
+def batch_request_line(custom_id, body):
+    """One JSONL line of a Batch API input file"""
+    return json.dumps(
+        {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+    )
+
+
+def parse_batch_output(text):
+    """Map each custom_id of a Batch API output or error file to its result.
+
+    A result is {"content", "model", "finish_reason", "usage"} for a
+    successful request and {"error": message} for a failed one.
+    """
+    results = {}
+    for line in (text or "").splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        custom_id = item.get("custom_id")
+        response = item.get("response") or {}
+        if item.get("error") or response.get("status_code") != 200:
+            error = item.get("error") or (response.get("body") or {}).get("error")
+            results[custom_id] = {"error": str(error or response.get("status_code"))}
+            continue
+        body = response.get("body") or {}
+        choice = (body.get("choices") or [{}])[0]
+        results[custom_id] = {
+            "content": (choice.get("message") or {}).get("content") or "",
+            "model": body.get("model"),
+            "finish_reason": choice.get("finish_reason"),
+            "usage": body.get("usage") or {},
+        }
+    return results
+
+
+class OfflineBatchRunner:
+    """Upload a JSONL request file, run it as a batch and fetch its results.
+
+    Batch API calls have their own rate limits and run outside the
+    concurrency governor and the per-key rate limiters.
+    """
+
+    def __init__(
+        self,
+        client_registry=None,
+        poll_seconds=OFFLINE_POLL_SECONDS,
+        completion_window=OFFLINE_COMPLETION_WINDOW,
+        base_url=OFFLINE_BASE_URL,
+    ):
+        self.client_registry = client_registry or get_client_registry()
+        self.poll_seconds = max(0.01, poll_seconds)
+        self.completion_window = completion_window
+        self.base_url = base_url
+
+    def _client(self, api_key):
+        client = self.client_registry.get_client(api_key)
+        # Keep the SDK's retries for these few, idempotent-by-id calls
+        options = {"max_retries": 2}
+        if self.base_url:
+            options["base_url"] = self.base_url
+        return client.with_options(**options)
+
+    def submit(self, api_key, lines, metadata=None):
+        """Upload the request lines and create a batch; returns its id"""
+        client = self._client(api_key)
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+        input_file = client.files.create(
+            file=("mtg-set-batch.jsonl", payload), purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window,
+            **({"metadata": metadata} if metadata else {}),
+        )
+        logger.info(
+            f"Submitted offline batch {batch.id} with {len(lines)} requests (file {input_file.id})"
+        )
+        return batch.id
+
+    def wait(self, api_key, batch_id, deadline):
+        """Poll a batch until it finishes; cancels it if the deadline passes"""
+        client = self._client(api_key)
+        while True:
+            batch = client.batches.retrieve(batch_id)
+            if batch.status in TERMINAL_STATUSES:
+                logger.info(f"Offline batch {batch_id} {batch.status}")
+                return batch
+            if deadline.expired():
+                client.batches.cancel(batch_id)
+                deadline.check(f"offline batch {batch_id} finished")
+            counts = getattr(batch, "request_counts", None)
+            if counts is not None:
+                logger.info(
+                    f"Offline batch {batch_id} {batch.status}: {counts.completed}/{counts.total} requests done"
+                )
+            remaining = deadline.remaining()
+            time.sleep(
+                self.poll_seconds
+                if remaining is None
+                else min(self.poll_seconds, max(0.01, remaining))
+            )
+
+    def fetch_results(self, api_key, batch):
+        """Results of a finished batch keyed by custom_id"""
+        if batch.status != "completed" and not batch.output_file_id:
+            raise OfflineBatchError(
+                f"Offline batch {batch.id} {batch.status}: {getattr(batch, 'errors', None)}"
+            )
+        client = self._client(api_key)
+        results = {}
+        for file_id in (batch.error_file_id, batch.output_file_id):
+            if file_id:
+                results.update(parse_batch_output(client.files.content(file_id).text))
+        return results
+
+    def run(self, api_key, lines, deadline, metadata=None, on_submit=None):
+        """Submit request lines, wait for the batch and return its results.
+
+        on_submit is called with the batch id as soon as it exists.
+        """
+        batch_id = self.submit(api_key, lines, metadata)
+        if on_submit is not None:
+            on_submit(batch_id)
+        return self.fetch_results(api_key, self.wait(api_key, batch_id, deadline))
+
+
+class OfflineJobStore:
+    """Status and results of offline sets generating in the background.
+
+    An offline set can take hours, so routes start it on a background
+    thread and hand back a job id; clients poll the status route (or
+    listen for Socket.IO events) instead of holding a request open.
+    """
+
+    def __init__(self, ttl_seconds=OFFLINE_RESULT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _prune_locked(self, now):
+        for job_id, entry in list(self._jobs.items()):
+            finished = entry["finished_at"]
+            if finished is not None and now - finished > self.ttl_seconds:
+                del self._jobs[job_id]
+
+    def create(self, theme, job):
+        """Register a running offline set and return its job id"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._prune_locked(time.monotonic())
+            self._jobs[job_id] = {
+                "theme": theme,
+                "job": job,
+                "status": "running",
+                "set": None,
+                "error": None,
+                "finished_at": None,
+            }
+        return job_id
+
+    def finish(self, job_id, complete_set=None, error=None):
+        """Store the set of a finished job, or the error that ended it"""
+        with self._lock:
+            entry = self._jobs[job_id]
+            entry["status"] = "failed" if error is not None else "completed"
+            entry["set"] = complete_set
+            entry["error"] = None if error is None else str(error)
+            entry["finished_at"] = time.monotonic()
+
+    def get(self, job_id):
+        """Status of a job, with its set once completed; None if unknown"""
+        with self._lock:
+            self._prune_locked(time.monotonic())
+            entry = self._jobs.get(job_id)
+            if entry is None:
+                return None
+            status = {
+                "job_id": job_id,
+                "status": entry["status"],
+                "theme": entry["theme"],
+                "generation": entry["job"].to_dict(),
+            }
+            if entry["set"] is not None:
+                status["set"] = entry["set"]
+            if entry["error"] is not None:
+                status["error"] = entry["error"]
+            return status
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_offline_job_store():
+    """Get the process-wide offline job store, creating it on first use"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = OfflineJobStore()
+        return _default_store
@@ -0,0 +1,151 @@
+"""
+Pooled OpenAI client registry shared by every generation request
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import httpx
+import openai
+
+logger = logging.getLogger(__name__)
+
+# Connection pool tuning for the shared HTTP transport
+HTTP_MAX_CONNECTIONS = int(os.getenv("MTG_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("MTG_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("MTG_HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+# Clients unused for this many seconds are dropped from the registry
+CLIENT_IDLE_TTL = float(os.getenv("MTG_CLIENT_IDLE_TTL", "900"))
+
+
+def fingerprint_api_key(api_key):
+    """Stable, non-reversible identifier for an API key"""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+
+
+def _http_limits(max_connections, max_keepalive_connections, keepalive_expiry):
+    """Connection pool limits shared by the sync and async transports"""
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+
+
+class OpenAIClientRegistry:
+    """Thread-safe cache of OpenAI clients keyed by API key hash.
+
+    Every client shares one pooled httpx transport, so TLS sessions and
+    keep-alive connections to the API are reused across keys and requests.
+    """
+
+    def __init__(
+        self,
+        idle_ttl=CLIENT_IDLE_TTL,
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    ):
+        self.idle_ttl = idle_ttl
+        self._http_client = self._create_http_client(
+            _http_limits(max_connections, max_keepalive_connections, keepalive_expiry)
+        )
+        self._clients = {}  # key hash -> (client, last used timestamp)
+        self._lock = threading.Lock()
+
+    def _create_http_client(self, limits):
+        """Build the shared HTTP transport"""
+        return httpx.Client(limits=limits, timeout=HTTP_TIMEOUT)
+
+    def _create_client(self, api_key):
+        """Build an OpenAI client bound to the shared transport"""
+        return openai.OpenAI(
+            api_key=api_key, max_retries=0, http_client=self._http_client
+        )
+
+    def get_client(self, api_key):
+        """Return the pooled client for an API key, creating it if needed"""
+        if not api_key:
+            raise ValueError("OpenAI API key is required")
+
+        key_hash = fingerprint_api_key(api_key)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle_locked(now)
+            entry = self._clients.get(key_hash)
+            client = entry[0] if entry else self._create_client(api_key)
+            if not entry:
+                logger.info(f"Created pooled OpenAI client for key {key_hash[:8]}")
+            self._clients[key_hash] = (client, now)
+            return client
+
+    def _evict_idle_locked(self, now):
+        """Drop clients that have been idle longer than the TTL"""
+        expired = [
+            key_hash
+            for key_hash, (_, last_used) in self._clients.items()
+            if now - last_used > self.idle_ttl
+        ]
+        for key_hash in expired:
+            # Don't close the client: that would close the shared transport
+            del self._clients[key_hash]
+            logger.info(f"Evicted idle OpenAI client for key {key_hash[:8]}")
+
+    def evict_idle(self):
+        """Drop idle clients now instead of on the next lookup"""
+        with self._lock:
+            self._evict_idle_locked(time.monotonic())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._clients)
+
+    def close(self):
+        """Drop every client and close the shared transport"""
+        with self._lock:
+            self._clients.clear()
+        self._http_client.close()
+
+
+class AsyncOpenAIClientRegistry(OpenAIClientRegistry):
+    """Registry of AsyncOpenAI clients sharing one pooled async transport.
+
+    The async transport is bound to the event loop it is first used on, so
+    each event loop should own its own registry.
+    """
+
+    def _create_http_client(self, limits):
+        """Build the shared async HTTP transport"""
+        return httpx.AsyncClient(limits=limits, timeout=HTTP_TIMEOUT)
+
+    def _create_client(self, api_key):
+        """Build an AsyncOpenAI client bound to the shared transport"""
+        return openai.AsyncOpenAI(
+            api_key=api_key, max_retries=0, http_client=self._http_client
+        )
+
+    async def aclose(self):
+        """Drop every client and close the shared async transport"""
+        with self._lock:
+            self._clients.clear()
+        await self._http_client.aclose()
+
+    def close(self):
+        raise RuntimeError("Use 'await registry.aclose()' for async registries")
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_client_registry():
+    """Get the process-wide client registry, creating it on first use"""
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = OpenAIClientRegistry()
+        return _default_registry
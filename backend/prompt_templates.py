@@ -0,0 +1,408 @@
+"""
+Precompiled card prompts with a static, cacheable prefix
+
+Upstream prompt caching only reuses an identical leading run of tokens, so
+every message starts with the long static guidance (built once at import)
+and the theme and slot details come last.
+"""
+
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from textwrap import dedent
+
+from token_budget import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Encode batch slots as one compact JSON line each instead of a verbose block
+COMPACT_SLOTS = os.getenv("MTG_COMPACT_SLOTS", "1").lower() in ("1", "true", "yes")
+# Share of batches whose prompt is also built and tokenized in the verbose
+# encoding to report the savings; 0 turns the report off
+SLOT_ENCODING_SAMPLE_RATE = float(os.getenv("MTG_SLOT_ENCODING_SAMPLE_RATE", "0.05"))
+
+# Upstream caches prompt prefixes only once they reach this many tokens
+MIN_CACHEABLE_PREFIX_TOKENS = 1024
+
+BALANCE_REQUIREMENTS = dedent("""
+    CRITICAL BALANCE REQUIREMENTS:
+    - Creatures: Follow the "Vanilla Test" - stats must be reasonable even without abilities
+    - 1-mana creatures: Usually 2/1, 1/2, or 1/1 with upside
+    - 2-mana creatures: Usually 2/2, 3/1, 1/3, or 2/1 with ability
+    - 3-mana creatures: Usually 3/3, 4/2, 2/4, or 3/2 with ability
+    - Higher costs: Scale appropriately with more stats or powerful abilities
+    - Spells: Cost effects fairly based on existing Magic cards
+    - Avoid "strictly better" versions of existing cards
+    - Respect each color's slice of the color pie strictly
+    - Match rarity expectations for complexity and power level
+    """).strip()
+
+RARITY_GUIDANCE = dedent("""
+    RARITY GUIDELINES:
+    - Common: Simple, self-contained cards that carry the set's core mechanics. At most one or two short abilities, no complex board states, and nothing that dominates Limited when several copies are opened. Removal at common is conditional or fairly costed.
+    - Uncommon: A step up in complexity and power. Signpost cards for two-color archetypes, build-around effects, and creatures with two abilities belong here, but they should still be fair in a game where both players have them.
+    - Rare: Powerful, splashy, or complex cards that reward building around them: bombs for Limited, engines for Constructed, and unique effects. Rares may break rules that commons follow, within the color pie.
+    - Mythic: The set's most iconic and memorable designs, such as legendary characters, planeswalkers, and spectacular effects. Power can be high, but the card must stay fun to play against.
+    """).strip()
+
+COLOR_PIE_GUIDANCE = dedent("""
+    COLOR PIE:
+    - White: Small efficient creatures, lifegain, tokens, protection, tapping, exiling attackers or enchanted permanents, and rules that apply to everyone.
+    - Blue: Card draw, counterspells, bounce, flying, tapping and freezing, copying, and manipulating the top of the library. Weak at dealing with resolved permanents directly.
+    - Black: Creature removal, discard, reanimation, deathtouch, menace, drain effects, and power at the cost of life or sacrifice. Struggles with enchantments and artifacts.
+    - Red: Direct damage, haste, first strike, temporary power boosts, impulsive card draw, and artifact destruction. Struggles with enchantments and card advantage.
+    - Green: The largest creatures for their cost, mana ramp, fight effects, reach, trample, +1/+1 counters, and enchantment or artifact removal. Weak at flying and direct creature removal.
+    - Multicolor: Combine the strengths of both colors and play into the archetype the pair represents; avoid effects neither color would do alone.
+    """).strip()
+
+TEMPLATING_GUIDANCE = dedent("""
+    TEMPLATING:
+    - Use current Oracle wording: "When this creature enters, ...", "Whenever this creature attacks, ...", "At the beginning of your upkeep, ...", and "Target creature gets +2/+2 until end of turn."
+    - Write mana costs in the compact form used by the examples ("2WU", "X1R"), with generic mana first and colored symbols in WUBRG order. Write mana symbols inside rules text as {T}, {W}, {U}, {B}, {R}, {G}, {C}, and {1}.
+    - Keyword abilities come first in rules text, comma separated and in lowercase after the first word ("Flying, vigilance"), followed by triggered and activated abilities on their own lines.
+    - Type lines use an em dash before subtypes ("Creature — Elf Druid", "Artifact — Equipment", "Enchantment — Aura").
+    - Flavor text is one or two evocative sentences that deepen the theme; it never repeats the rules text.
+    - Card names are unique, at most four or five words, and fit the theme's world.
+    """).strip()
+
+# Only added to the user message of prompts with a colorless slot
+COLORLESS_GUIDANCE = "For colorless cards, use generic mana costs and focus on artifacts, Equipment, or colorless creatures with unique abilities."
+
+SKELETON_CARD_SYSTEM_PROMPT = "\n\n".join(
+    [
+        "You are an expert Magic: The Gathering card designer with deep knowledge of game balance, the color pie, and rarity expectations. Create cards that are perfectly balanced according to established Magic design principles. Every card must pass the 'vanilla test' for stats and be appropriately costed. Prioritize balance and playability over flashy effects. Follow Mark Rosewater's design philosophy strictly.",
+        dedent("""
+            Every card you create should:
+            1. Perfectly fit the requested theme with creative, immersive flavor
+            2. Meet the specific requirements of its slot
+            3. Be appropriate for its rarity with balanced power level
+            4. Follow Mark Rosewater's design principles and modern Magic templating
+            5. Have properly costed stats and effects following established curves
+            6. Include a memorable, thematic name and evocative flavor text
+            7. Adhere to the color pie and rarity expectations strictly
+
+            Balance and Design Guidelines:
+            - Follow established mana cost to power/toughness ratios (e.g., 1-mana: 2/1 or 1/2, 2-mana: 2/2 or 3/1, etc.)
+            - The card's rarity should set its complexity and power level
+            - Abilities should be costed fairly according to Magic's established precedents
+            - Avoid overpowered effects that break Limited or Constructed formats
+            - Ensure the card fits within its color's slice of the color pie
+            - Create meaningful gameplay decisions without being overly complex
+            """).strip(),
+        BALANCE_REQUIREMENTS,
+        RARITY_GUIDANCE,
+        COLOR_PIE_GUIDANCE,
+        TEMPLATING_GUIDANCE,
+        dedent("""
+            The request names the theme first, then the slot: its rarity, color, slot ID, requirements, mana value, and card type. A mana value or card type of "flexible" leaves that choice to you.
+
+            Return the card in this JSON format:
+            {
+                "name": "Card Name",
+                "mana_cost": "1W",
+                "type": "Creature — Human Soldier",
+                "power": 2,
+                "toughness": 1,
+                "rules_text": "Card abilities text",
+                "flavor_text": "Flavor text here",
+                "rarity": "Slot Rarity"
+            }
+
+            Set rarity to the requested rarity in title case.
+            For non-creatures, omit power/toughness fields.
+            """).strip(),
+    ]
+)
+
+BATCH_SYSTEM_PROMPT = "\n\n".join(
+    [
+        'You are an expert Magic: The Gathering card designer specializing in batch card creation. You excel at creating multiple balanced, thematic cards in a single response. Always return exactly the number of cards requested in the "cards" array of a valid JSON object. Every creature must have appropriate stats for its mana cost, and every spell must be fairly costed according to established Magic design principles.',
+        dedent("""
+            DESIGN REQUIREMENTS:
+            1. Each card must perfectly fit the requested theme with immersive flavor
+            2. Follow Mark Rosewater's design principles and modern Magic templating
+            3. Be appropriate for the specified rarity with balanced power level
+            4. Have memorable, thematic names and evocative flavor text
+            5. Create meaningful gameplay decisions without being overly complex
+            6. Cards in the same batch must have distinct names and should not repeat the same effect
+            """).strip(),
+        BALANCE_REQUIREMENTS,
+        RARITY_GUIDANCE,
+        COLOR_PIE_GUIDANCE,
+        TEMPLATING_GUIDANCE,
+        dedent("""
+            REQUEST FORMAT:
+            The request names the theme first. Section context, if any, follows as one JSON object per skeleton section: keyword counts are quotas for the whole section, which may be spread over several batches; section_slots is the section's size and batch_slots how many of its slots are in this batch.
+            The slots come next, either as one JSON object per line (id = the card's slot_id, color, rarity, mv = mana value, where a list allows any of its values, type = card type, desc = slot requirements; a slot without mv or type leaves it flexible) or as numbered "Card N (Slot ID: ...)" blocks listing the same fields, where "flexible" leaves the field open.
+            The request ends with the number of cards to return.
+            """).strip(),
+        dedent("""
+            Return a JSON object with a single "cards" field: an array with one card per requested slot. Each card must include the slot_id field of its slot.
+
+            Format:
+            {"cards": [
+                {
+                    "slot_id": "CW01",
+                    "name": "Card Name",
+                    "mana_cost": "1W",
+                    "type": "Creature — Human Soldier",
+                    "power": 2,
+                    "toughness": 1,
+                    "rules_text": "Card abilities text",
+                    "flavor_text": "Flavor text here",
+                    "rarity": "Slot Rarity"
+                },
+                {
+                    "slot_id": "CU01",
+                    "name": "Another Card Name",
+                    "mana_cost": "2U",
+                    "type": "Instant",
+                    "rules_text": "Card effect",
+                    "flavor_text": "Flavor text",
+                    "rarity": "Slot Rarity"
+                }
+            ]}
+
+            Set each card's rarity to the rarity of its slot in title case.
+            For non-creatures, omit power/toughness fields.
+            ENSURE: Each card has a unique slot_id matching the slot specifications.
+            """).strip(),
+    ]
+)
+
+# The per-call parts of each user message come last: the theme, which every
+# call of a set shares, then the slot and any count
+SKELETON_CARD_TEMPLATE = dedent("""
+    Theme: {theme}
+
+    Create a Magic: The Gathering {rarity} card with the following specifications:
+
+    Color: {color}
+    Slot ID: {slot_id}
+    Slot Requirements: {description}
+
+    Additional Context:
+    - Mana Value: {mana_value}
+    - Card Type: {card_type}
+    """).strip()
+
+BATCH_THEME_TEMPLATE = 'Theme: "{theme}"'
+
+SECTION_CONTEXT_HEADER = "SECTION CONTEXT:"
+
+BATCH_SLOTS_HEADER = "CARD SPECIFICATIONS:"
+
+COMPACT_BATCH_SLOTS_HEADER = "SLOTS:"
+
+BATCH_SLOT_TEMPLATE = dedent("""
+    Card {index} (Slot ID: {slot_id}):
+    - Theme: {theme}
+    - Color: {color}
+    - Rarity: {rarity}
+    - Slot ID: {slot_id}
+    - Requirements: {description}
+    - Mana Value: {mana_value}
+    - Card Type: {card_type}
+    """).strip()
+
+BATCH_FOOTER_TEMPLATE = (
+    "CRITICAL: Create exactly {count} Magic: The Gathering cards, one for each "
+    'slot above, and return them in the "cards" array of a JSON object. '
+    "Each card must include the slot_id field."
+)
+
+
+def _color_identity(color):
+    return "colorless" if color == "colorless" else color
+
+
+def build_skeleton_card_messages(theme, color, rarity, slot_id, slot_data):
+    """Chat messages for one skeleton slot: static system prompt, then the slot"""
+    prompt = SKELETON_CARD_TEMPLATE.format(
+        rarity=rarity,
+        theme=theme,
+        color=_color_identity(color),
+        slot_id=slot_id,
+        description=slot_data.get("description", ""),
+        mana_value=slot_data.get("mana_value", "flexible"),
+        card_type=slot_data.get("type", "flexible"),
+    )
+    if color == "colorless":
+        prompt = f"{prompt}\n\n{COLORLESS_GUIDANCE}"
+    return [
+        {"role": "system", "content": SKELETON_CARD_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def slot_spec(request):
+    """Compact JSON-ready spec of one slot, omitting fields left flexible"""
+    color, rarity, slot_id, slot_data = request
+    spec = {"id": slot_id, "color": _color_identity(color), "rarity": rarity}
+    if slot_data.get("mana_value") is not None:
+        spec["mv"] = slot_data["mana_value"]
+    if slot_data.get("type"):
+        spec["type"] = slot_data["type"]
+    spec["desc"] = slot_data.get("description", "Generic slot")
+    return spec
+
+
+def format_batch_slot(index, theme, request, compact=COMPACT_SLOTS):
+    """Prompt section describing one slot of a batch"""
+    if compact:
+        return json.dumps(slot_spec(request), ensure_ascii=False, separators=(",", ":"))
+    color, rarity, slot_id, slot_data = request
+    return BATCH_SLOT_TEMPLATE.format(
+        index=index,
+        slot_id=slot_id,
+        theme=theme,
+        color=_color_identity(color),
+        rarity=rarity,
+        description=slot_data.get("description", "Generic slot"),
+        mana_value=slot_data.get("mana_value", "flexible"),
+        card_type=slot_data.get("type", "flexible"),
+    )
+
+
+def format_section_context(context, card_requests):
+    """Prompt section with the shared skeleton context of a batch's sections"""
+    batch_slots = Counter((color, rarity) for color, rarity, _, _ in card_requests)
+    lines = [SECTION_CONTEXT_HEADER]
+    for (color, rarity), section in context.items():
+        spec = {
+            "section": f"{color} {rarity}",
+            "batch_slots": batch_slots[(color, rarity)],
+        }
+        spec.update(section)
+        lines.append(json.dumps(spec, ensure_ascii=False, separators=(",", ":")))
+    return "\n".join(lines)
+
+
+def build_batch_messages(theme, card_requests, compact=COMPACT_SLOTS, context=None):
+    """Chat messages for a batch: static system prompt, theme, context, slots.
+
+    context maps (color, rarity) sections to the skeleton keywords and notes
+    the batch's slots share.
+    """
+    slots = [
+        format_batch_slot(i, theme, request, compact)
+        for i, request in enumerate(card_requests, 1)
+    ]
+    sections = [BATCH_THEME_TEMPLATE.format(theme=theme)]
+    if context:
+        sections.append(format_section_context(context, card_requests))
+    if compact:
+        sections.append("\n".join([COMPACT_BATCH_SLOTS_HEADER, *slots]))
+    else:
+        sections.extend([BATCH_SLOTS_HEADER, *slots])
+    if any(color == "colorless" for color, _, _, _ in card_requests):
+        sections.append(COLORLESS_GUIDANCE)
+    footer = BATCH_FOOTER_TEMPLATE.format(count=len(card_requests))
+    prompt = "\n\n".join([*sections, footer])
+    return [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def batch_prompt_tokens(theme, card_requests, context=None, model="gpt-4o-mini"):
+    """Prompt tokens of a batch with the compact and the verbose slot encoding"""
+    return tuple(
+        sum(
+            count_tokens(message["content"], model)
+            for message in build_batch_messages(theme, card_requests, compact, context)
+        )
+        for compact in (True, False)
+    )
+
+
+def static_prefix_tokens(model="gpt-4o-mini"):
+    """Tokens in the static system prompt that starts each kind of call"""
+    return {
+        "card": count_tokens(SKELETON_CARD_SYSTEM_PROMPT, model),
+        "batch": count_tokens(BATCH_SYSTEM_PROMPT, model),
+    }
+
+
+def check_static_prefixes(model="gpt-4o-mini"):
+    """Warn about static prefixes too short for upstream prompt caching"""
+    prefixes = static_prefix_tokens(model)
+    for kind, tokens in prefixes.items():
+        if tokens < MIN_CACHEABLE_PREFIX_TOKENS:
+            logger.warning(
+                f"The {kind} prompt prefix is {tokens} tokens, below the "
+                f"{MIN_CACHEABLE_PREFIX_TOKENS} upstream caching needs"
+            )
+    return prefixes
+
+
+def cached_prompt_tokens(usage):
+    """Prompt tokens the API served from its prefix cache, if it reported them"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", None) or 0
+
+
+class PromptCacheStats:
+    """Prompt and cached-prompt token totals per model"""
+
+    def __init__(self):
+        self._totals = {}
+        self._encoding = {"batches": 0, "prompt_tokens": 0, "verbose_prompt_tokens": 0}
+        self._lock = threading.Lock()
+
+    def record(self, model, usage):
+        """Record the prompt token usage of one completed call"""
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        if not prompt_tokens:
+            return
+        cached = cached_prompt_tokens(usage)
+        with self._lock:
+            totals = self._totals.setdefault(
+                model, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0}
+            )
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["cached_tokens"] += cached
+
+    def record_encoding(self, compact_tokens, verbose_tokens):
+        """Record a batch prompt's size next to its verbose-encoding size"""
+        with self._lock:
+            self._encoding["batches"] += 1
+            self._encoding["prompt_tokens"] += compact_tokens
+            self._encoding["verbose_prompt_tokens"] += verbose_tokens
+
+    def snapshot(self):
+        """Token totals, cache hit ratios and static prefix sizes for monitoring"""
+        with self._lock:
+            encoding = dict(self._encoding)
+            models = {
+                model: dict(
+                    totals,
+                    cached_ratio=round(
+                        totals["cached_tokens"] / totals["prompt_tokens"], 3
+                    ),
+                )
+                for model, totals in self._totals.items()
+            }
+        return {
+            "static_prefix_tokens": static_prefix_tokens(),
+            "models": models,
+            "slot_encoding": encoding,
+        }
+
+
+_default_stats = None
+_default_stats_lock = threading.Lock()
+
+
+def get_prompt_cache_stats():
+    """Get the process-wide prompt cache stats, creating them on first use"""
+    global _default_stats
+    with _default_stats_lock:
+        if _default_stats is None:
+            _default_stats = PromptCacheStats()
+        return _default_stats
@@ -0,0 +1,298 @@
+"""
+Per-API-key request and token rate limiting driven by OpenAI rate-limit headers
+"""
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+
+from deadline import DeadlineExceeded
+from openai_clients import fingerprint_api_key
+
+logger = logging.getLogger(__name__)
+
+# Limits assumed for a key until the API reports its real limits in headers
+DEFAULT_REQUESTS_PER_MINUTE = int(os.getenv("MTG_DEFAULT_RPM", "500"))
+DEFAULT_TOKENS_PER_MINUTE = int(os.getenv("MTG_DEFAULT_TPM", "200000"))
+# How many plain (non-quota) 429 responses a single call waits out before failing
+MAX_RATE_LIMIT_RETRIES = int(os.getenv("MTG_MAX_RATE_LIMIT_RETRIES", "5"))
+# Limiters unused for this many seconds are dropped from the registry
+LIMITER_IDLE_TTL = float(os.getenv("MTG_LIMITER_IDLE_TTL", "900"))
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset_duration(value):
+    """Parse OpenAI reset durations such as '1s', '6m0s' or '20ms' into seconds"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_SECONDS[unit] for amount, unit in parts)
+
+
+def estimate_tokens(text):
+    """Rough token estimate (about four characters per token)"""
+    return max(1, len(text or "") // 4)
+
+
+class TokenBucket:
+    """Token bucket that lets callers reserve capacity ahead of time.
+
+    Reservations may drive the level negative; the caller is told how long to
+    wait for the bucket to refill back to zero, so waiting happens outside the
+    lock and works the same for threads and coroutines.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = float(capacity)
+        self.level = float(capacity)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    @property
+    def refill_per_second(self):
+        return max(self.capacity, 1.0) / 60.0
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.level = min(self.capacity, self.level + elapsed * self.refill_per_second)
+        self.updated_at = now
+
+    def reserve(self, amount, now):
+        """Take capacity from the bucket and return the seconds to wait for it"""
+        self._refill(now)
+        self.level -= amount
+        wait = max(0.0, -self.level / self.refill_per_second)
+        return max(wait, self.paused_until - now)
+
+    def wait_for(self, amount, now):
+        """Seconds until the bucket could cover amount, without reserving it"""
+        self._refill(now)
+        wait = max(0.0, (amount - self.level) / self.refill_per_second)
+        return max(wait, self.paused_until - now)
+
+    def refund(self, amount, now):
+        """Return over-reserved capacity to the bucket"""
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+    def sync(self, limit, remaining, reset_seconds, now):
+        """Align the bucket with the limits the API reports"""
+        self._refill(now)
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+            if remaining <= 0 and reset_seconds:
+                self.pause(reset_seconds, now)
+
+    def pause(self, seconds, now):
+        """Stop handing out capacity for the given number of seconds"""
+        self.paused_until = max(self.paused_until, now + seconds)
+
+
+class KeyRateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets for one API key"""
+
+    def __init__(
+        self,
+        requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens):
+        """Reserve one request and an estimated token count, returning the wait"""
+        now = time.monotonic()
+        with self._lock:
+            return max(self.requests.reserve(1, now), self.tokens.reserve(tokens, now))
+
+    def headroom(self, tokens):
+        """Seconds a call of this size would wait now; 0 if the key has room"""
+        now = time.monotonic()
+        with self._lock:
+            return max(
+                self.requests.wait_for(1, now), self.tokens.wait_for(tokens, now)
+            )
+
+    def cancel(self, tokens):
+        """Hand back a reservation for a call that will not be made"""
+        now = time.monotonic()
+        with self._lock:
+            self.requests.refund(1, now)
+            self.tokens.refund(tokens, now)
+
+    def _reserve_within(self, tokens, deadline):
+        """Reserve capacity, unless pacing would run past the deadline"""
+        wait = self.reserve(tokens)
+        if deadline is not None and not deadline.allows(wait):
+            self.cancel(tokens)
+            raise DeadlineExceeded(
+                f"Deadline exceeded: the rate limiter would pace the call by {wait:.1f}s"
+            )
+        return wait
+
+    def acquire(self, tokens, deadline=None):
+        """Block until the key has headroom for the call; returns seconds waited.
+
+        Raises DeadlineExceeded without waiting if the wait would outlast
+        the deadline.
+        """
+        wait = self._reserve_within(tokens, deadline)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens, deadline=None):
+        """Wait on the event loop until the key has headroom for the call"""
+        wait = self._reserve_within(tokens, deadline)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """Correct the token bucket once the real usage of a call is known"""
+        if actual_tokens is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if actual_tokens < estimated_tokens:
+                self.tokens.refund(estimated_tokens - actual_tokens, now)
+            else:
+                self.tokens.reserve(actual_tokens - estimated_tokens, now)
+
+    def update_from_headers(self, headers):
+        """Sync both buckets with x-ratelimit-* response headers"""
+        if not headers:
+            return
+
+        def number(name):
+            try:
+                return float(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        now = time.monotonic()
+        with self._lock:
+            self.requests.sync(
+                number("x-ratelimit-limit-requests"),
+                number("x-ratelimit-remaining-requests"),
+                parse_reset_duration(headers.get("x-ratelimit-reset-requests")),
+                now,
+            )
+            self.tokens.sync(
+                number("x-ratelimit-limit-tokens"),
+                number("x-ratelimit-remaining-tokens"),
+                parse_reset_duration(headers.get("x-ratelimit-reset-tokens")),
+                now,
+            )
+
+    def snapshot(self):
+        """Remaining and total capacity of both buckets"""
+        now = time.monotonic()
+        with self._lock:
+            buckets = {}
+            for name, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+                bucket._refill(now)
+                buckets[name] = {
+                    "remaining": int(bucket.level),
+                    "limit": int(bucket.capacity),
+                    "paused_for": round(max(0.0, bucket.paused_until - now), 3),
+                }
+            return buckets
+
+    def penalize(self, headers=None, default_seconds=1.0):
+        """Pause every caller sharing this key after a 429; returns the pause"""
+        headers = headers or {}
+        retry_after = None
+        if headers.get("retry-after-ms"):
+            retry_after = parse_reset_duration(f"{headers.get('retry-after-ms')}ms")
+        if retry_after is None:
+            retry_after = parse_reset_duration(headers.get("retry-after"))
+        if retry_after is None:
+            retry_after = max(
+                parse_reset_duration(headers.get("x-ratelimit-reset-requests")) or 0,
+                parse_reset_duration(headers.get("x-ratelimit-reset-tokens")) or 0,
+            )
+        retry_after = retry_after or default_seconds
+
+        now = time.monotonic()
+        with self._lock:
+            self.requests.pause(retry_after, now)
+            self.tokens.pause(retry_after, now)
+        self.update_from_headers(headers)
+        return retry_after
+
+
+class RateLimiterRegistry:
+    """Thread-safe map of API key fingerprint to its KeyRateLimiter"""
+
+    def __init__(
+        self,
+        requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+        idle_ttl=LIMITER_IDLE_TTL,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.idle_ttl = idle_ttl
+        self._limiters = {}  # key hash -> (limiter, last used timestamp)
+        self._lock = threading.Lock()
+
+    def get(self, api_key):
+        """Get the limiter shared by every worker using this API key"""
+        key_hash = fingerprint_api_key(api_key)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle_locked(now)
+            entry = self._limiters.get(key_hash)
+            limiter = entry[0] if entry else None
+            if limiter is None:
+                limiter = KeyRateLimiter(
+                    self.requests_per_minute, self.tokens_per_minute
+                )
+            self._limiters[key_hash] = (limiter, now)
+            return limiter
+
+    def _evict_idle_locked(self, now):
+        """Drop limiters idle longer than the TTL, unless a 429 pause is pending"""
+        expired = [
+            key_hash
+            for key_hash, (limiter, last_used) in self._limiters.items()
+            if now - last_used > self.idle_ttl
+            and max(limiter.requests.paused_until, limiter.tokens.paused_until) <= now
+        ]
+        for key_hash in expired:
+            del self._limiters[key_hash]
+            logger.info(f"Evicted idle rate limiter for key {key_hash[:8]}")
+
+    def evict_idle(self):
+        """Drop idle limiters now instead of on the next lookup"""
+        with self._lock:
+            self._evict_idle_locked(time.monotonic())
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_rate_limiter_registry():
+    """Get the process-wide rate limiter registry, creating it on first use"""
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = RateLimiterRegistry()
+        return _default_registry
@@ -0,0 +1,129 @@
+"""
+Retry policy with exponential backoff and jitter for transient LLM failures
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+import openai
+
+from deadline import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = int(os.getenv("MTG_RETRY_MAX_ATTEMPTS", "3"))
+DEFAULT_BASE_DELAY = float(os.getenv("MTG_RETRY_BASE_DELAY", "1.0"))
+DEFAULT_MAX_DELAY = float(os.getenv("MTG_RETRY_MAX_DELAY", "20.0"))
+DEFAULT_JITTER = float(os.getenv("MTG_RETRY_JITTER", "0.5"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class MalformedResponseError(ValueError):
+    """The model answered, but the response could not be turned into cards"""
+
+
+def classify_error(error):
+    """Return a short retry reason for transient errors, or None if fatal"""
+    if isinstance(error, DeadlineExceeded):
+        return None
+    message = str(error).lower()
+    if "insufficient_quota" in message or "exceeded your current quota" in message:
+        # Quota is handled by model fallback; if it surfaces here it's final
+        return None
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection_error"
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limited"
+    status_code = getattr(error, "status_code", None)
+    if status_code in RETRYABLE_STATUS_CODES:
+        return f"http_{status_code}"
+    if isinstance(error, json.JSONDecodeError):
+        return "invalid_json"
+    if isinstance(error, MalformedResponseError):
+        return "malformed_response"
+    return None
+
+
+def classify_batch_error(error):
+    """classify_error for batch calls, which retry 429s in the rate limiter.
+
+    _make_api_request already waits out and retries rate limits up to
+    MAX_RATE_LIMIT_RETRIES times, so a 429 reaching the batch is final.
+    """
+    reason = classify_error(error)
+    return None if reason == "rate_limited" else reason
+
+
+class RetryPolicy:
+    """Bounded retries with exponential backoff and proportional jitter"""
+
+    def __init__(
+        self,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        base_delay=DEFAULT_BASE_DELAY,
+        max_delay=DEFAULT_MAX_DELAY,
+        jitter=DEFAULT_JITTER,
+        classify=classify_error,
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = min(max(jitter, 0.0), 1.0)
+        self.classify = classify
+
+    def delay_for(self, attempt):
+        """Backoff before retry number `attempt` (1-based)"""
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return delay * (1 - self.jitter * random.random())
+
+    def _should_retry(self, error, attempt, description, on_retry, deadline):
+        """Return the backoff delay if the error should be retried, else None"""
+        reason = self.classify(error)
+        if reason is None or attempt >= self.max_attempts:
+            return None
+        delay = self.delay_for(attempt)
+        if deadline is not None and not deadline.allows(delay):
+            raise DeadlineExceeded(
+                f"No time left to retry {description} after {reason}"
+            ) from error
+        logger.warning(
+            f"Retrying {description} after {reason} (attempt {attempt + 1}/{self.max_attempts}, backoff {delay:.2f}s): {error}"
+        )
+        if on_retry:
+            on_retry(attempt, reason, error)
+        return delay
+
+    def call(self, func, description="request", on_retry=None, deadline=None):
+        """Call func(), retrying transient failures while the deadline allows"""
+        attempt = 1
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                delay = self._should_retry(e, attempt, description, on_retry, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    async def call_async(
+        self, func, description="request", on_retry=None, deadline=None
+    ):
+        """Await func(), retrying transient failures while the deadline allows"""
+        attempt = 1
+        while True:
+            try:
+                return await func()
+            except Exception as e:
+                delay = self._should_retry(e, attempt, description, on_retry, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
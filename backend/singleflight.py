@@ -0,0 +1,57 @@
+"""
+In-process singleflight: concurrent identical calls share one execution
+"""
+
+import threading
+
+
+class _Call:
+    """One in-flight execution and the callers waiting on it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for it and get the same result (or exception). Once
+    the call finishes the key is forgotten, so later calls run again.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Run func() once per in-flight key; returns (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        """Number of distinct keys currently executing"""
+        with self._lock:
+            return len(self._calls)
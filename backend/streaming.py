@@ -0,0 +1,134 @@
+"""
+Incremental JSON-array parsing and chat completion stream collection
+"""
+
+import json
+import logging
+import time
+
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+
+logger = logging.getLogger(__name__)
+
+
+class JSONArrayStream:
+    """Incrementally parse the elements of the first JSON array in a text.
+
+    Text is fed in arbitrary chunks; feed() returns (index, element) for each
+    element whose closing bracket has arrived. Anything before the array
+    (prose, code fences, a wrapping object) is skipped, and an element that
+    doesn't decode is counted in `errors` instead of failing the whole array.
+    """
+
+    def __init__(self):
+        self.started = False  # Saw the array's opening bracket
+        self.closed = False  # Saw the array's closing bracket
+        self.errors = 0
+        self._buffer = ""
+        self._position = 0
+        self._depth = 0  # Nesting depth inside the array
+        self._in_string = False
+        self._escaped = False
+        self._element_start = None
+        self._index = 0
+
+    def feed(self, text):
+        """Consume more text and return the elements it completed"""
+        self._buffer += text
+        elements = []
+        buffer = self._buffer
+        position = self._position
+        while position < len(buffer) and not self.closed:
+            char = buffer[position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = self.started
+            elif not self.started:
+                if char == "[":
+                    self.started = True
+            elif char in "[{":
+                if self._depth == 0:
+                    self._element_start = position
+                self._depth += 1
+            elif char in "]}":
+                if self._depth == 0:
+                    self.closed = char == "]"
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        element = self._decode(
+                            buffer[self._element_start : position + 1]
+                        )
+                        if element is not None:
+                            elements.append((self._index, element))
+                        self._index += 1
+                        self._element_start = None
+            position += 1
+
+        # Only the unfinished element needs to stay buffered
+        keep_from = self._element_start if self._element_start is not None else position
+        self._buffer = buffer[keep_from:]
+        self._position = position - keep_from
+        if self._element_start is not None:
+            self._element_start = 0
+        return elements
+
+    def _decode(self, text):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            self.errors += 1
+            logger.warning(f"Skipping undecodable array element: {e}")
+            return None
+
+
+class ChatStreamCollector:
+    """Accumulate streamed chat completion chunks into a ChatCompletion"""
+
+    def __init__(self, on_delta=None):
+        self.on_delta = on_delta
+        self.parts = []
+        self.finish_reason = None
+        self.usage = None
+        self.id = None
+        self.model = None
+
+    def add(self, chunk):
+        """Record one chunk, passing any new content to on_delta"""
+        self.id = self.id or chunk.id
+        self.model = self.model or chunk.model
+        if getattr(chunk, "usage", None) is not None:
+            self.usage = chunk.usage
+        for choice in chunk.choices or []:
+            content = choice.delta.content if choice.delta else None
+            if content:
+                self.parts.append(content)
+                if self.on_delta:
+                    self.on_delta(content)
+            if choice.finish_reason:
+                self.finish_reason = choice.finish_reason
+
+    def completion(self):
+        """The streamed response as a regular (unvalidated) ChatCompletion"""
+        message = ChatCompletionMessage.construct(
+            role="assistant", content="".join(self.parts)
+        )
+        return ChatCompletion.construct(
+            id=self.id or "",
+            object="chat.completion",
+            created=int(time.time()),
+            model=self.model or "",
+            choices=[
+                Choice.construct(
+                    index=0, finish_reason=self.finish_reason, message=message
+                )
+            ],
+            usage=self.usage,
+        )
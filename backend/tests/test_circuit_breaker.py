@@ -0,0 +1,73 @@
+import httpx
+import openai
+
+from circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    counts_against_circuit,
+)
+
+
+def status_error(status_code):
+    response = httpx.Response(
+        status_code, request=httpx.Request("POST", "https://api.openai.com")
+    )
+    return openai.APIStatusError("error", response=response, body=None)
+
+
+def test_opens_on_error_rate_once_the_window_has_enough_calls():
+    breaker = CircuitBreaker(min_calls=4, error_rate=0.5)
+    for _ in range(3):
+        breaker.record(1.0, True, now=0)
+    assert breaker.state == CLOSED
+    assert breaker.record(1.0, True, now=0) == OPEN
+    assert not breaker.allows(now=1)
+
+
+def test_half_open_probe_closes_or_reopens_the_circuit():
+    breaker = CircuitBreaker(min_calls=1, open_seconds=30, half_open_probes=1)
+    breaker.record(1.0, True, now=0)
+    assert breaker.state == OPEN
+    assert breaker.admit(now=31)
+    assert breaker.state == HALF_OPEN
+    # Only one probe at a time
+    assert not breaker.admit(now=31)
+    assert breaker.record(1.0, True, now=32) == OPEN
+    assert breaker.admit(now=63)
+    assert breaker.record(1.0, False, now=64) == CLOSED
+
+
+def test_slow_calls_open_the_circuit():
+    breaker = CircuitBreaker(
+        min_calls=2, slow_call_seconds=10, slow_call_rate=0.5, error_rate=1.1
+    )
+    breaker.record(5, False, now=0)
+    assert breaker.record(50, False, now=0) == OPEN
+    assert breaker.reason.startswith("slow call rate")
+
+
+def test_slow_threshold_grows_with_completion_tokens():
+    breaker = CircuitBreaker(
+        min_calls=1,
+        slow_call_seconds=90,
+        slow_seconds_per_1k_tokens=30,
+        error_rate=1.1,
+        slow_call_rate=0.5,
+    )
+    assert breaker.slow_threshold(4000) == 210
+    breaker.record(150, False, now=0, completion_tokens=4000)
+    assert breaker.state == CLOSED
+    breaker.record(150, False, now=0)
+    assert breaker.state == OPEN
+
+
+def test_only_upstream_failures_count_against_the_circuit():
+    assert counts_against_circuit(status_error(503))
+    assert counts_against_circuit(
+        openai.APITimeoutError(httpx.Request("POST", "https://api.openai.com"))
+    )
+    assert not counts_against_circuit(status_error(400))
+    assert not counts_against_circuit(status_error(429))
+    assert not counts_against_circuit(ValueError("bad card"))
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from deadline import DeadlineExceeded
+from governor import (
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_STREAMING,
+    ConcurrencyGovernor,
+)
+
+
+def wait_for_queued(governor, count):
+    for _ in range(200):
+        if governor.snapshot()["queued"] == count:
+            return
+        time.sleep(0.005)
+    raise AssertionError(f"never saw {count} queued callers")
+
+
+def test_callers_over_the_cap_queue_until_the_timeout():
+    governor = ConcurrencyGovernor(max_in_flight=1, reserved_slots=0, weights={})
+    governor.acquire("sk-a")
+    with pytest.raises(DeadlineExceeded):
+        governor.acquire("sk-a", timeout=0.05)
+    snapshot = governor.snapshot()
+    assert snapshot["in_flight"] == 1
+    assert snapshot["queued"] == 0
+    governor.release("sk-a")
+    assert governor.snapshot()["in_flight"] == 0
+
+
+def test_reserved_slots_are_kept_for_interactive_calls():
+    governor = ConcurrencyGovernor(max_in_flight=2, reserved_slots=1, weights={})
+    governor.acquire("sk-a", PRIORITY_BULK)
+    with pytest.raises(DeadlineExceeded):
+        governor.acquire("sk-a", PRIORITY_STREAMING, timeout=0.05)
+    assert governor.acquire("sk-a", PRIORITY_INTERACTIVE, timeout=0.05) < 0.05
+
+
+def test_freed_slot_goes_to_the_highest_priority_lane():
+    governor = ConcurrencyGovernor(max_in_flight=1, reserved_slots=0, weights={})
+    governor.acquire("sk-a")
+    order = []
+
+    def call(name, priority):
+        with governor.slot("sk-a", priority, timeout=5):
+            order.append(name)
+
+    threads = [threading.Thread(target=call, args=("bulk", PRIORITY_BULK))]
+    threads[0].start()
+    wait_for_queued(governor, 1)
+    threads.append(
+        threading.Thread(target=call, args=("interactive", PRIORITY_INTERACTIVE))
+    )
+    threads[1].start()
+    wait_for_queued(governor, 2)
+    governor.release("sk-a")
+    for thread in threads:
+        thread.join(5)
+    assert order == ["interactive", "bulk"]
+
+
+def test_keys_share_slots_by_weight_not_by_backlog():
+    governor = ConcurrencyGovernor(max_in_flight=1, reserved_slots=0, weights={})
+    governor.acquire("sk-hog")
+    order = []
+
+    def call(key):
+        with governor.slot(key, timeout=5):
+            order.append(key)
+
+    threads = []
+    for key in ["sk-hog"] * 4 + ["sk-light"]:
+        threads.append(threading.Thread(target=call, args=(key,)))
+        threads[-1].start()
+        wait_for_queued(governor, len(threads))
+    governor.release("sk-hog")
+    for thread in threads:
+        thread.join(5)
+    # The light key's single call doesn't wait behind the hog's whole queue
+    assert order.index("sk-light") <= 1
+
+
+def test_async_acquire_times_out_and_withdraws():
+    governor = ConcurrencyGovernor(max_in_flight=1, reserved_slots=0, weights={})
+
+    async def main():
+        await governor.acquire_async("sk-a")
+        with pytest.raises(DeadlineExceeded):
+            await governor.acquire_async("sk-a", timeout=0.05)
+        assert governor.snapshot()["queued"] == 0
+        governor.release("sk-a")
+        async with governor.slot_async("sk-a", timeout=1):
+            assert governor.snapshot()["in_flight"] == 1
+
+    asyncio.run(main())
+    assert governor.snapshot()["in_flight"] == 0
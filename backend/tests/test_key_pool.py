@@ -0,0 +1,44 @@
+import time
+
+from key_pool import ApiKeyPool, load_pool_keys
+from rate_limiter import RateLimiterRegistry
+
+
+def make_pool(keys, recovery_seconds=300):
+    return ApiKeyPool(
+        keys, rate_limiters=RateLimiterRegistry(), recovery_seconds=recovery_seconds
+    )
+
+
+def test_calls_spread_evenly_across_keys():
+    pool = make_pool(["sk-a", "sk-b", "sk-c"])
+    chosen = [pool.choose() for _ in range(6)]
+    assert sorted(chosen) == ["sk-a", "sk-a", "sk-b", "sk-b", "sk-c", "sk-c"]
+
+
+def test_key_paused_by_a_429_is_passed_over():
+    registry = RateLimiterRegistry()
+    pool = ApiKeyPool(["sk-a", "sk-b"], rate_limiters=registry)
+    registry.get("sk-a").penalize({"retry-after": "30"})
+    assert [pool.choose() for _ in range(3)] == ["sk-b"] * 3
+
+
+def test_quota_exhausted_key_fails_over_then_recovers():
+    pool = make_pool(["sk-a", "sk-b"], recovery_seconds=0.05)
+    pool.mark_quota_exhausted("sk-a")
+    assert {pool.choose() for _ in range(4)} == {"sk-b"}
+    pool.mark_quota_exhausted("sk-b")
+    assert pool.choose() is None
+    time.sleep(0.1)
+    assert pool.choose() in ("sk-a", "sk-b")
+    assert all(state["in_rotation"] for state in pool.snapshot().values())
+
+
+def test_load_pool_keys_merges_env_and_file(tmp_path):
+    keys_file = tmp_path / "keys.txt"
+    keys_file.write_text("sk-b  # team key\n\n# retired\nsk-c\nsk-a\n")
+    assert load_pool_keys(" sk-a, sk-b ,", str(keys_file)) == ["sk-a", "sk-b", "sk-c"]
+
+
+def test_unreadable_keys_file_falls_back_to_env_keys(tmp_path):
+    assert load_pool_keys("sk-a", str(tmp_path / "missing.txt")) == ["sk-a"]
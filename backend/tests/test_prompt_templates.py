@@ -0,0 +1,36 @@
+from prompt_templates import (
+    MIN_CACHEABLE_PREFIX_TOKENS,
+    build_batch_messages,
+    build_skeleton_card_messages,
+    static_prefix_tokens,
+)
+
+
+def slot(slot_id, color="white", rarity="common"):
+    return (color, rarity, slot_id, {"description": "A test slot", "mana_value": 2})
+
+
+def test_static_prefixes_are_long_enough_to_cache():
+    for kind, tokens in static_prefix_tokens().items():
+        assert tokens >= MIN_CACHEABLE_PREFIX_TOKENS, kind
+
+
+def test_batch_prompts_share_the_static_prefix_and_put_the_count_last():
+    small = build_batch_messages("Steampunk", [slot("CW01")])
+    large = build_batch_messages(
+        "Deep Sea", [slot(f"CU{i:02d}", "blue") for i in range(8)], compact=False
+    )
+    assert small[0] == large[0]
+    for messages, count in ((small, 1), (large, 8)):
+        prompt = messages[1]["content"]
+        assert prompt.startswith("Theme: ")
+        assert f"exactly {count} " in prompt.rsplit("\n\n", 1)[1]
+        assert '"cards"' in prompt
+
+
+def test_skeleton_prompt_starts_with_the_theme():
+    messages = build_skeleton_card_messages(
+        "Steampunk", "colorless", "rare", "CR01", {"description": "Artifact"}
+    )
+    assert messages[1]["content"].startswith("Theme: Steampunk")
+    assert "colorless" in messages[1]["content"]
@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+from deadline import Deadline, DeadlineExceeded
+from rate_limiter import KeyRateLimiter, RateLimiterRegistry, TokenBucket
+
+
+def test_bucket_waits_for_capacity_it_does_not_have():
+    bucket = TokenBucket(60)  # Refills one unit per second
+    now = 100.0
+    bucket.updated_at = now
+    assert bucket.reserve(60, now) == 0
+    assert bucket.reserve(3, now) == pytest.approx(3.0)
+    # Capacity refills with time
+    assert bucket.wait_for(1, now + 4) == pytest.approx(0.0)
+
+
+def test_bucket_pause_holds_every_caller():
+    bucket = TokenBucket(60)
+    now = bucket.updated_at
+    bucket.pause(5, now)
+    assert bucket.reserve(1, now) == pytest.approx(5.0)
+    assert bucket.wait_for(1, now + 2) == pytest.approx(3.0)
+
+
+def test_reserve_and_cancel_round_trip():
+    limiter = KeyRateLimiter(requests_per_minute=60, tokens_per_minute=1000)
+    assert limiter.reserve(1000) == 0
+    assert limiter.headroom(500) > 0
+    limiter.cancel(1000)
+    assert limiter.headroom(500) == 0
+
+
+def test_acquire_refuses_to_wait_past_the_deadline():
+    limiter = KeyRateLimiter(requests_per_minute=60, tokens_per_minute=600)
+    limiter.reserve(600)
+    with pytest.raises(DeadlineExceeded):
+        limiter.acquire(300, Deadline(1))
+    # The refused reservation was handed back
+    assert limiter.snapshot()["requests"]["remaining"] >= 58
+
+
+def test_penalize_pauses_both_buckets_for_retry_after():
+    limiter = KeyRateLimiter()
+    assert limiter.penalize({"retry-after-ms": "2500"}) == pytest.approx(2.5)
+    snapshot = limiter.snapshot()
+    assert 2.0 < snapshot["requests"]["paused_for"] <= 2.5
+    assert 2.0 < snapshot["tokens"]["paused_for"] <= 2.5
+
+
+def test_headers_set_the_limits_the_api_reports():
+    limiter = KeyRateLimiter(requests_per_minute=500, tokens_per_minute=200000)
+    limiter.update_from_headers(
+        {
+            "x-ratelimit-limit-requests": "100",
+            "x-ratelimit-remaining-requests": "10",
+            "x-ratelimit-limit-tokens": "5000",
+            "x-ratelimit-remaining-tokens": "0",
+            "x-ratelimit-reset-tokens": "6s",
+        }
+    )
+    snapshot = limiter.snapshot()
+    assert snapshot["requests"]["limit"] == 100
+    assert snapshot["requests"]["remaining"] == 10
+    assert snapshot["tokens"]["limit"] == 5000
+    assert snapshot["tokens"]["paused_for"] > 5
+
+
+def test_record_usage_corrects_the_estimate():
+    limiter = KeyRateLimiter(tokens_per_minute=1000)
+    limiter.reserve(800)
+    limiter.record_usage(800, 200)
+    assert limiter.snapshot()["tokens"]["remaining"] >= 799
+
+
+def test_registry_shares_a_limiter_per_key():
+    registry = RateLimiterRegistry()
+    assert registry.get("sk-a") is registry.get("sk-a")
+    assert registry.get("sk-a") is not registry.get("sk-b")
+
+
+def test_registry_evicts_idle_limiters_but_keeps_paused_ones():
+    registry = RateLimiterRegistry(idle_ttl=0.05)
+    idle = registry.get("sk-idle")
+    paused = registry.get("sk-paused")
+    paused.penalize({"retry-after": "5"})
+    time.sleep(0.1)
+    registry.evict_idle()
+    assert registry.get("sk-paused") is paused
+    assert registry.get("sk-idle") is not idle
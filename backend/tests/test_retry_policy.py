@@ -0,0 +1,76 @@
+import httpx
+import openai
+import pytest
+
+from deadline import Deadline, DeadlineExceeded
+from retry_policy import (
+    MalformedResponseError,
+    RetryPolicy,
+    classify_batch_error,
+    classify_error,
+)
+
+REQUEST = httpx.Request("POST", "https://api.openai.com")
+
+
+def rate_limit_error(message="Rate limit reached"):
+    response = httpx.Response(429, request=REQUEST)
+    return openai.RateLimitError(message, response=response, body=None)
+
+
+def test_classify_transient_and_fatal_errors():
+    assert classify_error(openai.APITimeoutError(REQUEST)) == "timeout"
+    assert classify_error(rate_limit_error()) == "rate_limited"
+    assert classify_error(MalformedResponseError("no array")) == "malformed_response"
+    assert classify_error(rate_limit_error("insufficient_quota")) is None
+    assert classify_error(ValueError("bug")) is None
+
+
+def test_batches_leave_rate_limits_to_the_limiter():
+    assert classify_batch_error(rate_limit_error()) is None
+    assert classify_batch_error(openai.APITimeoutError(REQUEST)) == "timeout"
+
+
+def test_call_retries_transient_failures_until_success():
+    outcomes = [openai.APITimeoutError(REQUEST), MalformedResponseError("x"), "ok"]
+    retries = []
+
+    def attempt():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    policy = RetryPolicy(max_attempts=3, base_delay=0)
+    result = policy.call(attempt, on_retry=lambda n, reason, e: retries.append(reason))
+    assert result == "ok"
+    assert retries == ["timeout", "malformed_response"]
+
+
+def test_call_gives_up_after_max_attempts_or_on_fatal_errors():
+    calls = []
+
+    def attempt():
+        calls.append(1)
+        raise openai.APITimeoutError(REQUEST)
+
+    with pytest.raises(openai.APITimeoutError):
+        RetryPolicy(max_attempts=2, base_delay=0).call(attempt)
+    assert len(calls) == 2
+
+    def fatal():
+        calls.append(1)
+        raise ValueError("bug")
+
+    with pytest.raises(ValueError):
+        RetryPolicy(max_attempts=5, base_delay=0).call(fatal)
+    assert len(calls) == 3
+
+
+def test_call_does_not_back_off_past_the_deadline():
+    def attempt():
+        raise openai.APITimeoutError(REQUEST)
+
+    policy = RetryPolicy(max_attempts=3, base_delay=10, jitter=0)
+    with pytest.raises(DeadlineExceeded):
+        policy.call(attempt, deadline=Deadline(1))
@@ -0,0 +1,63 @@
+import json
+
+from streaming import JSONArrayStream
+
+
+def feed_all(parser, text, chunk_size):
+    elements = []
+    for start in range(0, len(text), chunk_size):
+        elements.extend(parser.feed(text[start : start + chunk_size]))
+    return elements
+
+
+def test_elements_arrive_as_they_close_whatever_the_chunking():
+    cards = [{"slot_id": f"CW{i:02d}", "name": f"Card {i}"} for i in range(5)]
+    text = json.dumps(cards)
+    for chunk_size in (1, 3, 17, len(text)):
+        parser = JSONArrayStream()
+        assert feed_all(parser, text, chunk_size) == list(enumerate(cards))
+        assert parser.closed
+        assert parser.errors == 0
+
+
+def test_element_is_returned_only_once_complete():
+    parser = JSONArrayStream()
+    assert parser.feed('[{"slot_id": "CW01", "name": "Half') == []
+    assert parser.feed('"}, {"slot_id"') == [(0, {"slot_id": "CW01", "name": "Half"})]
+    assert parser.feed(': "CW02"}]') == [(1, {"slot_id": "CW02"})]
+    assert parser.closed
+
+
+def test_cards_wrapper_object_and_surrounding_prose_are_skipped():
+    parser = JSONArrayStream()
+    text = 'Here you go:\n```json\n{"cards": [{"slot_id": "CU01"}]}\n```'
+    assert parser.feed(text) == [(0, {"slot_id": "CU01"})]
+    assert parser.closed
+
+
+def test_brackets_and_escaped_quotes_inside_strings():
+    card = {"rules_text": 'Counter target spell. [Draw] {T}: say "hi\\"]"'}
+    parser = JSONArrayStream()
+    assert parser.feed(json.dumps([card, {"name": "x"}])) == [
+        (0, card),
+        (1, {"name": "x"}),
+    ]
+
+
+def test_undecodable_element_is_counted_and_skipped():
+    parser = JSONArrayStream()
+    elements = parser.feed('[{"name": "ok"}, {"name": bad}, {"name": "also ok"}]')
+    assert elements == [(0, {"name": "ok"}), (2, {"name": "also ok"})]
+    assert parser.errors == 1
+
+
+def test_text_after_the_array_is_ignored():
+    parser = JSONArrayStream()
+    assert parser.feed('[{"a": 1}] [{"b": 2}]') == [(0, {"a": 1})]
+    assert parser.feed('[{"c": 3}]') == []
+
+
+def test_unterminated_array_is_not_closed():
+    parser = JSONArrayStream()
+    assert parser.feed('[{"a": 1}, {"b":') == [(0, {"a": 1})]
+    assert parser.started and not parser.closed
@@ -0,0 +1,236 @@
+"""
+Token-budget batch packing: per-slot prompt/completion estimates and max_tokens
+"""
+
+import json
+import logging
+import os
+import threading
+
+try:
+    import tiktoken
+except ImportError:  # Optional; fall back to a character-based estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# (context window, maximum completion tokens) per model
+MODEL_TOKEN_LIMITS = {
+    "gpt-4o-mini": (128000, 16384),
+    "gpt-4o": (128000, 4096),
+    "gpt-4-turbo": (128000, 4096),
+    "gpt-4": (8192, 8192),
+    "gpt-3.5-turbo": (16385, 4096),
+}
+DEFAULT_TOKEN_LIMITS = (8192, 4096)
+
+# Share of a model's completion limit a packed batch is planned to use
+BUDGET_FRACTION = float(os.getenv("MTG_BATCH_TOKEN_BUDGET_FRACTION", "0.8"))
+# Optional absolute cap on the completion tokens planned for one batch
+MAX_BATCH_COMPLETION_TOKENS = int(os.getenv("MTG_BATCH_TOKEN_BUDGET", "0"))
+# max_tokens is set to the completion estimate times this, plus a fixed slack
+MAX_TOKENS_MARGIN = float(os.getenv("MTG_MAX_TOKENS_MARGIN", "1.5"))
+MAX_TOKENS_SLACK = 100
+
+# Starting completion tokens per card before any output has been observed
+RARITY_OUTPUT_TOKENS = {"common": 110, "uncommon": 140, "rare": 180, "mythic": 220}
+KIND_OUTPUT_ADJUSTMENT = {
+    "creature": 0,
+    "spell": -10,
+    "multicolor": 30,
+    "planeswalker": 120,
+    "colorless": 0,
+    "lands": -30,
+}
+# Weight of each newly observed card in the per-rarity/type averages
+OUTPUT_STATS_ALPHA = 0.2
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def _encoding_for(model):
+    """tiktoken encoding for a model, or None if tiktoken isn't usable"""
+    if tiktoken is None:
+        return None
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                # Encodings are downloaded on first use; work offline too
+                logger.warning(f"tiktoken unavailable, estimating tokens: {e}")
+                _encodings[model] = None
+        return _encodings[model]
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    """Count tokens with the local tokenizer, or estimate at ~4 chars per token"""
+    encoding = _encoding_for(model)
+    if encoding is None:
+        return max(1, len(text or "") // 4)
+    return len(encoding.encode(text or "", disallowed_special=()))
+
+
+def warm_up_encodings(models=("gpt-4o-mini",)):
+    """Load each model's encoding at startup so no request waits on a download.
+
+    Returns whether token counts are exact; if tiktoken or an encoding is
+    unavailable, counting falls back to the character estimate for good.
+    """
+    exact = True
+    for model in dict.fromkeys(models):
+        exact = _encoding_for(model) is not None and exact
+    if exact:
+        logger.info(f"Loaded tiktoken encodings for {', '.join(models)}")
+    else:
+        logger.warning("Token counts are estimated from text length")
+    return exact
+
+
+def normalize_rarity(rarity):
+    """Map skeleton rarity sections such as 'uncommon_signposts' to a rarity"""
+    rarity = (rarity or "").lower()
+    for name in ("mythic", "uncommon", "rare", "common"):
+        if name in rarity:
+            return name
+    return "common"
+
+
+def slot_kind(color, slot_data):
+    """Coarse slot type used to bucket output-size statistics"""
+    if color in ("multicolor", "colorless", "lands"):
+        return color
+    slot_type = slot_data.get("type")
+    if slot_type == "planeswalker":
+        return "planeswalker"
+    # Creature slots in the skeleton carry no type; spell slots do
+    return "spell" if slot_type else "creature"
+
+
+class TokenBudgetPlanner:
+    """Pack skeleton slots into batches that fit a per-model token budget.
+
+    Completion size per slot comes from running averages of the cards
+    actually generated for each (rarity, slot type), so mythic multicolor
+    slots take more of a batch's budget than vanilla common creatures.
+    """
+
+    def __init__(
+        self,
+        budget_fraction=BUDGET_FRACTION,
+        max_batch_completion_tokens=MAX_BATCH_COMPLETION_TOKENS,
+        max_tokens_margin=MAX_TOKENS_MARGIN,
+    ):
+        self.budget_fraction = budget_fraction
+        self.max_batch_completion_tokens = max_batch_completion_tokens
+        self.max_tokens_margin = max_tokens_margin
+        self._output_tokens = {}  # (rarity, kind) -> average completion tokens
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, request):
+        color, rarity, _, slot_data = request
+        return normalize_rarity(rarity), slot_kind(color, slot_data)
+
+    def estimate_completion(self, request):
+        """Expected completion tokens for one slot"""
+        bucket = self._bucket(request)
+        with self._lock:
+            average = self._output_tokens.get(bucket)
+        if average is not None:
+            return int(average)
+        rarity, kind = bucket
+        return RARITY_OUTPUT_TOKENS[rarity] + KIND_OUTPUT_ADJUSTMENT.get(kind, 0)
+
+    def estimate_batch_completion(self, card_requests):
+        """Expected completion tokens for a batch of slots"""
+        return sum(self.estimate_completion(request) for request in card_requests)
+
+    def record_cards(self, card_requests, cards, model="gpt-4o-mini"):
+        """Update the per-rarity/type output averages from generated cards"""
+        for request in card_requests:
+            card = cards.get(request[2])
+            if not card:
+                continue
+            card_text = json.dumps(
+                {k: v for k, v in card.items() if k != "generated_for_theme"},
+                ensure_ascii=False,
+            )
+            tokens = count_tokens(card_text, model)
+            bucket = self._bucket(request)
+            with self._lock:
+                average = self._output_tokens.get(bucket)
+                self._output_tokens[bucket] = (
+                    tokens
+                    if average is None
+                    else average + OUTPUT_STATS_ALPHA * (tokens - average)
+                )
+                self._samples[bucket] = self._samples.get(bucket, 0) + 1
+
+    def completion_budget(self, model):
+        """Completion tokens a packed batch may plan to use on this model"""
+        _, max_output = MODEL_TOKEN_LIMITS.get(model, DEFAULT_TOKEN_LIMITS)
+        budget = int(max_output * self.budget_fraction)
+        if self.max_batch_completion_tokens > 0:
+            budget = min(budget, self.max_batch_completion_tokens)
+        return budget
+
+    def max_tokens_for(self, model, expected_completion, prompt_tokens=0):
+        """max_tokens for a call: the estimate plus margin, within model limits"""
+        context_window, max_output = MODEL_TOKEN_LIMITS.get(model, DEFAULT_TOKEN_LIMITS)
+        max_tokens = int(expected_completion * self.max_tokens_margin)
+        max_tokens += MAX_TOKENS_SLACK
+        return max(1, min(max_tokens, max_output, context_window - prompt_tokens))
+
+    def fit(self, candidates, model, max_cards, slot_prompt_tokens, base_prompt_tokens):
+        """How many leading candidate slots fit in one batch.
+
+        Slots are counted in order while the batch stays within max_cards,
+        the model's completion budget and its context window; a batch always
+        gets at least one slot. Returns (count, prompt tokens, completion tokens).
+        """
+        context_window, _ = MODEL_TOKEN_LIMITS.get(model, DEFAULT_TOKEN_LIMITS)
+        completion_budget = self.completion_budget(model)
+        count = 0
+        prompt_tokens = base_prompt_tokens
+        completion_tokens = 0
+        for request in candidates:
+            if count >= max_cards:
+                break
+            next_prompt = prompt_tokens + slot_prompt_tokens(request)
+            next_completion = completion_tokens + self.estimate_completion(request)
+            fits = next_completion <= completion_budget and (
+                next_prompt + next_completion * self.max_tokens_margin <= context_window
+            )
+            if count and not fits:
+                break
+            count += 1
+            prompt_tokens, completion_tokens = next_prompt, next_completion
+        return count, prompt_tokens, completion_tokens
+
+    def snapshot(self):
+        """Observed completion tokens per (rarity, slot type) for monitoring"""
+        with self._lock:
+            return {
+                f"{rarity}/{kind}": {
+                    "completion_tokens": round(average, 1),
+                    "samples": self._samples.get((rarity, kind), 0),
+                }
+                for (rarity, kind), average in self._output_tokens.items()
+            }
+
+
+_default_planner = None
+_default_planner_lock = threading.Lock()
+
+
+def get_token_budget_planner():
+    """Get the process-wide token budget planner, creating it on first use"""
+    global _default_planner
+    with _default_planner_lock:
+        if _default_planner is None:
+            _default_planner = TokenBudgetPlanner()
+        return _default_planner